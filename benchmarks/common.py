@@ -0,0 +1,80 @@
+"""Shared helpers for the plone.caching benchmarks."""
+
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+import io
+import time
+import tracemalloc
+
+
+class Event:
+    """Stands in for the ZPublisher events passed to the hooks."""
+
+    def __init__(self, request=None, response=None):
+        self.request = request
+        self.response = response
+
+
+def makeRequest(published, method="GET", path="/plone/front-page"):
+    """Create a ZPublisher request for ``published``."""
+
+    environ = {
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "8080",
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+    }
+    response = HTTPResponse()
+    request = HTTPRequest(io.BytesIO(), environ, response)
+    request["PUBLISHED"] = published
+    return request
+
+
+def measure(func, makeRequests, repeat):
+    """Return the best time, in nanoseconds per request, of calling ``func``
+    for each of the requests returned by ``makeRequests()``, ``repeat``
+    times.
+
+    Requests are created afresh (and untimed) for each repetition, since the
+    hooks store state on the request and response.
+    """
+
+    best = None
+    for i in range(repeat):
+        requests = makeRequests()
+        start = time.perf_counter_ns()
+        for request in requests:
+            func(request)
+        elapsed = time.perf_counter_ns() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / len(requests)
+
+
+def measureAllocations(func, requests):
+    """Return the average number of bytes and memory blocks allocated while
+    calling ``func`` for each of ``requests``, as traced by ``tracemalloc``.
+
+    The bytes are the peak traced memory during each call, i.e. including
+    temporary objects. The blocks are those still alive after each call.
+    """
+
+    tracemalloc.start()
+    try:
+        totalBytes = 0
+        totalBlocks = 0
+        for request in requests:
+            before = tracemalloc.take_snapshot()
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            func(request)
+            totalBytes += tracemalloc.get_traced_memory()[1] - current
+            after = tracemalloc.take_snapshot()
+            totalBlocks += sum(
+                stat.count_diff for stat in after.compare_to(before, "filename")
+            )
+    finally:
+        tracemalloc.stop()
+
+    return totalBytes / len(requests), totalBlocks / len(requests)
@@ -0,0 +1,88 @@
+"""Measure the cost of the plone.caching publisher hooks when caching is
+globally disabled.
+
+For each simulated request, the ``intercept``, ``MutatorTransform.mutate``
+and ``modifyStreamingResponse`` hooks are called, as they would be by
+ZPublisher and plone.transformchain. The result is compared to a baseline
+loop that creates the same request and events without calling any hooks,
+i.e. as if plone.caching were not installed.
+
+Run with::
+
+    python benchmarks/disabled.py [--requests N] [--repeat N]
+"""
+
+from common import Event
+from common import makeRequest
+from common import measure
+from plone.caching.hooks import intercept
+from plone.caching.hooks import modifyStreamingResponse
+from plone.caching.hooks import MutatorTransform
+from plone.caching.interfaces import ICacheSettings
+from plone.caching.lookup import DefaultRulesetLookup
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.globalrequest import clearRequest
+from zope.globalrequest import setRequest
+
+import argparse
+
+
+class View:
+    pass
+
+
+def setUp():
+    provideAdapter(persistentFieldAdapter)
+    provideAdapter(DefaultRulesetLookup)
+
+    registry = Registry()
+    registry.registerInterface(ICacheSettings)
+    settings = registry.forInterface(ICacheSettings)
+    settings.enabled = False
+    settings.operationMapping = {"testrule": "op1"}
+    provideUtility(registry, IRegistry)
+
+
+def baseline(request):
+    setRequest(request)
+    Event(request=request)
+    Event(response=request.response)
+    clearRequest()
+
+
+def hooks(request):
+    setRequest(request)
+    intercept(Event(request=request))
+    modifyStreamingResponse(Event(response=request.response))
+    MutatorTransform(request["PUBLISHED"], request).mutate()
+    clearRequest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    setUp()
+
+    # Requests are created up front, so that their (comparatively large)
+    # construction cost does not drown out the cost of the hooks
+    def makeRequests():
+        return [makeRequest(View()) for i in range(args.requests)]
+
+    results = {}
+    for name, func in (("baseline", baseline), ("disabled", hooks)):
+        results[name] = measure(func, makeRequests, args.repeat)
+        print(f"{name:10} {results[name]:10.0f} ns/request")
+
+    overhead = results["disabled"] - results["baseline"]
+    print(f"{'overhead':10} {overhead:10.0f} ns/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Micro-benchmarks for the plone.caching publish path.
+
+Drives the ``intercept``, ``MutatorTransform.mutate`` and (optionally)
+``modifyStreamingResponse`` hooks with ZPublisher requests and responses, an
+in-memory ``plone.registry.Registry``, and a configurable number of rules,
+operations, chained operations and options per operation. For each scenario,
+the time (ns/request) and memory allocated (bytes and surviving blocks per
+request, traced with ``tracemalloc``) are reported.
+
+Scenarios:
+
+disabled
+    Caching is globally disabled.
+unmatched
+    Caching is enabled, but no rule matches the published object.
+operation
+    Each rule is mapped to a single operation.
+chain
+    Each rule is mapped to a chain of ``--chain`` operations.
+
+Results can be saved as JSON and compared with a previous run, or with
+another checkout of plone.caching, which is imported from its ``src``
+directory in a subprocess running this same script::
+
+    python benchmarks/hooks.py --save before.json
+    python benchmarks/hooks.py --compare before.json
+    python benchmarks/hooks.py --checkout ../plone.caching-main
+
+or, through tox::
+
+    tox -e benchmark -- --checkout ../plone.caching-main
+"""
+
+from common import Event
+from common import makeRequest
+from common import measure
+from common import measureAllocations
+from plone.caching.hooks import intercept
+from plone.caching.hooks import modifyStreamingResponse
+from plone.caching.hooks import MutatorTransform
+from plone.caching.interfaces import ICacheSettings
+from plone.caching.interfaces import ICachingOperation
+from plone.caching.interfaces import ICachingOperationType
+from plone.caching.lookup import DefaultRulesetLookup
+from plone.caching.operations import Chain
+from plone.caching.utils import lookupOptions
+from plone.registry import field
+from plone.registry import Record
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from z3c.caching.registry import getGlobalRulesetRegistry
+from z3c.caching.registry import RulesetRegistry
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.globalrequest import clearRequest
+from zope.globalrequest import setRequest
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.interface import provider
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import z3c.caching.registry
+import zope.component.testing
+
+SCENARIOS = ("disabled", "unmatched", "operation", "chain")
+CHAIN = "plone.caching.operations.chain"
+
+
+class UnmatchedView:
+    pass
+
+
+def makeOperation(name, optionNames):
+    @implementer(ICachingOperation)
+    @adapter(Interface, Interface)
+    @provider(ICachingOperationType)
+    class BenchmarkOperation:
+        title = name
+        description = ""
+        prefix = name
+        options = optionNames
+
+        def __init__(self, published, request):
+            self.published = published
+            self.request = request
+
+        def interceptResponse(self, rulename, response):
+            lookupOptions(self.__class__, rulename)
+            return None
+
+        def modifyResponse(self, rulename, response):
+            options = lookupOptions(self.__class__, rulename)
+            response.setHeader("X-Benchmark", options[self.options[0]])
+
+    return BenchmarkOperation
+
+
+def setUp(scenario, args):
+    """Configure the component and plone.registry registries for the given
+    scenario. Returns a list of published object classes to cycle through.
+    """
+
+    zope.component.testing.setUp()
+    provideAdapter(persistentFieldAdapter)
+    provideAdapter(RulesetRegistry)
+    provideAdapter(DefaultRulesetLookup)
+    getGlobalRulesetRegistry().explicit = False
+
+    registry = Registry()
+    provideUtility(registry, IRegistry)
+    registry.registerInterface(ICacheSettings)
+    settings = registry.forInterface(ICacheSettings)
+    settings.enabled = scenario != "disabled"
+
+    provideAdapter(Chain, name=CHAIN)
+    provideUtility(Chain, name=CHAIN)
+
+    optionNames = tuple(f"option{i}" for i in range(max(args.options, 1)))
+    operations = []
+    for i in range(args.operations):
+        name = f"benchmark.operation{i}"
+        operation = makeOperation(name, optionNames)
+        provideAdapter(operation, name=name)
+        provideUtility(operation, ICachingOperationType, name=name)
+        for option in optionNames:
+            registry.records[f"{name}.{option}"] = Record(field.TextLine(), option)
+        operations.append(name)
+
+    mapping = {}
+    views = []
+    for i in range(args.rules):
+        rule = f"benchmark.rule{i}"
+        view = type(f"View{i}", (), {})
+        z3c.caching.registry.register(view, rule)
+        views.append(view)
+
+        if scenario == "chain":
+            mapping[rule] = CHAIN
+            chained = [operations[(i + j) % len(operations)] for j in range(args.chain)]
+            registry.records[f"{CHAIN}.{rule}.operations"] = Record(
+                field.List(value_type=field.TextLine()), chained
+            )
+        else:
+            mapping[rule] = operations[i % len(operations)]
+
+            # Override half of the options per rule
+            for option in optionNames[::2]:
+                registry.records[f"{mapping[rule]}.{rule}.{option}"] = Record(
+                    field.TextLine(), rule
+                )
+
+    settings.operationMapping = mapping
+
+    if scenario == "unmatched":
+        return [UnmatchedView]
+    return views
+
+
+def tearDown():
+    clearRequest()
+    zope.component.testing.tearDown()
+
+
+def makePublishFunction(streaming):
+    def publish(request):
+        setRequest(request)
+        try:
+            intercept(Event(request=request))
+            if streaming:
+                modifyStreamingResponse(Event(response=request.response))
+            MutatorTransform(request["PUBLISHED"], request).transformBytes(b"", "utf-8")
+        finally:
+            clearRequest()
+
+    return publish
+
+
+def run(args):
+    publish = makePublishFunction(args.streaming)
+    results = {}
+
+    for scenario in args.scenarios:
+        views = setUp(scenario, args)
+        try:
+
+            def makeRequests():
+                return [
+                    makeRequest(views[i % len(views)]()) for i in range(args.requests)
+                ]
+
+            # Warm up caches
+            for request in makeRequests():
+                publish(request)
+
+            ns = measure(publish, makeRequests, args.repeat)
+            allocated, blocks = measureAllocations(
+                publish, makeRequests()[: args.allocation_requests]
+            )
+        finally:
+            tearDown()
+
+        results[scenario] = {"ns": ns, "bytes": allocated, "blocks": blocks}
+
+    return results
+
+
+def report(results, baseline=None):
+    header = f"{'scenario':12} {'ns/request':>12} {'bytes/request':>14} {'blocks':>8}"
+    if baseline is not None:
+        header += f" {'time':>8} {'bytes':>8}"
+    print(header)
+
+    for scenario, result in results.items():
+        line = (
+            f"{scenario:12} {result['ns']:12.0f} {result['bytes']:14.0f} "
+            f"{result['blocks']:8.1f}"
+        )
+        if baseline is not None and scenario in baseline:
+            line += f" {_delta(baseline[scenario]['ns'], result['ns']):>8}"
+            line += f" {_delta(baseline[scenario]['bytes'], result['bytes']):>8}"
+        print(line)
+
+
+def _delta(before, after):
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def runCheckout(checkout, argv):
+    """Run this script against another checkout of plone.caching, returning
+    its results.
+    """
+
+    src = os.path.join(os.path.abspath(checkout), "src")
+    if not os.path.isdir(os.path.join(src, "plone", "caching")):
+        raise SystemExit(f"{checkout} is not a plone.caching checkout")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "results.json")
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+        subprocess.run(
+            [sys.executable, __file__, "--quiet", "--save", output] + argv,
+            env=env,
+            check=True,
+        )
+        with open(output) as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--rules", type=int, default=10)
+    parser.add_argument("--operations", type=int, default=5)
+    parser.add_argument("--chain", type=int, default=3)
+    parser.add_argument("--options", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--allocation-requests", type=int, default=200)
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument(
+        "--scenario",
+        dest="scenarios",
+        action="append",
+        choices=SCENARIOS,
+        help="scenario to run (may be repeated; default: all)",
+    )
+    parser.add_argument("--save", metavar="FILE", help="save results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare with results")
+    parser.add_argument(
+        "--checkout", metavar="PATH", help="compare with another checkout"
+    )
+    parser.add_argument("--quiet", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    args.operations = max(args.operations, 1)
+
+    baseline = None
+    if args.checkout:
+        argv = [
+            arg
+            for arg in sys.argv[1:]
+            if arg not in (args.checkout, "--checkout", args.save, "--save")
+        ]
+        print(f"Running against {args.checkout}...")
+        baseline = runCheckout(args.checkout, argv)
+        report(baseline)
+        print()
+    elif args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run(args)
+
+    if not args.quiet:
+        import plone.caching
+
+        print(f"plone.caching from {os.path.dirname(plone.caching.__file__)}")
+        report(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Compare intercepting a response with an exception with intercepting it
+without one.
+
+exception
+    What plone.caching does. ``intercept`` raises ``Intercepted`` after
+    traversal, and ZPublisher renders the ``index.html`` view of the
+    exception, as ``ZPublisher.WSGIPublisher`` does, and aborts the
+    transaction.
+direct
+    A prototype of an exception-free path, run as a ZPublisher post-traversal
+    hook. ``interceptDirect`` returns an ``InterceptorResponse``, which
+    ZPublisher publishes in place of the traversed object with ``mapply()``,
+    and commits the (empty) transaction.
+direct-abort
+    As ``direct``, but the transaction is aborted instead, as it would be if
+    the hook doomed it.
+
+Each path is measured from the end of traversal to the response body being
+set. A single caching operation is mapped to the published object, which
+intercepts with a ``304`` response or serves a 2 KiB cached body. In
+ZPublisher, the exception unwinds through more frames than here, so its cost
+is, if anything, understated.
+
+The direct path was not adopted: it gave no net speed-up (see the README).
+Run with::
+
+    python benchmarks/interception.py [--requests N] [--repeat N]
+"""
+
+from common import Event
+from common import makeRequest
+from common import measure
+from plone.caching.hooks import intercept
+from plone.caching.hooks import Intercepted
+from plone.caching.hooks import InterceptorResponse
+from plone.caching.interfaces import ICacheSettings
+from plone.caching.interfaces import ICachingOperation
+from plone.caching.interfaces import X_CACHE_OPERATION_HEADER
+from plone.caching.interfaces import X_CACHE_RULE_HEADER
+from plone.caching.lookup import DefaultRulesetLookup
+from plone.caching.stats import statistics
+from plone.caching.timing import queryTimer
+from plone.caching.utils import findOperation
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.transformchain.interfaces import DISABLE_TRANSFORM_REQUEST_KEY
+from time import perf_counter
+from z3c.caching.registry import getGlobalRulesetRegistry
+from z3c.caching.registry import RulesetRegistry
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.interface import implementer
+from zope.interface import Interface
+from ZPublisher.mapply import mapply
+from ZPublisher.WSGIPublisher import _exc_view_created_response
+from ZPublisher.WSGIPublisher import call_object
+from ZPublisher.WSGIPublisher import dont_publish_class
+from ZPublisher.WSGIPublisher import missing_name
+
+import argparse
+import gc
+import logging
+import sys
+import transaction
+import z3c.caching.registry
+import zope.component.testing
+
+PATHS = ("exception", "direct", "direct-abort")
+RESPONSES = ("304", "hit")
+
+logger = logging.getLogger("plone.caching")
+
+CACHED = b"<html><body>" + b"x" * 2048 + b"</body></html>"
+
+
+class View:
+    pass
+
+
+class Root:
+    pass
+
+
+@implementer(ICachingOperation)
+@adapter(Interface, Interface)
+class Operation:
+    response = "304"
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def interceptResponse(self, rulename, response):
+        if self.response == "304":
+            response.setStatus(304)
+            return ""
+        response.setHeader("Content-Type", "text/html")
+        return CACHED
+
+    def modifyResponse(self, rulename, response):
+        pass
+
+
+def interceptDirect(request):
+    """Do what ``intercept`` does, but return the view to publish instead of
+    raising ``Intercepted``.
+    """
+
+    rule, operationName, operation = findOperation(request)
+    if rule is None:
+        return None
+
+    published = request.get("PUBLISHED", None)
+    request.response.setHeader(X_CACHE_RULE_HEADER, rule)
+    logger.debug(
+        "Published: %s Ruleset: %s Operation: %s", repr(published), rule, operation
+    )
+    if operation is None:
+        return None
+
+    start = perf_counter()
+    responseBody = operation.interceptResponse(rule, request.response)
+    statistics.observe("intercept", operationName, perf_counter() - start)
+    timer = queryTimer(request)
+    if timer is not None:
+        timer.record("caching-intercept", start, operationName)
+    if responseBody is None:
+        statistics.increment("operations", operationName, "notIntercepted")
+        return None
+
+    statistics.increment("operations", operationName, "intercepted")
+    request.response.setHeader(X_CACHE_OPERATION_HEADER, operationName)
+    if DISABLE_TRANSFORM_REQUEST_KEY not in request.environ:
+        request.environ[DISABLE_TRANSFORM_REQUEST_KEY] = True
+    status = request.response.getStatus()
+    if status:
+        request.response.setStatus(status, lock=True)
+    if timer is not None:
+        timer.finish(request, request.response)
+    return InterceptorResponse(Intercepted(status, responseBody), request)
+
+
+def publishException(request):
+    response = request.response
+    try:
+        intercept(Event(request=request))
+    except Intercepted as exc:
+        # As ZPublisher.WSGIPublisher.transaction_pubevents does
+        exc_info = sys.exc_info()
+        transaction.abort()
+        _exc_view_created_response(exc, request, response)
+        del exc_info
+
+
+def publishDirect(request, end=transaction.commit):
+    response = request.response
+    published = interceptDirect(request)
+    # As ZPublisher.WSGIPublisher.publish does
+    result = mapply(
+        published,
+        request.args,
+        request,
+        call_object,
+        1,
+        missing_name,
+        dont_publish_class,
+        request,
+        bind=1,
+    )
+    if result is not response:
+        response.setBody(result)
+    end()
+
+
+def publishDirectAbort(request):
+    publishDirect(request, transaction.abort)
+
+
+PUBLISHERS = {
+    "exception": publishException,
+    "direct": publishDirect,
+    "direct-abort": publishDirectAbort,
+}
+
+
+def setUp():
+    zope.component.testing.setUp()
+    provideAdapter(persistentFieldAdapter)
+    provideAdapter(RulesetRegistry)
+    provideAdapter(DefaultRulesetLookup)
+    getGlobalRulesetRegistry().explicit = False
+
+    registry = Registry()
+    provideUtility(registry, IRegistry)
+    registry.registerInterface(ICacheSettings)
+    settings = registry.forInterface(ICacheSettings)
+    settings.enabled = True
+    z3c.caching.registry.register(View, "benchmark.rule")
+    settings.operationMapping = {"benchmark.rule": "benchmark.operation"}
+    provideAdapter(Operation, name="benchmark.operation")
+    provideAdapter(
+        InterceptorResponse, (Intercepted, Interface), Interface, name="index.html"
+    )
+
+
+def makeRequests(count):
+    requests = []
+    for i in range(count):
+        request = makeRequest(View())
+        request["PARENTS"] = [Root()]
+        requests.append(request)
+    return requests
+
+
+def run(args):
+    results = dict.fromkeys(
+        ((path, kind) for path in PATHS for kind in RESPONSES), None
+    )
+    setUp()
+    gc.disable()
+    try:
+        for kind in RESPONSES:
+            Operation.response = kind
+            for path in PATHS:
+                # Warm up caches
+                for request in makeRequests(100):
+                    PUBLISHERS[path](request)
+
+            # Interleave the paths, so that they are equally affected by any
+            # change in the load of the machine
+            for i in range(args.repeat):
+                for path in PATHS:
+                    elapsed = measure(
+                        PUBLISHERS[path], lambda: makeRequests(args.requests), 1
+                    )
+                    best = results[path, kind]
+                    if best is None or elapsed < best:
+                        results[path, kind] = elapsed
+                    gc.collect()
+    finally:
+        gc.enable()
+        zope.component.testing.tearDown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args)
+
+    print(f"{'response':8} " + " ".join(f"{path:>13}" for path in PATHS))
+    for kind in RESPONSES:
+        exception = results["exception", kind]
+        cells = [f"{exception:13.0f}"]
+        for path in PATHS[1:]:
+            change = (results[path, kind] - exception) / exception * 100
+            cells.append(f"{change:+12.1f}%")
+        print(f"{kind:8} " + " ".join(cells))
+    print("(ns/request for exception, change for the others)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Compare the two ways of running the mutation phase of plone.caching.
+
+transform
+    ``MutatorTransform`` is registered as a plone.transformchain transform,
+    the default. The chain runs for every response to call it.
+event
+    The ``plone-caching-event-mutation`` ZCML feature is provided, so no
+    transform is registered and ``modifyResponseBeforeCommit`` is notified
+    after the (empty) transform chain instead.
+
+Each path is measured as ZPublisher drives it before commit, i.e. calling
+plone.transformchain's ``applyTransformOnSuccess`` handler, then, for the
+event path, the plone.caching handler. A single caching operation setting a
+header is mapped to the published object. Responses have a small or a large
+HTML body, or a stream iterator body.
+
+Run with::
+
+    python benchmarks/mutation.py [--requests N] [--repeat N] [--large BYTES]
+"""
+
+from common import Event
+from common import makeRequest
+from common import measure
+from plone.caching.hooks import modifyResponseBeforeCommit
+from plone.caching.hooks import MutatorTransform
+from plone.caching.interfaces import ICacheSettings
+from plone.caching.interfaces import ICachingOperation
+from plone.caching.lookup import DefaultRulesetLookup
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.transformchain.transformer import Transformer
+from plone.transformchain.zpublisher import applyTransformOnSuccess
+from z3c.caching.registry import getGlobalRulesetRegistry
+from z3c.caching.registry import RulesetRegistry
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.interface import implementer
+from zope.interface import Interface
+from ZPublisher.Iterators import IStreamIterator
+
+import argparse
+import z3c.caching.registry
+import zope.component.testing
+
+PATHS = ("transform", "event")
+BODIES = ("small", "large", "stream")
+
+
+class View:
+    pass
+
+
+@implementer(ICachingOperation)
+@adapter(Interface, Interface)
+class Operation:
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def interceptResponse(self, rulename, response):
+        return None
+
+    def modifyResponse(self, rulename, response):
+        response.setHeader("Cache-Control", "max-age=60")
+
+
+@implementer(IStreamIterator)
+class StreamIterator:
+    """In-memory stand-in for a ``filestream_iterator``."""
+
+    def __init__(self, data, chunk=65536):
+        self.data = data
+        self.chunk = chunk
+
+    def __iter__(self):
+        for start in range(0, len(self.data), self.chunk):
+            yield self.data[start : start + self.chunk]
+
+    def __len__(self):
+        return len(self.data)
+
+
+def setUp(path):
+    zope.component.testing.setUp()
+    provideAdapter(persistentFieldAdapter)
+    provideAdapter(RulesetRegistry)
+    provideAdapter(DefaultRulesetLookup)
+    getGlobalRulesetRegistry().explicit = False
+
+    registry = Registry()
+    provideUtility(registry, IRegistry)
+    registry.registerInterface(ICacheSettings)
+    settings = registry.forInterface(ICacheSettings)
+    settings.enabled = True
+    z3c.caching.registry.register(View, "benchmark.rule")
+    settings.operationMapping = {"benchmark.rule": "benchmark.operation"}
+    provideAdapter(Operation, name="benchmark.operation")
+
+    provideUtility(Transformer())
+    if path == "transform":
+        provideAdapter(MutatorTransform, name="plone.caching.mutator")
+
+        def publish(request):
+            applyTransformOnSuccess(Event(request=request))
+
+    else:
+
+        def publish(request):
+            event = Event(request=request)
+            applyTransformOnSuccess(event)
+            modifyResponseBeforeCommit(event)
+
+    return publish
+
+
+def makeBody(kind, args):
+    if kind == "small":
+        return b"<html><body>" + b"x" * 2048 + b"</body></html>"
+    data = b"<html><body>" + b"x" * args.large + b"</body></html>"
+    if kind == "stream":
+        return StreamIterator(data)
+    return data
+
+
+def run(args):
+    results = {}
+    for path in PATHS:
+        publish = setUp(path)
+        try:
+            for kind in BODIES:
+                body = makeBody(kind, args)
+
+                def makeRequests():
+                    requests = []
+                    for i in range(args.requests):
+                        request = makeRequest(View())
+                        request.response.setHeader("Content-Type", "text/html")
+                        # As set by ZPublisher, without the cost of setBody()
+                        request.response.body = body
+                        requests.append(request)
+                    return requests
+
+                # Warm up caches
+                for request in makeRequests()[:100]:
+                    publish(request)
+
+                results[path, kind] = measure(publish, makeRequests, args.repeat)
+        finally:
+            zope.component.testing.tearDown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--large", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    results = run(args)
+
+    print(f"{'body':8} {'transform':>12} {'event':>12} {'change':>8}")
+    for kind in BODIES:
+        transform = results["transform", kind]
+        event = results["event", kind]
+        change = (event - transform) / transform * 100
+        print(f"{kind:8} {transform:12.0f} {event:12.0f} {change:+7.1f}%")
+    print("(ns/request)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+Response caching operations compute their keys with named ``ICacheKey`` adapters, selected per rule with the ``cacheKey`` option, and add the request headers a key depends on to the ``Vary`` header.
@@ -0,0 +1,5 @@
+Compile the ``Chain`` operation per rule and published object/request
+specification: the child operation adapter factories and the
+``X-Cache-Chain-Operations`` header values are looked up once and reused
+until the ``operations`` option or the operation registrations change, or
+for at most a minute, for changes made by other ZEO clients.
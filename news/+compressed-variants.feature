@@ -0,0 +1 @@
+Response caching operations can store pre-compressed ``gzip`` and ``deflate`` variants of responses with the ``compress`` option, and serve them according to ``Accept-Encoding``.
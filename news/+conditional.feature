@@ -0,0 +1 @@
+Add a ``plone.caching.operations.conditional`` operation, which sets ``ETag`` and ``Last-Modified`` headers from pluggable ``IETagValue`` components and answers matching conditional requests with ``304 Not Modified``.
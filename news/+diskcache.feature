@@ -0,0 +1 @@
+Add a ``plone.caching.operations.diskcache`` operation, which stores large response bodies in content-addressed files and serves them as file stream iterators.
@@ -0,0 +1 @@
+Add an ``IPubBeforeCommit`` handler running the mutation phase outside of plone.transformchain, selected with the ``plone-caching-event-mutation`` ZCML feature, and a benchmark comparing both.
@@ -0,0 +1,5 @@
+Return from the publisher hooks before any registry or component lookup when
+caching is globally disabled, and add the optional ``cacheableMethods``,
+``ignoredPathPrefixes`` and ``ignoredPathSegments`` settings to exclude
+requests from caching. Add ``benchmarks/disabled.py`` to measure the cost of
+the hooks when caching is disabled.
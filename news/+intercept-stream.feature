@@ -0,0 +1 @@
+Responses intercepted with a stream iterator, file or memoryview body are sent without reading the body into memory as a whole.
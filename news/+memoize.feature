@@ -0,0 +1,3 @@
+Memoize the result of ``findOperation()`` on the request, so that the
+intercept, mutate and streaming hooks only resolve the caching rule and
+operation once per request.
@@ -0,0 +1,4 @@
+Cache the options resolved by ``lookupOptions()`` and ``lookupOption()`` per
+operation prefix and rule. Records under an operation's prefix are read in a
+single pass (see the new ``prefetchOptions()`` helper), and the cache is
+invalidated when a record under that prefix changes.
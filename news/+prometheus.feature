@@ -0,0 +1 @@
+Add a ``@@caching-metrics`` view exposing the caching statistics, including latency histograms for the intercept and modify phases, in the Prometheus text format.
@@ -0,0 +1 @@
+Purge caching proxies after successful commits, in batches sent from background threads over persistent connections, with retries and metrics.
@@ -0,0 +1 @@
+Add a ``plone.caching.operations.ramcache`` operation, which stores rendered responses in an in-process LRU store and serves them without rendering.
@@ -0,0 +1 @@
+Answer ``Range`` and ``If-Range`` requests from the response caches with ``206`` responses, including ``multipart/byteranges``, reading only the requested ranges of bodies stored on disk.
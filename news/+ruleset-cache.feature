@@ -0,0 +1,5 @@
+Cache rulesets in the default ``IRulesetLookup`` by the interfaces provided
+by the published object. The cache is cleared when rulesets are registered or
+unregistered, and at least every minute, for changes made by other ZEO
+clients. Published objects whose ruleset depends on instance state can
+opt out by providing the new ``IVolatileRuleset`` marker interface.
@@ -0,0 +1,4 @@
+Add optional ``Server-Timing`` header and log instrumentation of the ruleset
+lookup, operation lookup, ``interceptResponse()`` and ``modifyResponse()``
+phases, including each operation in a chain. Enable it with the new
+``serverTiming`` and ``logTiming`` settings.
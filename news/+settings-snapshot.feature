@@ -0,0 +1,4 @@
+Read ``ICacheSettings`` from an immutable, process-wide snapshot instead of
+calling ``registry.forInterface()`` on every request. The snapshot is rebuilt
+when an ``ICacheSettings`` record changes, and at least every
+``SETTINGS_MAX_AGE`` seconds to pick up changes made by other ZEO clients.
@@ -0,0 +1 @@
+Add a ``plone.caching.operations.sharedmemorycache`` operation, which stores rendered responses in a shared memory segment used by all Zope processes on a host.
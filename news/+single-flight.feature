@@ -0,0 +1 @@
+Response caching operations can coalesce concurrent misses with the ``singleFlight`` option, so that one request renders the page and the others wait for its result.
@@ -0,0 +1 @@
+Response caching operations can serve expired responses for a ``staleWhileRevalidate`` window while they are refreshed in a background thread, re-publishing the URL as the same user.
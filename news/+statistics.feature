@@ -0,0 +1 @@
+Count requests per rule and intercepted/modified responses per operation in an ``ICachingStatistics`` utility.
@@ -0,0 +1 @@
+Store bodies sent as stream iterators or written with ``response.write()`` in the response caches as they are sent, up to the new ``maxStreamSize`` option, writing them straight to disk for the disk cache.
@@ -0,0 +1 @@
+Add a ``plone.caching.operations.surrogatekeys`` operation setting ``Surrogate-Key`` and ``xkey`` headers from ``ICacheTags`` adapters, and invalidate responses stored in the RAM cache by tag.
@@ -0,0 +1,197 @@
+from plone.caching.interfaces import ICacheKey
+from zope.component import adapter
+from zope.component import queryMultiAdapter
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.interface import providedBy
+
+import hashlib
+
+# Maximum number of request interface specifications to keep layer names
+# for. The cache is simply cleared when it grows beyond this size.
+LAYERS_CACHE_SIZE = 100
+
+# Maps a request interface specification to the names of its layers
+_layersCache = {}
+
+# Name of the request attribute holding the memoised cache keys for the
+# request, as a tuple ``(published, keys)``, where ``keys`` maps the name of
+# an ``ICacheKey`` adapter to a tuple ``(key, vary)``.
+_MEMO_KEY = "_plone_caching_cachekey"
+
+
+def hashKey(parts):
+    """Return a compact key for a sequence of strings."""
+    data = "\0".join(parts).encode("utf-8", "surrogateescape")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def layerNames(request):
+    """Return a string identifying the interfaces, such as browser layers,
+    provided by the request. This is computed once per specification.
+    """
+
+    spec = providedBy(request)
+    names = _layersCache.get(spec)
+    if names is None:
+        names = " ".join(iface.__identifier__ for iface in spec.__iro__)
+        if len(_layersCache) >= LAYERS_CACHE_SIZE:
+            _layersCache.clear()
+        _layersCache[spec] = names
+    return names
+
+
+def getCacheKey(published, request, name):
+    """Return a tuple ``(key, vary)`` of the key computed by the named
+    ``ICacheKey`` adapter and the request headers it depends on. The key is
+    None if there is no such adapter or the response should not be cached.
+
+    The key is computed at most once per request.
+    """
+
+    memo = request.__dict__.get(_MEMO_KEY)
+    if memo is None or memo[0] is not published:
+        memo = (published, {})
+        try:
+            setattr(request, _MEMO_KEY, memo)
+        except AttributeError:
+            pass
+
+    keys = memo[1]
+    try:
+        return keys[name]
+    except KeyError:
+        pass
+
+    builder = queryMultiAdapter((published, request), ICacheKey, name=name)
+    if builder is None:
+        result = (None, ())
+    else:
+        result = (builder(), tuple(builder.vary))
+    keys[name] = result
+    return result
+
+
+def addVary(response, names):
+    """Add the given header names to the ``Vary`` header of the response,
+    unless already listed.
+    """
+
+    if not names:
+        return
+    existing = response.getHeader("Vary")
+    vary = mergeVary(existing, names)
+    if vary != existing:
+        response.setHeader("Vary", vary)
+
+
+def mergeVary(value, names):
+    """Return the ``Vary`` header value ``value`` (which may be None) with
+    the given header names added, unless already listed.
+    """
+
+    if not names:
+        return value
+    if not value:
+        return ", ".join(names)
+    listed = {token.strip().lower() for token in value.split(",")}
+    if "*" in listed:
+        return value
+    missing = [name for name in names if name.lower() not in listed]
+    if not missing:
+        return value
+    return ", ".join([value] + missing)
+
+
+@implementer(ICacheKey)
+@adapter(Interface, Interface)
+class CacheKey:
+    """Cache key built from the URL and declared facets of the request.
+
+    Subclasses declare the facets the key depends on with these attributes:
+
+    ``query``
+        Include the query string (the default).
+    ``headers``
+        Names of request headers to include.
+    ``cookies``
+        Names of cookies to include.
+    ``language``
+        Include the negotiated language.
+    ``layers``
+        Include the interfaces provided by the request, such as the theme
+        or skin layers.
+
+    Each facet is read individually, so computing the key does not copy the
+    request headers or cookies.
+    """
+
+    query = True
+    headers = ()
+    cookies = ()
+    language = False
+    layers = False
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    @property
+    def vary(self):
+        vary = tuple(self.headers)
+        if self.cookies:
+            vary += ("Cookie",)
+        if self.language:
+            vary += ("Accept-Language",)
+        return vary
+
+    def __call__(self):
+        request = self.request
+        url = request.get("ACTUAL_URL", None)
+        if url is None:
+            return None
+
+        parts = [url]
+        if self.query:
+            environ = getattr(request, "environ", None) or {}
+            parts.append(environ.get("QUERY_STRING", ""))
+        for name in self.headers:
+            parts.append(request.getHeader(name) or "")
+        if self.cookies:
+            cookies = getattr(request, "cookies", None) or {}
+            for name in self.cookies:
+                parts.append(cookies.get(name) or "")
+        if self.language:
+            parts.append(request.get("LANGUAGE", None) or "")
+        if self.layers:
+            parts.append(layerNames(request))
+        return hashKey(parts)
+
+
+class LanguageCacheKey(CacheKey):
+    """Cache key varying on the URL and the negotiated language."""
+
+    language = True
+
+
+class LayersCacheKey(CacheKey):
+    """Cache key varying on the URL, the negotiated language and the layers
+    provided by the request, e.g. for sites with several themes.
+    """
+
+    language = True
+    layers = True
+
+
+def clearLayersCache():
+    """Clear the cache of request layer names."""
+    _layersCache.clear()
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(clearLayersCache)
+    del addCleanUp
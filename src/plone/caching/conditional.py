@@ -0,0 +1,267 @@
+from AccessControl import getSecurityManager
+from Acquisition import aq_base
+from Acquisition import aq_get
+from datetime import datetime
+from datetime import timezone
+from email.utils import format_datetime
+from email.utils import parsedate_to_datetime
+from plone.caching.interfaces import _
+from plone.caching.interfaces import ICachingOperation
+from plone.caching.interfaces import ICachingOperationType
+from plone.caching.interfaces import IETagValue
+from plone.caching.interfaces import ILastModified
+from plone.caching.utils import lookupOptions
+from zope.component import adapter
+from zope.component import queryAdapter
+from zope.component import queryMultiAdapter
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.interface import provider
+
+# Name of the request attribute holding the memoised ETag component values
+# and modification time for the request, as a tuple ``(published, values)``.
+_MEMO_KEY = "_plone_caching_conditional"
+
+_lastModifiedKey = object()
+
+
+def _memo(published, request):
+    memo = request.__dict__.get(_MEMO_KEY)
+    if memo is not None and memo[0] is published:
+        return memo[1]
+    values = {}
+    try:
+        setattr(request, _MEMO_KEY, (published, values))
+    except AttributeError:
+        pass
+    return values
+
+
+def getETagValue(published, request, name):
+    """Return the value of the named ``IETagValue`` component for the
+    published object and request, or None if there is no such component.
+
+    The value is computed at most once per request.
+    """
+
+    memo = _memo(published, request)
+    try:
+        return memo[name]
+    except KeyError:
+        pass
+
+    component = queryMultiAdapter((published, request), IETagValue, name=name)
+    value = component() if component is not None else None
+    memo[name] = value
+    return value
+
+
+def getLastModified(published, request):
+    """Return the modification time of the published object as a timezone
+    aware ``datetime``, truncated to seconds, or None if unknown.
+
+    The value is computed at most once per request.
+    """
+
+    memo = _memo(published, request)
+    try:
+        return memo[_lastModifiedKey]
+    except KeyError:
+        pass
+
+    value = None
+    adapted = queryAdapter(published, ILastModified)
+    if adapted is not None:
+        value = adapted()
+        if value is not None:
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            value = value.replace(microsecond=0)
+
+    memo[_lastModifiedKey] = value
+    return value
+
+
+def getETag(published, request, names):
+    """Return the ETag, including quotes, built from the named ``IETagValue``
+    components, or None if ``names`` is empty or none of the components has a
+    value.
+    """
+
+    if not names:
+        return None
+    values = [getETagValue(published, request, name) or "" for name in names]
+    if not any(values):
+        # An ETag with no varying part would match every version of the page
+        return None
+    return '"{}"'.format("|".join(values).replace('"', ""))
+
+
+def _etagMatches(etag, header):
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _notModifiedSince(lastModified, header):
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError, IndexError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return lastModified <= since
+
+
+@implementer(ICachingOperation)
+@provider(ICachingOperationType)
+@adapter(Interface, Interface)
+class ConditionalResponse:
+    """Caching operation which sets ``ETag`` and ``Last-Modified`` headers,
+    and answers conditional requests with a ``304 Not Modified`` response
+    when they match.
+
+    The ETag is built from the ``IETagValue`` components named in the
+    ``etags`` option. ``Last-Modified`` is set from the ``ILastModified``
+    adapter of the published object if the ``lastModified`` option is set.
+    Component values are computed once per request, and shared by both
+    phases.
+    """
+
+    title = _("Conditional requests")
+    description = _(
+        "Sets ETag and Last-Modified headers, and sends 304 Not Modified "
+        "responses to matching conditional requests"
+    )
+    prefix = "plone.caching.operations.conditional"
+    options = ("etags", "lastModified")
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def interceptResponse(self, rulename, response):
+        request = self.request
+        environ = getattr(request, "environ", None) or {}
+        if environ.get("REQUEST_METHOD", "GET") not in ("GET", "HEAD"):
+            return None
+
+        ifNoneMatch = request.getHeader("If-None-Match")
+        ifModifiedSince = request.getHeader("If-Modified-Since")
+        if not ifNoneMatch and not ifModifiedSince:
+            return None
+
+        options = lookupOptions(self.__class__, rulename)
+        etag = getETag(self.published, request, options["etags"])
+        lastModified = None
+        if options["lastModified"]:
+            lastModified = getLastModified(self.published, request)
+
+        # If-Modified-Since is ignored if If-None-Match is present
+        if ifNoneMatch:
+            if etag is None or not _etagMatches(etag, ifNoneMatch):
+                return None
+        elif lastModified is None or not _notModifiedSince(
+            lastModified, ifModifiedSince
+        ):
+            return None
+
+        response.setStatus(304)
+        self.setHeaders(response, etag, lastModified)
+        return ""
+
+    def modifyResponse(self, rulename, response):
+        options = lookupOptions(self.__class__, rulename)
+        etag = getETag(self.published, self.request, options["etags"])
+        lastModified = None
+        if options["lastModified"]:
+            lastModified = getLastModified(self.published, self.request)
+        self.setHeaders(response, etag, lastModified)
+
+    def setHeaders(self, response, etag, lastModified):
+        if etag is not None:
+            response.setHeader("ETag", etag)
+        if lastModified is not None:
+            response.setHeader(
+                "Last-Modified",
+                format_datetime(lastModified.astimezone(timezone.utc), usegmt=True),
+            )
+
+
+#
+# Default components
+#
+
+
+@implementer(ILastModified)
+@adapter(Interface)
+class PersistentLastModified:
+    """Modification time of a persistent published object, or of the context
+    of a published view or method, from its ZODB transaction time.
+    """
+
+    def __init__(self, published):
+        self.published = published
+
+    def __call__(self):
+        obj = getattr(self.published, "__self__", self.published)
+        obj = getattr(obj, "context", obj)
+        mtime = getattr(aq_base(obj), "_p_mtime", None)
+        if mtime is None:
+            return None
+        return datetime.fromtimestamp(mtime, timezone.utc)
+
+
+@implementer(IETagValue)
+@adapter(Interface, Interface)
+class BaseETagValue:
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+
+class UserID(BaseETagValue):
+    """The id of the current user, empty for anonymous users."""
+
+    def __call__(self):
+        user = getSecurityManager().getUser()
+        return (user.getId() if user is not None else None) or ""
+
+
+class Language(BaseETagValue):
+    """The negotiated language, or the ``Accept-Language`` header."""
+
+    def __call__(self):
+        return self.request.get("LANGUAGE", None) or (
+            self.request.getHeader("Accept-Language") or ""
+        )
+
+
+class LastModified(BaseETagValue):
+    """The modification time of the published object, as a timestamp."""
+
+    def __call__(self):
+        lastModified = getLastModified(self.published, self.request)
+        if lastModified is None:
+            return None
+        return str(int(lastModified.timestamp()))
+
+
+class CatalogCounter(BaseETagValue):
+    """The counter of the acquired ``portal_catalog``, which changes
+    whenever the catalog is updated.
+    """
+
+    def __call__(self):
+        obj = getattr(self.published, "__self__", self.published)
+        obj = getattr(obj, "context", obj)
+        catalog = aq_get(obj, "portal_catalog", None, 1)
+        if catalog is None or not hasattr(catalog, "getCounter"):
+            return None
+        return str(catalog.getCounter())
@@ -0,0 +1,326 @@
+from collections import OrderedDict
+from plone.caching.interfaces import ICacheWriter
+from plone.caching.interfaces import IStreamingCacheStore
+from plone.caching.stats import statistics
+from plone.caching.stores import CachedResponse
+from zope.interface import implementer
+from ZPublisher.Iterators import filestream_iterator
+
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+
+# Prefix of the temporary files bodies are written to
+_TEMPORARY_PREFIX = ".tmp"
+
+# Directories of this process, removed when it exits
+_processDirectories = set()
+_processDirectoriesLock = threading.Lock()
+
+
+def processDirectory(path):
+    """Return the subdirectory of ``path`` used by this process, so that
+    processes configured with the same directory do not remove or evict each
+    other's files. It is removed when the process exits.
+    """
+
+    pid = os.getpid()
+    directory = os.path.join(path, str(pid))
+    with _processDirectoriesLock:
+        if directory not in _processDirectories:
+            _processDirectories.add(directory)
+            atexit.register(_removeProcessDirectory, directory, pid)
+    return directory
+
+
+def _removeProcessDirectory(directory, pid):
+    # A forked child inherits the exit handlers of its parent
+    if os.getpid() == pid:
+        shutil.rmtree(directory, True)
+
+
+class _DiskEntry:
+    """Index entry for a response whose body is stored in a file."""
+
+    __slots__ = ("status", "headers", "digest", "size", "created")
+
+    def __init__(self, status, headers, digest, size, created):
+        self.status = status
+        self.headers = headers
+        self.digest = digest
+        self.size = size
+        self.created = created
+
+
+@implementer(IStreamingCacheStore)
+class DiskStore:
+    """Store keeping response bodies in files, and an index of the stored
+    responses in memory.
+
+    Bodies are stored content-addressed, in files named after their SHA-256
+    digest, so responses with identical bodies share a file. Files are
+    written to a temporary file and renamed into place, so a file is never
+    seen half written. The store is bounded by the total size of its files
+    and the number of entries, evicting the least recently used entries.
+
+    Bodies are returned as ``filestream_iterator`` objects, which ZPublisher
+    sends in chunks without reading the file into memory. Bodies written in
+    chunks with ``open()`` are written straight to the temporary file, so
+    they are never held in memory either.
+
+    Since the index is not persistent, each process keeps its files in a
+    subdirectory of the given directory named after its process id, and
+    removes it when it exits. Files left over in that subdirectory, by a
+    previous store or a crashed process with the same id, are removed when
+    the store is created; other subdirectories are left alone. The store
+    must not share a directory with other stores of the same process. If no
+    directory is given, a temporary directory is used and removed when the
+    store is garbage collected.
+    """
+
+    def __init__(
+        self,
+        name,
+        path=None,
+        maxSize=1024 * 1024 * 1024,
+        maxEntries=10000,
+        minSize=0,
+    ):
+        self.name = name
+        self.maxSize = maxSize
+        self.maxEntries = maxEntries
+        self.minSize = minSize
+        self.size = 0
+
+        if path is None:
+            path = tempfile.mkdtemp(prefix="plone.caching-")
+            self._finalizer = weakref.finalize(self, shutil.rmtree, path, True)
+        else:
+            path = processDirectory(path)
+            os.makedirs(path, exist_ok=True)
+            self._removeFiles(path)
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # digest -> number of entries using the file
+        self._references = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def filename(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            body = filestream_iterator(self.filename(entry.digest), "rb")
+        except OSError:
+            # The file was removed, e.g. by hand. Unless the entry has been
+            # replaced meanwhile, it is of no use any more.
+            self._discard(key, entry)
+            return None
+
+        return CachedResponse(
+            entry.status, entry.headers, body, entry.created, entry.size
+        )
+
+    def set(self, key, response):
+        body = response.body
+        size = len(body)
+        if size < self.minSize or size > self.maxSize:
+            return False
+
+        digest = hashlib.sha256(body).hexdigest()
+        filename = self.filename(digest)
+        if not os.path.exists(filename):
+            self._write(filename, body)
+
+        entry = _DiskEntry(
+            response.status, response.headers, digest, size, response.created
+        )
+        with self._lock:
+            if digest not in self._references and not os.path.exists(filename):
+                # Removed by another thread since we wrote it
+                self._write(filename, body)
+            evicted = self._add(key, entry)
+
+        if evicted:
+            statistics.increment("caches", self.name, "evictions", evicted)
+        return True
+
+    def open(self, key, status, headers, tags=()):
+        return _DiskWriter(self, key, status, headers)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._release(entry)
+
+    def _discard(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+                self._release(entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._references.clear()
+            self.size = 0
+            self._removeFiles(self.path)
+
+    def _write(self, filename, body):
+        directory = os.path.dirname(filename)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=_TEMPORARY_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(temporary, filename)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+
+    def _commit(self, key, entry, temporary):
+        # Moves a body written by a writer into place and indexes it
+        filename = self.filename(entry.digest)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with self._lock:
+            if os.path.exists(filename):
+                # Another response has the same body
+                os.unlink(temporary)
+            else:
+                os.replace(temporary, filename)
+            evicted = self._add(key, entry)
+
+        if evicted:
+            statistics.increment("caches", self.name, "evictions", evicted)
+
+    def _add(self, key, entry):
+        # Must be called with the lock held, once the file of the entry is in
+        # place. Returns the number of entries evicted.
+        previous = self._entries.pop(key, None)
+        self._entries[key] = entry
+        self._reference(entry.digest, entry.size)
+        if previous is not None:
+            self._release(previous)
+        return self._evict()
+
+    def _reference(self, digest, size):
+        # Must be called with the lock held
+        count = self._references.get(digest, 0)
+        if not count:
+            self.size += size
+        self._references[digest] = count + 1
+
+    def _release(self, entry):
+        # Must be called with the lock held. Removes the file once no entry
+        # uses it.
+        count = self._references[entry.digest] - 1
+        if count:
+            self._references[entry.digest] = count
+            return
+        del self._references[entry.digest]
+        self.size -= entry.size
+        try:
+            os.unlink(self.filename(entry.digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Must be called with the lock held
+        evicted = 0
+        entries = self._entries
+        while entries and (len(entries) > self.maxEntries or self.size > self.maxSize):
+            key, entry = entries.popitem(last=False)
+            self._release(entry)
+            evicted += 1
+        return evicted
+
+    def _removeFiles(self, path):
+        for name in os.listdir(path):
+            if len(name) == 2:
+                shutil.rmtree(os.path.join(path, name), True)
+            elif name.startswith(_TEMPORARY_PREFIX):
+                try:
+                    os.unlink(os.path.join(path, name))
+                except OSError:
+                    pass
+
+
+@implementer(ICacheWriter)
+class _DiskWriter:
+    """Writes a body to a temporary file in the directory of a
+    ``DiskStore``, computing its digest as it goes, and moves the file into
+    place when committed.
+    """
+
+    def __init__(self, store, key, status, headers):
+        self.store = store
+        self.key = key
+        self.status = status
+        self.headers = tuple(headers)
+        self.created = time.time()
+        self.size = 0
+        self._digest = hashlib.sha256()
+        fd, self._temporary = tempfile.mkstemp(dir=store.path, prefix=_TEMPORARY_PREFIX)
+        self._file = os.fdopen(fd, "wb")
+        # Removes the file if the writer is dropped without being committed
+        # or aborted
+        self._finalizer = weakref.finalize(self, _discard, self._file, self._temporary)
+
+    def write(self, data):
+        self._file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+
+    def commit(self):
+        if not self._finalizer.alive:
+            return False
+        self._file.close()
+        store = self.store
+        if self.size < store.minSize or self.size > store.maxSize:
+            self.abort()
+            return False
+
+        entry = _DiskEntry(
+            self.status,
+            self.headers,
+            self._digest.hexdigest(),
+            self.size,
+            self.created,
+        )
+        self._finalizer.detach()
+        try:
+            store._commit(self.key, entry, self._temporary)
+        except BaseException:
+            _discard(self._file, self._temporary)
+            raise
+        return True
+
+    def abort(self):
+        self._finalizer()
+
+
+def _discard(file, filename):
+    file.close()
+    try:
+        os.unlink(filename)
+    except OSError:
+        pass
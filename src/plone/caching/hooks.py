@@ -1,8 +1,15 @@
 from plone.caching.interfaces import X_CACHE_OPERATION_HEADER
 from plone.caching.interfaces import X_CACHE_RULE_HEADER
+from plone.caching.stats import statistics
+from plone.caching.streaming import publishableBody
+from plone.caching.timing import queryTimer
 from plone.caching.utils import findOperation
+from plone.caching.utils import getResponseStream
+from plone.caching.utils import setResponseBody
 from plone.transformchain.interfaces import DISABLE_TRANSFORM_REQUEST_KEY
 from plone.transformchain.interfaces import ITransform
+from plone.transformchain.zpublisher import isEvilWebDAVRequest
+from time import perf_counter
 from ZODB.POSException import ConflictError
 from zope.component import adapter
 from zope.globalrequest import getRequest
@@ -10,7 +17,10 @@ from zope.interface import alsoProvides
 from zope.interface import implementer
 from zope.interface import Interface
 from ZPublisher.interfaces import IPubAfterTraversal
+from ZPublisher.interfaces import IPubBeforeAbort
+from ZPublisher.interfaces import IPubBeforeCommit
 from ZPublisher.interfaces import IPubBeforeStreaming
+from ZPublisher.Iterators import IStreamIterator
 
 import logging
 
@@ -42,6 +52,10 @@ class Intercepted(Exception):
 class InterceptorResponse:
     """View for the Intercepted exception, serving to return an empty
     response in the case of an intercepted response.
+
+    Stream iterators, files and buffers returned by the operation are passed
+    on to ZPublisher without being read into memory, see
+    ``publishableBody()``.
     """
 
     def __init__(self, context, request):
@@ -49,7 +63,7 @@ class InterceptorResponse:
         self.request = request
 
     def __call__(self):
-        return self.context.responseBody
+        return publishableBody(self.context.responseBody)
 
 
 @adapter(IPubAfterTraversal)
@@ -65,21 +79,31 @@ def intercept(event):
 
     try:
         request = event.request
-        published = request.get("PUBLISHED", None)
         rule, operationName, operation = findOperation(request)
 
         if rule is None:
             return
 
+        published = request.get("PUBLISHED", None)
         request.response.setHeader(X_CACHE_RULE_HEADER, rule)
         logger.debug(
             "Published: %s Ruleset: %s Operation: %s", repr(published), rule, operation
         )
 
         if operation is not None:
+            start = perf_counter()
             responseBody = operation.interceptResponse(rule, request.response)
+            statistics.observe("intercept", operationName, perf_counter() - start)
+
+            timer = queryTimer(request)
+            if timer is not None:
+                timer.record("caching-intercept", start, operationName)
+
+            if responseBody is None:
+                statistics.increment("operations", operationName, "notIntercepted")
+            else:
+                statistics.increment("operations", operationName, "intercepted")
 
-            if responseBody is not None:
                 # Only put this in the response if the operation actually
                 # intercepted something
                 request.response.setHeader(X_CACHE_OPERATION_HEADER, operationName)
@@ -95,6 +119,9 @@ def intercept(event):
                 if status:
                     request.response.setStatus(status, lock=True)
 
+                if timer is not None:
+                    timer.finish(request, request.response)
+
                 raise Intercepted(status, responseBody)
 
     except ConflictError:
@@ -121,7 +148,11 @@ class MutatorTransform:
 
     This transformer is uncommon in that it doesn't actually change the
     response body. Instead, we look up caching operations which can modify
-    response headers and perform other caching functions.
+    response headers and perform other caching functions. The only exception
+    is a stream iterator body of known length, which an operation may wrap
+    with ``replaceResponseStream()``, e.g. to store it as it is sent. Unbound
+    stream iterators are left alone, since the transform chain would read a
+    replacement into a string.
     """
 
     order = 12000
@@ -131,19 +162,35 @@ class MutatorTransform:
         self.request = request
 
     def transformUnicode(self, result, encoding):
-        self.mutate()
+        self.mutate(result, encoding)
         return None
 
     def transformBytes(self, result, encoding):
-        self.mutate()
+        self.mutate(result, encoding)
         return None
 
     def transformIterable(self, result, encoding):
-        self.mutate()
+        stream = self.mutate(result, encoding)
+        # The transform chain reads any iterable other than a stream iterator
+        # of known length into a string
+        if IStreamIterator.providedBy(stream) and stream is not result:
+            return stream
         return None
 
-    def mutate(self):
+    def mutate(self, result=None, encoding=None):
+        """Invoke the modifyResponse() method of the caching operation, if
+        one can be found. Return the stream iterator body of the response
+        after it, if any.
+        """
+
         request = self.request
+        rule, operationName, operation = findOperation(request)
+
+        if rule is None:
+            return
+
+        if result is not None:
+            setResponseBody(request, result, encoding)
 
         # Abort if this was a streamed request handled by our event handler
         # below
@@ -151,11 +198,6 @@ class MutatorTransform:
             return
 
         published = request.get("PUBLISHED", None)
-        rule, operationName, operation = findOperation(request)
-
-        if rule is None:
-            return
-
         request.response.setHeader(X_CACHE_RULE_HEADER, rule)
         logger.debug(
             "Published: %s Ruleset: %s Operation: %s", repr(published), rule, operation
@@ -163,7 +205,78 @@ class MutatorTransform:
 
         if operation is not None:
             request.response.setHeader(X_CACHE_OPERATION_HEADER, operationName)
-            operation.modifyResponse(rule, request.response)
+            _modifyResponse(request, request.response, rule, operationName, operation)
+            return getResponseStream(request, request.response)
+
+
+# Hooks for the mutation phase bound to publisher events, registered instead
+# of the transform above if the ``plone-caching-event-mutation`` ZCML feature
+# is provided. They are registered after the handlers of the transform chain,
+# which ``configure.zcml`` includes first, so they are notified after it; the
+# order relative to other handlers of these events depends on the order their
+# packages are loaded in.
+
+
+@adapter(IPubBeforeCommit)
+def modifyResponseBeforeCommit(event):
+    """Invoke the modifyResponse() method of a caching operation, if one can
+    be found, before the transaction of a successful request is committed.
+
+    Unlike ``MutatorTransform``, this does not take part in the transform
+    chain, so sites using no other transforms do not run the chain at all.
+    It is notified after the transform chain has set the final body on the
+    response. Like the transform, it is skipped if transforms are disabled
+    for the request, e.g. because the response was intercepted, and for
+    WebDAV and other requests which are neither ``GET`` nor ``POST``.
+    """
+    _mutateOnEvent(event.request)
+
+
+@adapter(IPubBeforeAbort)
+def modifyResponseBeforeAbort(event):
+    """Invoke the modifyResponse() method of a caching operation for the
+    error response of a failed request, as the transform chain does, unless
+    the request will be retried.
+    """
+
+    if event.retry:
+        return
+    # The status is only set from the exception after the event, as in
+    # plone.transformchain
+    event.request.response.setStatus(event.exc_info[0])
+    _mutateOnEvent(event.request)
+
+
+def _mutateOnEvent(request):
+    try:
+        if request.environ.get(DISABLE_TRANSFORM_REQUEST_KEY, False):
+            return
+        if isEvilWebDAVRequest(request):
+            return
+        MutatorTransform(request.get("PUBLISHED", None), request).mutate()
+    except ConflictError:
+        raise
+    except Exception:
+        logging.exception(
+            "Swallowed exception in plone.caching publisher event handler"
+        )
+
+
+def _modifyResponse(request, response, rule, operationName, operation):
+    """Invoke the modifyResponse() method of the operation, recording it in
+    the statistics, and emitting the phase timings if timing is enabled.
+    """
+
+    statistics.increment("operations", operationName, "modified")
+
+    start = perf_counter()
+    operation.modifyResponse(rule, response)
+    statistics.observe("modify", operationName, perf_counter() - start)
+
+    timer = queryTimer(request)
+    if timer is not None:
+        timer.record("caching-modify", start, operationName)
+        timer.finish(request, response)
 
 
 # Hook for streaming responses - does not use plone.transformchain, since
@@ -184,17 +297,17 @@ def modifyStreamingResponse(event):
     if request is None:
         return
 
+    rule, operationName, operation = findOperation(request)
+
+    if rule is None:
+        return
+
     # Mark the response to allow us to avoid attempting a modify operation
     # again in the normal hook above
     alsoProvides(request, IStreamedResponse)
 
     published = request.get("PUBLISHED", None)
 
-    rule, operationName, operation = findOperation(request)
-
-    if rule is None:
-        return
-
     response.setHeader(X_CACHE_RULE_HEADER, rule)
     logger.debug(
         "Published: %s Ruleset: %s Operation: %s", repr(published), rule, operation
@@ -202,4 +315,4 @@ def modifyStreamingResponse(event):
 
     if operation is not None:
         response.setHeader(X_CACHE_OPERATION_HEADER, operationName)
-        operation.modifyResponse(rule, response)
+        _modifyResponse(request, response, rule, operationName, operation)
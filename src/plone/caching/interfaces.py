@@ -1,4 +1,5 @@
 from zope import schema
+from zope.interface import Attribute
 from zope.interface import Interface
 
 import zope.i18nmessageid
@@ -26,6 +27,162 @@ class ICacheSettings(Interface):
     )
 
 
+class IRequestFilterSettings(Interface):
+    """Optional settings found in plone.registry, excluding requests from
+    caching operations before any rule set or operation is looked up.
+
+    They are kept apart from ``ICacheSettings``, so that the records of
+    existing sites still match that interface. Missing records are treated
+    as unset.
+    """
+
+    cacheableMethods = schema.Tuple(
+        title=_("Cacheable request methods"),
+        description=_(
+            "If set, caching operations will only be attempted for requests "
+            "using one of these HTTP methods, e.g. GET and HEAD"
+        ),
+        value_type=schema.ASCIILine(title=_("Request method")),
+        required=False,
+    )
+
+    ignoredPathPrefixes = schema.Tuple(
+        title=_("Ignored path prefixes"),
+        description=_(
+            "No caching operations will be attempted for requests whose "
+            "path (before virtual hosting) starts with one of these prefixes"
+        ),
+        value_type=schema.TextLine(title=_("Path prefix")),
+        required=False,
+    )
+
+    ignoredPathSegments = schema.Tuple(
+        title=_("Ignored path segments"),
+        description=_(
+            "No caching operations will be attempted for requests whose "
+            "path contains one of these strings, e.g. ++resource++"
+        ),
+        value_type=schema.TextLine(title=_("Path segment")),
+        required=False,
+    )
+
+
+class ITimingSettings(Interface):
+    """Optional settings found in plone.registry, reporting the time spent
+    in caching. Like ``IRequestFilterSettings``, missing records are treated
+    as unset.
+    """
+
+    serverTiming = schema.Bool(
+        title=_("Emit Server-Timing header"),
+        description=_(
+            "If set, the time spent in ruleset lookup, operation lookup and "
+            "the caching operations is reported in a Server-Timing header"
+        ),
+        required=False,
+        default=False,
+    )
+
+    logTiming = schema.Bool(
+        title=_("Log caching phase timings"),
+        description=_(
+            "If set, the time spent in ruleset lookup, operation lookup and "
+            "the caching operations is logged for each request"
+        ),
+        required=False,
+        default=False,
+    )
+
+
+class IPurgingSettings(Interface):
+    """Settings for purging caching proxies, expected to be found in
+    plone.registry
+    """
+
+    enabled = schema.Bool(
+        title=_("Enable purging"),
+        description=_(
+            "If set, caching proxies are purged when content changes, after "
+            "the transaction is committed"
+        ),
+        default=False,
+    )
+
+    proxies = schema.Tuple(
+        title=_("Caching proxies"),
+        description=_(
+            "URLs of the caching proxies to send PURGE requests to, e.g. "
+            "http://localhost:6081"
+        ),
+        value_type=schema.ASCIILine(title=_("Proxy URL")),
+        required=False,
+        default=(),
+    )
+
+    threads = schema.Int(
+        title=_("Purge threads"),
+        description=_("Number of background threads sending PURGE requests"),
+        required=False,
+        default=2,
+    )
+
+    batchSize = schema.Int(
+        title=_("Batch size"),
+        description=_(
+            "Maximum number of paths sent to a proxy over one connection in " "one go"
+        ),
+        required=False,
+        default=50,
+    )
+
+    retries = schema.Int(
+        title=_("Retries"),
+        description=_("Number of times a failed purge is retried"),
+        required=False,
+        default=3,
+    )
+
+    backoff = schema.Float(
+        title=_("Retry backoff"),
+        description=_(
+            "Number of seconds to wait before the first retry, doubled for "
+            "each further retry"
+        ),
+        required=False,
+        default=1.0,
+    )
+
+    timeout = schema.Float(
+        title=_("Timeout"),
+        description=_("Socket timeout for PURGE requests, in seconds"),
+        required=False,
+        default=10.0,
+    )
+
+    virtualHosting = schema.Bool(
+        title=_("Virtual host rewriting"),
+        description=_(
+            "If set, purged paths are rewritten to VirtualHostMonster URLs "
+            "for the virtual host of the request that changed the content, "
+            "as the proxies pass them to Zope"
+        ),
+        required=False,
+        default=False,
+    )
+
+    domains = schema.Tuple(
+        title=_("Domains"),
+        description=_(
+            "Public URLs the site is served at, e.g. https://www.example.com. "
+            "Paths are purged for each, with its host in the Host header. If "
+            "empty, the URL of the request that changed the content is used"
+        ),
+        value_type=schema.ASCIILine(title=_("Domain URL")),
+        required=False,
+        default=(),
+    )
+
+
 #
 #  Cache operations
 #
@@ -45,8 +202,10 @@ class ICachingOperation(Interface):
         May modify the response if required, e.g. by setting headers.
 
         Return None if the request should *not* be interrupted. Otherwise,
-        return a new response body as a unicode string. For simple 304
-        responses, returning ``u""`` will suffice.
+        return a new response body as a unicode or byte string. For simple 304
+        responses, returning ``u""`` will suffice. Large bodies may be
+        returned as a stream iterator, a file or a memoryview, which are sent
+        without being read into memory as a whole.
 
         ``rulset`` is the name of the caching ruleset that was matched. It may
         be ``None``. ``response`` is the current HTTP response.
@@ -155,6 +314,207 @@ class ICachingOperationType(Interface):
     )
 
 
+#
+# Conditional requests
+#
+
+
+class IETagValue(Interface):
+    """A component of an ETag computed by the conditional request operation.
+
+    This is a named multi-adapter from the published object and the request.
+    The name is used to select components in the ``etags`` option.
+    """
+
+    def __call__():
+        """Return the value of the component as a string, or None."""
+
+
+class ILastModified(Interface):
+    """Adapter from a published object giving its modification time, used
+    for the ``Last-Modified`` header and ``If-Modified-Since`` checks.
+    """
+
+    def __call__():
+        """Return a ``datetime``, or None if unknown. Naive values are taken
+        to be in UTC.
+        """
+
+
+#
+# Response caching
+#
+
+
+class ICachedResponse(Interface):
+    """A response stored by a response caching operation."""
+
+    status = Attribute("The HTTP status code")
+    headers = Attribute("A tuple of ``(name, value)`` header pairs")
+    body = Attribute("The response body, as a byte string")
+    created = Attribute("The time the response was stored, as ``time.time()``")
+    tags = Attribute("A tuple of the cache tags of the response, possibly empty")
+
+
+class ICacheTags(Interface):
+    """Tags identifying the content a published object renders, e.g. the
+    UIDs of the items of a listing, used for ``Surrogate-Key`` headers and to
+    invalidate cached responses by tag.
+
+    This is a named adapter from the published object. The tags of all
+    adapters registered for an object are used. When content is purged, the
+    tags of its own adapters are invalidated.
+    """
+
+    def __call__():
+        """Return an iterable of tags, as strings without whitespace."""
+
+
+class ICacheKey(Interface):
+    """Computes the key under which a response caching operation stores the
+    response to a request.
+
+    This is a named multi-adapter from the published object and the request.
+    The name is selected with the ``cacheKey`` option of the operation.
+    """
+
+    vary = Attribute(
+        "Tuple of request header names the key depends on, emitted in the "
+        "Vary response header"
+    )
+
+    def __call__():
+        """Return the key as a string, or None if the response to the
+        request should not be cached.
+        """
+
+
+class ICacheStore(Interface):
+    """A bounded store of ``ICachedResponse`` objects, keyed by string.
+
+    Stores are shared between threads, and must be safe to use concurrently.
+    A store may evict entries at any time to stay within its bounds.
+    """
+
+    name = Attribute("The name of the store, used in statistics")
+
+    def get(key):
+        """Return the ``ICachedResponse`` stored under ``key``, or None."""
+
+    def set(key, response):
+        """Store an ``ICachedResponse`` under ``key``, replacing any existing
+        entry. Return True if it was stored, or False if it is too large for
+        the store.
+        """
+
+    def delete(key):
+        """Remove the entry stored under ``key``, if any."""
+
+    def clear():
+        """Remove all entries."""
+
+
+class ITaggedCacheStore(ICacheStore):
+    """A cache store keeping an index of the entries stored with each tag."""
+
+    def invalidateTags(tags):
+        """Remove all entries stored with any of the given tags, and return
+        the number of entries removed.
+        """
+
+
+class ICacheWriter(Interface):
+    """Stores a response whose body is written in chunks, as it is sent to
+    the client.
+    """
+
+    def write(data):
+        """Append a chunk of bytes to the body."""
+
+    def commit():
+        """Store the response with the body written so far. Return True if it
+        was stored, or False if it is too large for the store.
+        """
+
+    def abort():
+        """Discard the body written so far, without storing the response."""
+
+
+class IStreamingCacheStore(ICacheStore):
+    """A cache store which can store a body written in chunks without
+    holding it in memory.
+    """
+
+    def open(key, status, headers, tags=()):
+        """Return an ``ICacheWriter`` storing a response with the given
+        status, ``(name, value)`` header pairs and tags under ``key`` once it
+        is committed. Nothing is stored before then.
+        """
+
+
+#
+# Statistics
+#
+
+
+class ICachingStatistics(Interface):
+    """Utility holding runtime counters for caching rules and operations.
+
+    Counters are grouped in sections, keyed by rule name (as reported in the
+    ``X-Cache-Rule`` header) or operation name (as reported in the
+    ``X-Cache-Operation`` header). The hooks in this package record:
+
+    * in the ``rules`` section, ``requests`` (the rule matched a request)
+      and ``noOperation`` (no operation is mapped to the rule, or the mapped
+      operation could not be found);
+    * in the ``operations`` section, ``intercepted`` (``interceptResponse()``
+      returned a response), ``notIntercepted`` (it returned None) and
+      ``modified`` (``modifyResponse()`` was called);
+    * in the ``caches`` section, keyed by the name of the ``ICacheStore``,
+      ``hits``, ``misses``, ``stale`` (an expired response was served while
+      it is refreshed), ``refreshes`` (an expired response was rendered
+      again in the background), ``partial`` (a hit was answered with
+      ranges of the response), ``collapsed`` (a response was served
+      after waiting for another request to render it), ``flightTimeouts``
+      (waiting for another request timed out), ``stored``, ``evictions`` and
+      ``invalidations`` (entries removed by tag);
+    * in the ``purges`` section, keyed by caching proxy URL, ``purged``,
+      ``failed`` (a purge was given up after all retries), ``retried`` and
+      ``dropped`` (the dispatch queue was full).
+
+    Latency histograms are recorded per operation in the ``intercept`` and
+    ``modify`` sections, for the durations of ``interceptResponse()`` and
+    ``modifyResponse()`` respectively.
+    """
+
+    buckets = Attribute("Ascending tuple of histogram bucket upper bounds, in seconds")
+
+    def increment(section, name, counter, value=1):
+        """Add ``value`` to the given counter."""
+
+    def snapshot(reset=False):
+        """Return the current counters as a nested dictionary
+        ``{section: {name: {counter: value}}}``, omitting zero counters.
+
+        If ``reset`` is true, the counters are atomically reset to zero.
+        """
+
+    def observe(section, name, seconds):
+        """Record a duration in the given histogram."""
+
+    def histograms(reset=False):
+        """Return the current histograms as a nested dictionary
+        ``{section: {name: {"buckets": ..., "count": ..., "sum": ...}}}``.
+
+        ``buckets`` is a tuple of cumulative counts, one for each bound in
+        ``buckets`` followed by the total count. Empty histograms are
+        omitted. If ``reset`` is true, the histograms are atomically reset.
+        """
+
+    def reset():
+        """Reset all counters and histograms to zero."""
+
+
 #
 # Internal abstractions
 #
@@ -180,3 +540,13 @@ class IRulesetLookup(Interface):
 
         Returns a ruleset name (a string) or None.
         """
+
+
+class IVolatileRuleset(Interface):
+    """Marker interface for published objects whose caching ruleset depends
+    on instance state, rather than only on the interfaces they provide.
+
+    The default ``IRulesetLookup`` caches rulesets by the interfaces provided
+    by the published object. Objects providing this interface are always
+    looked up in full, as are objects of classes defining ``__conform__``.
+    """
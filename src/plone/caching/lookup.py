@@ -1,8 +1,34 @@
+from Acquisition import aq_base
 from plone.caching.interfaces import IRulesetLookup
+from plone.caching.interfaces import IVolatileRuleset
+from plone.caching.utils import ExpiringCache
+from z3c.caching.registry import ICacheRule
 from z3c.caching.registry import lookup
 from zope.component import adapter
+from zope.component import getSiteManager
 from zope.interface import implementer
 from zope.interface import Interface
+from zope.interface import providedBy
+from zope.interface.interfaces import IAdapterRegistration
+from zope.interface.interfaces import IRegistrationEvent
+
+import weakref
+
+# Maximum number of interface specifications to cache rulesets for, per site
+# manager. The cache is simply cleared when it grows beyond this size.
+RULESET_CACHE_SIZE = 1000
+
+_marker = object()
+_volatile = object()
+
+# Maps site managers to ``ExpiringCache`` dictionaries mapping the
+# ``providedBy()`` specification of a published object to its ruleset name
+# (or None), or to ``_volatile`` if the object opted out. Rulesets may be
+# registered locally, so they are cached per site manager. Local
+# registrations committed by other ZEO clients fire no events here, so the
+# caches expire after ``SETTINGS_MAX_AGE`` seconds.
+_rulesetCaches = weakref.WeakKeyDictionary()
+_lastSiteCache = (None, None)
 
 
 @implementer(IRulesetLookup)
@@ -12,6 +38,14 @@ class DefaultRulesetLookup:
 
     Only override this if you have very special needs. The safest option is
     to use ``z3c.caching`` to set rulesets.
+
+    Rulesets are cached by the current site manager and the interfaces
+    provided by the published object, and the cache is cleared when rulesets
+    are registered or unregistered in this process, and at least every
+    ``SETTINGS_MAX_AGE`` seconds. Published objects whose ruleset depends
+    on instance state can provide ``IVolatileRuleset`` to opt out. Objects
+    of classes defining ``__conform__`` are never cached either, since they
+    may adapt themselves to ``ICacheRule``.
     """
 
     def __init__(self, published, request):
@@ -19,4 +53,77 @@ class DefaultRulesetLookup:
         self.request = request
 
     def __call__(self):
-        return lookup(self.published)
+        published = self.published
+        cache = _getRulesetCache()
+        if cache is None:
+            return lookup(published)
+
+        spec = providedBy(published)
+        rule = cache.get(spec, _marker)
+        if rule is _marker:
+            if _isVolatile(published):
+                rule = _volatile
+            else:
+                rule = lookup(published)
+            if len(cache) >= RULESET_CACHE_SIZE:
+                cache.clear()
+            cache[spec] = rule
+
+        if rule is _volatile:
+            return lookup(published)
+
+        return rule
+
+
+def _isVolatile(published):
+    if IVolatileRuleset.providedBy(published):
+        return True
+    return getattr(type(aq_base(published)), "__conform__", None) is not None
+
+
+def _getRulesetCache():
+    global _lastSiteCache
+    sm = getSiteManager()
+
+    # Fast path: the same site as last time. This avoids the weak reference
+    # created by every WeakKeyDictionary lookup.
+    lastSite, cache = _lastSiteCache
+    if lastSite is sm:
+        cache.expire()
+        return cache
+
+    try:
+        cache = _rulesetCaches.get(sm)
+        if cache is None:
+            cache = _rulesetCaches.setdefault(sm, ExpiringCache())
+    except TypeError:
+        # Site managers which cannot be weakly referenced are not cached
+        return None
+    _lastSiteCache = (sm, cache)
+    cache.expire()
+    return cache
+
+
+def clearRulesetCache():
+    """Clear the cache of rulesets by interface specification."""
+    global _lastSiteCache
+    _lastSiteCache = (None, None)
+    _rulesetCaches.clear()
+
+
+@adapter(IAdapterRegistration, IRegistrationEvent)
+def rulesetRegistrationChanged(registration, event):
+    """Clear the ruleset cache when a ruleset is registered or unregistered
+    with a component registry.
+    """
+    if registration.provided is ICacheRule:
+        clearRulesetCache()
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(clearRulesetCache)
+    del addCleanUp
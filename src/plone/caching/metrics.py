@@ -0,0 +1,194 @@
+from plone.caching.stats import statistics
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (section, counter, metric name, help text) for the counters exposed
+_COUNTERS = (
+    (
+        "rules",
+        "requests",
+        "plone_caching_rule_requests_total",
+        "Requests matching a caching rule.",
+    ),
+    (
+        "rules",
+        "noOperation",
+        "plone_caching_rule_no_operation_total",
+        "Requests matching a caching rule with no operation.",
+    ),
+    (
+        "operations",
+        "intercepted",
+        "plone_caching_operation_intercepted_total",
+        "Responses intercepted by a caching operation.",
+    ),
+    (
+        "operations",
+        "notIntercepted",
+        "plone_caching_operation_not_intercepted_total",
+        "Requests not intercepted by a caching operation.",
+    ),
+    (
+        "operations",
+        "modified",
+        "plone_caching_operation_modified_total",
+        "Responses modified by a caching operation.",
+    ),
+    (
+        "caches",
+        "hits",
+        "plone_caching_cache_hits_total",
+        "Responses served from a response cache.",
+    ),
+    (
+        "caches",
+        "misses",
+        "plone_caching_cache_misses_total",
+        "Cacheable requests not found in a response cache.",
+    ),
+    (
+        "caches",
+        "stale",
+        "plone_caching_cache_stale_total",
+        "Expired responses served while they are refreshed.",
+    ),
+    (
+        "caches",
+        "refreshes",
+        "plone_caching_cache_refreshes_total",
+        "Expired responses rendered again in the background.",
+    ),
+    (
+        "caches",
+        "partial",
+        "plone_caching_cache_partial_total",
+        "Hits answered with the requested ranges of a cached response.",
+    ),
+    (
+        "caches",
+        "collapsed",
+        "plone_caching_cache_collapsed_total",
+        "Renders avoided by waiting for a concurrent request to render.",
+    ),
+    (
+        "caches",
+        "flightTimeouts",
+        "plone_caching_cache_flight_timeouts_total",
+        "Requests which timed out waiting for a concurrent render.",
+    ),
+    (
+        "caches",
+        "stored",
+        "plone_caching_cache_stored_total",
+        "Responses stored in a response cache.",
+    ),
+    (
+        "caches",
+        "evictions",
+        "plone_caching_cache_evictions_total",
+        "Responses evicted from a response cache to make room.",
+    ),
+    (
+        "caches",
+        "invalidations",
+        "plone_caching_cache_invalidations_total",
+        "Responses removed from a response cache by tag.",
+    ),
+    (
+        "purges",
+        "purged",
+        "plone_caching_purges_total",
+        "Paths purged from a caching proxy.",
+    ),
+    (
+        "purges",
+        "retried",
+        "plone_caching_purge_retries_total",
+        "Failed purges of a path scheduled for another attempt.",
+    ),
+    (
+        "purges",
+        "failed",
+        "plone_caching_purge_failures_total",
+        "Purges of a path given up after all retries.",
+    ),
+    (
+        "purges",
+        "dropped",
+        "plone_caching_purges_dropped_total",
+        "Purges of a path dropped because the dispatch queue was full.",
+    ),
+)
+
+# (section, metric name, help text) for the histograms exposed
+_HISTOGRAMS = (
+    (
+        "intercept",
+        "plone_caching_intercept_duration_seconds",
+        "Time spent in interceptResponse() of a caching operation.",
+    ),
+    (
+        "modify",
+        "plone_caching_modify_duration_seconds",
+        "Time spent in modifyResponse() of a caching operation.",
+    ),
+)
+
+_LABELS = {
+    "rules": "rule",
+    "operations": "operation",
+    "caches": "cache",
+    "purges": "proxy",
+    "intercept": "operation",
+    "modify": "operation",
+}
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def renderMetrics(stats=statistics):
+    """Render the counters and histograms of an ``ICachingStatistics``
+    utility in the Prometheus text exposition format.
+    """
+
+    counters = stats.snapshot()
+    histograms = stats.histograms()
+    bounds = [repr(bound) for bound in stats.buckets] + ["+Inf"]
+    lines = []
+
+    for section, counter, metric, help in _COUNTERS:
+        lines.append(f"# HELP {metric} {help}")
+        lines.append(f"# TYPE {metric} counter")
+        label = _LABELS[section]
+        for name, values in sorted(counters.get(section, {}).items()):
+            value = values.get(counter)
+            if value:
+                lines.append(f'{metric}{{{label}="{_escape(name)}"}} {value}')
+
+    for section, metric, help in _HISTOGRAMS:
+        lines.append(f"# HELP {metric} {help}")
+        lines.append(f"# TYPE {metric} histogram")
+        label = _LABELS[section]
+        for name, histogram in sorted(histograms.get(section, {}).items()):
+            labels = f'{label}="{_escape(name)}"'
+            for bound, value in zip(bounds, histogram["buckets"]):
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f"{metric}_sum{{{labels}}} {histogram['sum']!r}")
+            lines.append(f"{metric}_count{{{labels}}} {histogram['count']}")
+
+    lines.append("")
+    return "\n".join(lines)
+
+
+class MetricsView:
+    """View rendering the caching statistics for a Prometheus scraper."""
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+
+    def __call__(self):
+        self.request.response.setHeader("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        return renderMetrics()
@@ -1,12 +1,62 @@
 from plone.caching.interfaces import _
 from plone.caching.interfaces import ICachingOperation
 from plone.caching.interfaces import ICachingOperationType
+from plone.caching.timing import queryTimer
+from plone.caching.utils import ExpiringCache
 from plone.caching.utils import lookupOptions
+from time import perf_counter
 from zope.component import adapter
-from zope.component import queryMultiAdapter
+from zope.component import getSiteManager
 from zope.interface import implementer
 from zope.interface import Interface
+from zope.interface import providedBy
 from zope.interface import provider
+from zope.interface.interfaces import IAdapterRegistration
+from zope.interface.interfaces import IRegistrationEvent
+
+import weakref
+
+# Maximum number of compiled chains to keep per site manager. The cache is
+# simply cleared when it grows beyond this size.
+CHAIN_CACHE_SIZE = 1000
+
+# Maps site managers to ``ExpiringCache`` dictionaries mapping ``(rulename,
+# published spec, request spec)`` to a ``_CompiledChain``. Site managers are
+# weakly referenced, so that persistent ones do not keep their connection
+# alive. Local operation registrations committed by other ZEO clients fire no
+# events here, so the caches expire after ``SETTINGS_MAX_AGE`` seconds.
+_chainCaches = weakref.WeakKeyDictionary()
+_lastSiteCache = (None, None)
+
+
+class _CompiledChain:
+    """The child operation factories of a chain for a given rule and
+    published object/request specification, along with the precomputed
+    ``X-Cache-Chain-Operations`` header values.
+    """
+
+    __slots__ = ("operations", "names", "factories", "headers")
+
+    def __init__(self, operations, names, factories):
+        self.operations = operations
+        self.names = names
+        self.factories = factories
+        self.headers = tuple(
+            "; ".join(names[: index + 1]) for index in range(len(names))
+        )
+
+    def header(self, index, skipped=None):
+        """Return the ``X-Cache-Chain-Operations`` header value for the
+        operations up to and including ``index``, excluding the indexes in
+        ``skipped``.
+        """
+        if not skipped:
+            return self.headers[index]
+        return "; ".join(
+            name
+            for position, name in enumerate(self.names[: index + 1])
+            if position not in skipped
+        )
 
 
 @implementer(ICachingOperation)
@@ -25,6 +75,12 @@ class Chain:
     ``plone.caching.operations.chain.${rulename}.chain``.
 
     The option must be a sequence type (e.g. a ``Tuple``).
+
+    The chained operation adapter factories are looked up once per site
+    manager, rule and published object/request specification, and recompiled
+    when the value of the ``operations`` option changes, when operations are
+    registered or unregistered in this process, and at least every
+    ``SETTINGS_MAX_AGE`` seconds.
     """
 
     title = _("Chain")
@@ -37,40 +93,148 @@ class Chain:
         self.request = request
 
     def interceptResponse(self, rulename, response):
-        options = lookupOptions(self.__class__, rulename)
-
-        chained = []
-
-        if options["operations"]:
-            for name in options["operations"]:
-                operation = queryMultiAdapter(
-                    (self.published, self.request), ICachingOperation, name=name
+        chain = self.compile(rulename)
+        if chain is None:
+            return None
+
+        published = self.published
+        request = self.request
+        skipped = None
+
+        timer = queryTimer(request)
+
+        for index, factory in enumerate(chain.factories):
+            operation = factory(published, request)
+            if operation is None:
+                # The factory declined to adapt
+                skipped = (skipped or ()) + (index,)
+                continue
+
+            if timer is None:
+                value = operation.interceptResponse(rulename, response)
+            else:
+                start = perf_counter()
+                value = operation.interceptResponse(rulename, response)
+                timer.record(
+                    f"caching-chain-intercept-{index}", start, chain.names[index]
                 )
 
-                if operation is not None:
-                    chained.append(name)
-
-                    value = operation.interceptResponse(rulename, response)
-                    if value is not None:
-                        response.setHeader(
-                            "X-Cache-Chain-Operations", "; ".join(chained)
-                        )
-                        return value
+            if value is not None:
+                response.setHeader(
+                    "X-Cache-Chain-Operations", chain.header(index, skipped)
+                )
+                return value
 
     def modifyResponse(self, rulename, response):
-        options = lookupOptions(self.__class__, rulename)
+        chain = self.compile(rulename)
+        if chain is None:
+            return
+
+        published = self.published
+        request = self.request
+        skipped = None
+
+        timer = queryTimer(request)
+
+        for index, factory in enumerate(chain.factories):
+            operation = factory(published, request)
+            if operation is None:
+                skipped = (skipped or ()) + (index,)
+                continue
+
+            if timer is None:
+                operation.modifyResponse(rulename, response)
+            else:
+                start = perf_counter()
+                operation.modifyResponse(rulename, response)
+                timer.record(f"caching-chain-modify-{index}", start, chain.names[index])
+
+        if chain.factories:
+            header = chain.header(len(chain.factories) - 1, skipped)
+            if header:
+                response.setHeader("X-Cache-Chain-Operations", header)
+
+    def compile(self, rulename):
+        """Return the ``_CompiledChain`` for the given rule, or None if no
+        operations are configured.
+        """
 
-        chained = []
-
-        if options["operations"]:
-            for name in options["operations"]:
-                operation = queryMultiAdapter(
-                    (self.published, self.request), ICachingOperation, name=name
-                )
+        options = lookupOptions(self.__class__, rulename)
+        operations = options["operations"]
+        if not operations:
+            return None
+
+        sm = getSiteManager()
+        publishedSpec = providedBy(self.published)
+        requestSpec = providedBy(self.request)
+        key = (rulename, publishedSpec, requestSpec)
+
+        cache = _getChainCache(sm)
+        chain = cache.get(key)
+        if chain is not None and (
+            chain.operations is operations or chain.operations == operations
+        ):
+            return chain
+
+        lookup = sm.adapters.lookup
+        names = []
+        factories = []
+        for name in operations:
+            factory = lookup((publishedSpec, requestSpec), ICachingOperation, name)
+            if factory is not None:
+                names.append(name)
+                factories.append(factory)
+
+        chain = _CompiledChain(operations, tuple(names), tuple(factories))
+
+        if len(cache) >= CHAIN_CACHE_SIZE:
+            cache.clear()
+        cache[key] = chain
+        return chain
+
+
+def _getChainCache(sm):
+    global _lastSiteCache
+
+    # Fast path: the same site as last time. This avoids the weak reference
+    # created by every WeakKeyDictionary lookup.
+    lastSite, cache = _lastSiteCache
+    if lastSite is sm:
+        cache.expire()
+        return cache
+
+    try:
+        cache = _chainCaches.get(sm)
+        if cache is None:
+            cache = _chainCaches.setdefault(sm, ExpiringCache())
+    except TypeError:
+        # Site managers which cannot be weakly referenced are not cached
+        return {}
+    _lastSiteCache = (sm, cache)
+    cache.expire()
+    return cache
+
+
+def clearChainCache():
+    """Clear the cache of compiled chains."""
+    global _lastSiteCache
+    _lastSiteCache = (None, None)
+    _chainCaches.clear()
+
+
+@adapter(IAdapterRegistration, IRegistrationEvent)
+def operationRegistrationChanged(registration, event):
+    """Clear the compiled chain cache when a caching operation is registered
+    or unregistered with a component registry.
+    """
+    if registration.provided is ICachingOperation:
+        clearChainCache()
 
-                if operation is not None:
-                    chained.append(name)
-                    operation.modifyResponse(rulename, response)
 
-        if chained:
-            response.setHeader("X-Cache-Chain-Operations", "; ".join(chained))
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(clearChainCache)
+    del addCleanUp
@@ -0,0 +1,443 @@
+from http.client import HTTPConnection
+from http.client import HTTPException
+from http.client import HTTPSConnection
+from http.client import RemoteDisconnected
+from plone.caching.interfaces import IPurgingSettings
+from plone.caching.stats import statistics
+from plone.registry.interfaces import IRegistry
+from urllib.parse import urlsplit
+from z3c.caching.interfaces import IPurgeEvent
+from z3c.caching.interfaces import IPurgePaths
+from zope.component import adapter
+from zope.component import getAdapters
+from zope.component import queryUtility
+from zope.globalrequest import getRequest
+from zope.schema import getFieldNames
+
+import logging
+import queue
+import threading
+import transaction
+
+logger = logging.getLogger("plone.caching")
+
+_SETTINGS_PREFIX = IPurgingSettings.__identifier__ + "."
+
+# Record enabling purging in plone.cachepurging, which purges on the same
+# events
+_CACHEPURGING_ENABLED = "plone.cachepurging.interfaces.ICachePurgingSettings.enabled"
+
+# Maximum number of batches waiting to be sent. Further batches are dropped
+# rather than blocking the committing request.
+QUEUE_SIZE = 10000
+
+# Key of the paths queued in a transaction, in the transaction's data
+_queueKey = object()
+
+_dispatcher = None
+_dispatcherLock = threading.Lock()
+
+
+def getPurgingSettings(registry=None):
+    """Return the ``IPurgingSettings`` records as a dictionary, with field
+    defaults for missing records, or None if there is no registry.
+    """
+
+    if registry is None:
+        registry = queryUtility(IRegistry)
+    if registry is None:
+        return None
+    return {
+        name: registry.get(_SETTINGS_PREFIX + name, IPurgingSettings[name].default)
+        for name in getFieldNames(IPurgingSettings)
+    }
+
+
+def queuePurge(paths, request=None, absolute=False):
+    """Queue paths to be purged from the caching proxies once the current
+    transaction is committed. Paths are rewritten for the public domains of
+    the site with ``rewritePaths()``, using the current request if none is
+    given, unless ``absolute`` is set, in which case they are purged as they
+    are, like the absolute paths of ``IPurgePaths``. They are de-duplicated
+    per transaction, and nothing is purged if the transaction is aborted or
+    purging is disabled.
+    """
+
+    txn = transaction.get()
+    try:
+        queued, settings = txn.data(_queueKey)
+    except KeyError:
+        settings = getPurgingSettings()
+        if settings is None or not settings["enabled"] or not settings["proxies"]:
+            return
+        queued = {}
+        txn.set_data(_queueKey, (queued, settings))
+        txn.addAfterCommitHook(_afterCommit, (queued, settings))
+
+    if absolute:
+        targets = [(None, path) for path in paths]
+    else:
+        if request is None:
+            request = getRequest()
+        targets = rewritePaths(paths, settings, request)
+    for target in targets:
+        queued[target] = None
+
+
+def rewritePaths(paths, settings, request=None):
+    """Return the ``(host, path)`` pairs to purge for the given paths: the
+    paths are purged for each of the configured ``domains``, or the domain
+    of the request, with its host sent in the ``Host`` header, as the proxies
+    key their entries by it. The host is None if there is no domain.
+
+    If ``virtualHosting`` is set, the paths are rewritten to the
+    VirtualHostMonster URLs the proxies pass to Zope for each domain, with
+    the virtual root of the request, as ``plone.cachepurging`` does. Paths
+    are left as they are if the request is not virtual hosted.
+    """
+
+    domains = settings.get("domains") or ()
+    if not domains and request is not None:
+        serverURL = request.get("SERVER_URL")
+        if serverURL:
+            domains = (serverURL,)
+    if not domains:
+        return [(None, path) for path in paths]
+
+    virtualHost = None
+    if settings.get("virtualHosting") and request is not None:
+        virtualHost = _virtualHost(request)
+
+    targets = []
+    for domain in domains:
+        scheme, host = urlsplit(domain)[:2]
+        for path in paths:
+            if path and not path.startswith("/"):
+                path = "/" + path
+            if virtualHost is not None:
+                root, prefix = virtualHost
+                path = (
+                    f"/VirtualHostBase/{scheme}/{host}{root}"
+                    f"/VirtualHostRoot{prefix}{path}"
+                )
+            targets.append((host, path))
+    return targets
+
+
+def _virtualHost(request):
+    # Returns the virtual root and _vh_ prefix of a virtual hosted request,
+    # or None
+    urlParts = request.get("VIRTUAL_URL_PARTS")
+    rootPath = request.get("VirtualRootPhysicalPath")
+    if not isinstance(urlParts, (list, tuple)) or not 2 <= len(urlParts) <= 3:
+        return None
+    if not isinstance(rootPath, (list, tuple)) or not rootPath:
+        return None
+
+    root = "/".join(rootPath)
+    if root == "/":
+        root = ""
+    prefix = ""
+    if len(urlParts) == 3 and urlParts[1]:
+        prefix = "".join(f"/_vh_{part}" for part in urlParts[1].split("/"))
+    return root, prefix
+
+
+def _afterCommit(success, targets, settings):
+    if not success or not targets:
+        return
+    dispatcher = getDispatcher(settings)
+    byHost = {}
+    for host, path in targets:
+        byHost.setdefault(host, []).append(path)
+    for host, paths in byHost.items():
+        dispatcher.dispatch(settings, paths, host)
+
+
+@adapter(IPurgeEvent)
+def queuePurgeEvent(event):
+    """Queue the paths of the ``IPurgePaths`` adapters of the purged object.
+    Relative paths are rewritten with ``rewritePaths()``, absolute paths are
+    purged as they are.
+
+    Nothing is queued if ``plone.cachepurging`` is enabled, since it purges
+    the same paths on the same events.
+    """
+
+    registry = queryUtility(IRegistry)
+    if registry is not None and registry.get(_CACHEPURGING_ENABLED, False):
+        return
+
+    paths = []
+    absolutePaths = []
+    for name, purgePaths in getAdapters((event.object,), IPurgePaths):
+        paths.extend(purgePaths.getRelativePaths() or ())
+        absolutePaths.extend(purgePaths.getAbsolutePaths() or ())
+    if paths:
+        queuePurge(paths)
+    if absolutePaths:
+        queuePurge(absolutePaths, absolute=True)
+
+
+class _Batch:
+    """Paths to purge from one proxy, for one host."""
+
+    __slots__ = ("proxy", "paths", "settings", "host", "attempt")
+
+    def __init__(self, proxy, paths, settings, host=None, attempt=0):
+        self.proxy = proxy
+        self.paths = paths
+        self.settings = settings
+        self.host = host
+        self.attempt = attempt
+
+
+class PurgeDispatcher:
+    """Sends PURGE requests to caching proxies from a pool of background
+    threads.
+
+    Paths are sent in batches of up to ``batchSize`` paths per proxy. Each
+    thread keeps a persistent HTTP/1.1 connection to each proxy, so a batch
+    costs one connection at most. Paths that fail, with a connection error or
+    a server error, are retried in a new batch after ``backoff`` seconds,
+    doubled for each further attempt, up to ``retries`` times.
+
+    The queue of batches is bounded by ``queueSize``: when it is full, new
+    batches are dropped, so that committing requests never wait for the
+    proxies.
+    """
+
+    def __init__(self, threads=2, queueSize=QUEUE_SIZE):
+        self.threads = threads
+        self._queue = queue.Queue(queueSize)
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._timers = set()
+        self._stopped = False
+        self._workers = [
+            threading.Thread(
+                target=self._run, name=f"plone.caching purge {i}", daemon=True
+            )
+            for i in range(threads)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def dispatch(self, settings, paths, host=None):
+        """Queue PURGE requests for the paths to all configured proxies,
+        with ``host`` in the ``Host`` header if given, and the host of the
+        proxy otherwise.
+        """
+
+        batchSize = max(1, settings["batchSize"] or 1)
+        for proxy in settings["proxies"]:
+            for start in range(0, len(paths), batchSize):
+                batch = paths[start : start + batchSize]
+                self._put(_Batch(proxy, batch, settings, host))
+
+    def join(self, timeout=None):
+        """Wait until all queued and retried batches are sent or given up.
+        Return False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending, timeout)
+
+    def stop(self, wait=True):
+        """Stop the threads once the batches already queued are sent, and
+        wait for them if ``wait`` is set. Otherwise, the oldest batches are
+        dropped if the queue is too full to tell the threads to stop. Pending
+        retries are abandoned.
+        """
+
+        with self._condition:
+            self._stopped = True
+            timers = list(self._timers)
+            self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+            self._done()
+        if wait:
+            for worker in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            return
+
+        # Make room for the sentinels rather than waiting for the workers,
+        # dropping the oldest batches if the queue is full
+        for worker in self._workers:
+            while True:
+                try:
+                    self._queue.put_nowait(None)
+                    break
+                except queue.Full:
+                    pass
+                try:
+                    batch = self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if batch is None:
+                    # Only sentinels are queued, which the workers take
+                    self._queue.put(None)
+                else:
+                    self._drop(batch)
+
+    def _put(self, batch):
+        with self._condition:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            self._drop(batch)
+
+    def _drop(self, batch):
+        self._done()
+        statistics.increment("purges", batch.proxy, "dropped", len(batch.paths))
+        logger.warning(
+            "Purge queue full, dropping %d paths for %s",
+            len(batch.paths),
+            batch.proxy,
+        )
+
+    def _done(self):
+        with self._condition:
+            self._pending -= 1
+            if not self._pending:
+                self._condition.notify_all()
+
+    def _run(self):
+        connections = {}
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    break
+                try:
+                    self._send(connections, batch)
+                except Exception:
+                    logger.exception("Error purging %s", batch.proxy)
+                finally:
+                    self._done()
+        finally:
+            for connection, prefix in connections.values():
+                connection.close()
+
+    def _send(self, connections, batch):
+        failed = []
+        for path in batch.paths:
+            try:
+                status = self._purge(connections, batch, path)
+            except (OSError, HTTPException) as e:
+                logger.debug("Error purging %s from %s: %s", path, batch.proxy, e)
+                entry = connections.pop(batch.proxy, None)
+                if entry is not None:
+                    entry[0].close()
+                failed.append(path)
+                continue
+            # Proxies answer 404 for paths they do not hold
+            if status < 400 or status == 404:
+                statistics.increment("purges", batch.proxy, "purged")
+            else:
+                failed.append(path)
+
+        if failed:
+            self._retry(
+                _Batch(
+                    batch.proxy, failed, batch.settings, batch.host, batch.attempt + 1
+                )
+            )
+
+    def _purge(self, connections, batch, path):
+        entry = connections.get(batch.proxy)
+        if entry is not None:
+            try:
+                return self._request(connections, batch, entry, path)
+            except (RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The proxy closed the kept-alive connection, e.g. after its
+                # idle timeout: reconnect once before counting a failure
+                del connections[batch.proxy]
+                entry[0].close()
+
+        url = urlsplit(batch.proxy)
+        factory = HTTPSConnection if url.scheme == "https" else HTTPConnection
+        connection = factory(url.hostname, url.port, timeout=batch.settings["timeout"])
+        entry = connections[batch.proxy] = (connection, url.path.rstrip("/"))
+        return self._request(connections, batch, entry, path)
+
+    def _request(self, connections, batch, entry, path):
+        connection, prefix = entry
+        headers = {"Host": batch.host} if batch.host else {}
+        connection.request("PURGE", prefix + path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.will_close:
+            del connections[batch.proxy]
+            connection.close()
+        return response.status
+
+    def _retry(self, batch):
+        settings = batch.settings
+        if batch.attempt > (settings["retries"] or 0):
+            statistics.increment("purges", batch.proxy, "failed", len(batch.paths))
+            logger.warning(
+                "Giving up purging %d paths from %s", len(batch.paths), batch.proxy
+            )
+            return
+
+        statistics.increment("purges", batch.proxy, "retried", len(batch.paths))
+        delay = (settings["backoff"] or 0) * 2 ** (batch.attempt - 1)
+        timer = threading.Timer(delay, self._requeue)
+        timer.args = (batch, timer)
+        timer.daemon = True
+        with self._condition:
+            if self._stopped:
+                return
+            self._pending += 1
+            self._timers.add(timer)
+        timer.start()
+
+    def _requeue(self, batch, timer):
+        with self._condition:
+            if timer not in self._timers:
+                return
+            self._timers.discard(timer)
+        self._put(batch)
+        self._done()
+
+
+def getDispatcher(settings):
+    """Return the dispatcher shared by all threads of this process, with the
+    number of threads configured in ``settings``.
+    """
+
+    global _dispatcher
+    threads = max(1, settings["threads"] or 1)
+    dispatcher = _dispatcher
+    if dispatcher is None or dispatcher.threads != threads:
+        with _dispatcherLock:
+            dispatcher = _dispatcher
+            if dispatcher is None or dispatcher.threads != threads:
+                if dispatcher is not None:
+                    # Let the previous threads finish what they have queued
+                    dispatcher.stop(wait=False)
+                dispatcher = _dispatcher = PurgeDispatcher(threads)
+    return dispatcher
+
+
+def stopDispatcher():
+    """Stop the dispatcher, after sending the batches already queued."""
+
+    global _dispatcher
+    with _dispatcherLock:
+        dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None:
+        dispatcher.stop()
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(stopDispatcher)
+    del addCleanUp
@@ -0,0 +1,159 @@
+from email.utils import parsedate_to_datetime
+from zope.interface import implementer
+from ZPublisher.HTTPRangeSupport import expandRanges
+from ZPublisher.HTTPRangeSupport import parseRange
+from ZPublisher.Iterators import IStreamIterator
+
+import uuid
+
+# Largest number of ranges served from one request. Requests for more are
+# answered with the whole body.
+MAX_RANGES = 20
+
+
+def getRanges(request, headers, size):
+    """Return the byte ranges of a stored body of ``size`` bytes requested
+    with the ``Range`` header of the request, as a list of ``(start, end)``
+    tuples with exclusive ends, or an empty list if none can be satisfied.
+
+    Return None if the whole body should be sent instead: if there is no
+    ``Range`` header, if it cannot be parsed or asks for more than
+    ``MAX_RANGES`` ranges, or if the ``If-Range`` header does not match the
+    stored ``(name, value)`` header pairs.
+    """
+
+    header = request.getHeader("Range")
+    if not header:
+        return None
+
+    ifRange = request.getHeader("If-Range")
+    if ifRange and not _validatorMatches(ifRange.strip(), headers):
+        return None
+
+    ranges = parseRange(header)
+    if ranges is None or len(ranges) > MAX_RANGES:
+        return None
+    return expandRanges(ranges, size)
+
+
+def _validatorMatches(ifRange, headers):
+    # If-Range holds a strong entity tag or the exact modification date
+    values = {name.lower(): value for name, value in headers}
+    if ifRange.startswith('"'):
+        return values.get("etag") == ifRange
+    if ifRange.startswith("W/"):
+        return False
+
+    lastModified = values.get("last-modified")
+    if lastModified is None:
+        return False
+    try:
+        return parsedate_to_datetime(ifRange) == parsedate_to_datetime(lastModified)
+    except (TypeError, ValueError, IndexError):
+        return False
+
+
+def contentRange(start, end, size):
+    """Return the ``Content-Range`` header value for a range with an
+    exclusive end.
+    """
+    return f"bytes {start}-{end - 1}/{size}"
+
+
+def rangeParts(ranges, size, contentType):
+    """Return the parts of the body of a ``206`` response for the ranges,
+    and its content type.
+
+    Parts are byte strings to send as they are, and ``(start, end)`` tuples
+    standing for slices of the stored body. More than one range is sent as a
+    ``multipart/byteranges`` body.
+    """
+
+    if len(ranges) == 1:
+        return list(ranges), contentType
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, end in ranges:
+        header = f"\r\n--{boundary}\r\n"
+        if contentType:
+            header += f"Content-Type: {contentType}\r\n"
+        header += f"Content-Range: {contentRange(start, end, size)}\r\n\r\n"
+        parts.append(header.encode("latin-1"))
+        parts.append((start, end))
+    parts.append(f"\r\n--{boundary}--\r\n".encode("latin-1"))
+    return parts, f"multipart/byteranges; boundary={boundary}"
+
+
+def canSlice(body):
+    """Return True if ranges of a stored body can be served."""
+    return isinstance(body, (bytes, bytearray, memoryview)) or (
+        hasattr(body, "seek") and hasattr(body, "read")
+    )
+
+
+def rangeBody(body, parts):
+    """Return the body made of ``parts`` of a stored body, or None if the
+    stored body cannot be sliced.
+
+    A single slice of a byte string body is returned as a memoryview of it,
+    and several are copied into a new byte string. A file body is sent as a
+    stream iterator reading only the slices from the file.
+    """
+
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        view = memoryview(body)
+        if len(parts) == 1:
+            start, end = parts[0]
+            return view[start:end]
+        return b"".join(
+            part if isinstance(part, bytes) else view[part[0] : part[1]]
+            for part in parts
+        )
+    if canSlice(body):
+        return RangeStreamIterator(body, parts)
+    return None
+
+
+@implementer(IStreamIterator)
+class RangeStreamIterator:
+    """Stream iterator sending slices of a file, and the byte strings
+    between them, in chunks of at most ``streamsize`` bytes. The file is
+    closed when the iterator is.
+    """
+
+    def __init__(self, file, parts, streamsize=1 << 16):
+        self.file = file
+        self.streamsize = streamsize
+        self._parts = iter(parts)
+        self._remaining = 0
+        self._length = sum(
+            len(part) if isinstance(part, bytes) else part[1] - part[0]
+            for part in parts
+        )
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._remaining:
+            part = next(self._parts)
+            if isinstance(part, bytes):
+                if part:
+                    return part
+                continue
+            start, end = part
+            self.file.seek(start)
+            self._remaining = end - start
+
+        data = self.file.read(min(self._remaining, self.streamsize))
+        if not data:
+            raise ValueError("File shorter than stored size")
+        self._remaining -= len(data)
+        return data
+
+    def __len__(self):
+        return self._length
+
+    def close(self):
+        self.file.close()
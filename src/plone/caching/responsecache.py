@@ -0,0 +1,939 @@
+from AccessControl import getSecurityManager
+from AccessControl.users import nobody
+from plone.caching.cachekey import addVary
+from plone.caching.cachekey import getCacheKey
+from plone.caching.cachekey import mergeVary
+from plone.caching.diskstore import DiskStore
+from plone.caching.hooks import IStreamedResponse
+from plone.caching.interfaces import _
+from plone.caching.interfaces import ICachingOperation
+from plone.caching.interfaces import ICachingOperationType
+from plone.caching.interfaces import ITaggedCacheStore
+from plone.caching.ranges import canSlice
+from plone.caching.ranges import contentRange
+from plone.caching.ranges import getRanges
+from plone.caching.ranges import rangeBody
+from plone.caching.ranges import rangeParts
+from plone.caching.shmstore import SharedMemoryStore
+from plone.caching.stats import statistics
+from plone.caching.stores import CachedResponse
+from plone.caching.stores import openWriter
+from plone.caching.stores import RAMStore
+from plone.caching.streaming import Tee
+from plone.caching.streaming import teeIterator
+from plone.caching.streaming import teeStreamedResponse
+from plone.caching.surrogatekeys import getCacheTags
+from plone.caching.surrogatekeys import getTags
+from plone.caching.utils import getResponseBody
+from plone.caching.utils import getResponseStream
+from plone.caching.utils import lookupOptions
+from plone.caching.utils import replaceResponseStream
+from z3c.caching.interfaces import IPurgeEvent
+from zope.component import adapter
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.interface import provider
+from ZPublisher.HTTPResponse import uncompressableMimeMajorTypes
+from ZPublisher.interfaces import IPubEnd
+from ZPublisher.WSGIPublisher import publish_module
+
+import functools
+import io
+import logging
+import sys
+import threading
+import time
+import transaction
+import zlib
+
+# Response headers stored with a cached response unless configured otherwise
+DEFAULT_HEADERS = (
+    "Content-Type",
+    "Content-Language",
+    "Cache-Control",
+    "Expires",
+    "Last-Modified",
+    "ETag",
+    "Vary",
+    "Surrogate-Key",
+    "xkey",
+)
+
+logger = logging.getLogger("plone.caching")
+
+# Cache-Control directives forbidding a shared cache to store a response
+UNCACHEABLE_DIRECTIVES = frozenset(("private", "no-store"))
+
+# Content codings responses can be stored in, mapped to the zlib window
+# bits producing them
+ENCODINGS = {
+    "gzip": zlib.MAX_WBITS | 16,
+    "deflate": zlib.MAX_WBITS,
+}
+
+# Number of seconds a request may take to render a response other requests
+# are waiting for, or to refresh a stale response, before another request is
+# allowed to try.
+REFRESH_TIMEOUT = 30
+
+# Maximum number of stale responses refreshed in the background at once in
+# this process. Further stale responses are refreshed by the request finding
+# them, as on a miss.
+REFRESH_THREADS = 4
+
+# Key of the WSGI environ of a request refreshing a stale response in the
+# background, which must not be served from the cache
+REFRESH_ENVIRON_KEY = "plone.caching.refresh"
+
+# Request headers not passed on to a background refresh, so that it renders
+# the whole page
+_REFRESH_EXCLUDED = frozenset(
+    (
+        "CONTENT_LENGTH",
+        "CONTENT_TYPE",
+        "HTTP_IF_MATCH",
+        "HTTP_IF_MODIFIED_SINCE",
+        "HTTP_IF_NONE_MATCH",
+        "HTTP_IF_RANGE",
+        "HTTP_IF_UNMODIFIED_SINCE",
+        "HTTP_RANGE",
+    )
+)
+
+_refreshSlots = threading.BoundedSemaphore(REFRESH_THREADS)
+
+# Name of the request attribute holding the ``(prefix, key)`` of the
+# response the request is rendering for others and its ``_Flight``
+_FLIGHT_KEY = "_plone_caching_flight"
+
+# Responses being rendered in this process by one request on behalf of
+# others, mapping ``(prefix, key)`` to a ``_Flight``
+_flights = {}
+_flightsLock = threading.Lock()
+
+# Key of the tags to invalidate in a transaction, in the transaction's data
+_tagsKey = object()
+
+# Stores shared by all requests in this process, keyed by operation prefix.
+# Values are tuples ``(store, config)``.
+_stores = {}
+_storesLock = threading.Lock()
+
+
+class _Flight:
+    """A response being rendered by one request, which other requests may
+    wait for.
+    """
+
+    __slots__ = ("deadline", "event")
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.event = threading.Event()
+
+
+def isAnonymous():
+    """Return True if the current user is anonymous."""
+    user = getSecurityManager().getUser()
+    return user is None or user.getUserName() == nobody.getUserName()
+
+
+@implementer(ICachingOperation)
+@adapter(Interface, Interface)
+class BaseResponseCache:
+    """Base class for caching operations which store rendered responses in an
+    ``ICacheStore`` and serve them from ``interceptResponse()`` on later
+    requests, without calling the published object.
+
+    Responses are stored under the key computed by the ``ICacheKey`` adapter
+    named in the ``cacheKey`` option (``url`` by default), and
+    ``modifyResponse()`` adds the request headers the key depends on to the
+    ``Vary`` header. A response is stored if the request is a ``GET``
+    request, the response has a ``200`` status, sets no cookies, is not
+    already encoded, is not marked ``private`` or ``no-store`` in its
+    ``Cache-Control`` header, does not vary on request headers the key does
+    not depend on (or ``*``), and, if the ``anonymousOnly`` option is set
+    (the default), the user is anonymous. Stored responses are served for up
+    to ``maxAge`` seconds. The response headers named in the ``headers``
+    option are stored and restored with the body.
+
+    If the ``staleWhileRevalidate`` option is set, an expired response is
+    still served for that many more seconds, while the page is rendered again
+    in the background to refresh it, see ``refresh()``. Only one refresh per
+    response runs at a time in this process.
+
+    If the ``compress`` option lists content codings (``gzip`` or
+    ``deflate``), compressed variants of each stored response are stored
+    alongside it, compressed once with zlib at ``compressionLevel``. Hits are
+    served in the first listed coding the ``Accept-Encoding`` request header
+    accepts, so they cost no compression.
+
+    Stores which index tags, such as the store of the RAM cache, record the
+    ``ICacheTags`` of the published object with each response, so that
+    ``invalidateTags()`` removes every response depending on a tag.
+
+    Bodies sent as stream iterators or written with ``response.write()`` are
+    copied to the store as they are sent to the client, and stored only if
+    the whole body is sent successfully and is no larger than
+    ``maxStreamSize`` bytes (0 disables this). Stores which can write bodies
+    in chunks, such as the store of the disk cache, never hold such a body in
+    memory; others hold it until it is stored. Streamed bodies are not
+    compressed.
+
+    If the ``ranges`` option is set (the default), requests with a ``Range``
+    header, and an ``If-Range`` header matching the stored ``ETag`` or
+    ``Last-Modified`` header if any, are answered from the stored response
+    with a ``206`` response holding only the requested ranges, as a
+    ``multipart/byteranges`` body for several ranges. Bodies stored in files
+    are read only where the ranges are. Ranges are served from the
+    uncompressed response.
+
+    If the ``singleFlight`` option is set, concurrent requests in this
+    process for a response that is not stored wait for the first one to
+    render it, for up to ``singleFlightTimeout`` seconds, and are then
+    served the stored response.
+
+    Subclasses must set ``prefix`` and implement ``getStore()``. The
+    ``defaults`` mapping supplies values for options not set in the registry.
+    """
+
+    prefix = None
+    options = (
+        "maxAge",
+        "staleWhileRevalidate",
+        "singleFlight",
+        "singleFlightTimeout",
+        "anonymousOnly",
+        "headers",
+        "cacheKey",
+        "compress",
+        "compressionLevel",
+        "maxStreamSize",
+        "ranges",
+    )
+    defaults = {
+        "maxAge": 60,
+        "staleWhileRevalidate": 0,
+        "singleFlight": False,
+        "singleFlightTimeout": 5,
+        "anonymousOnly": True,
+        "headers": DEFAULT_HEADERS,
+        "cacheKey": "url",
+        "compress": (),
+        "compressionLevel": 6,
+        "maxStreamSize": 1024 * 1024,
+        "ranges": True,
+    }
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def interceptResponse(self, rulename, response):
+        options = self.getOptions(rulename)
+        key = self.cacheKey(rulename, options)
+        if key is None:
+            return None
+
+        environ = getattr(self.request, "environ", None) or {}
+        if environ.get(REFRESH_ENVIRON_KEY):
+            # Rendered to refresh a stale response, and stored once rendered
+            statistics.increment("caches", self.prefix, "refreshes")
+            return None
+
+        store = self.getStore()
+        cached = self.lookup(store, key, options)
+        if cached is not None:
+            age = time.time() - cached.created
+            if age < options["maxAge"]:
+                statistics.increment("caches", self.prefix, "hits")
+                return self.serve(response, cached, age, options)
+            if age < options["maxAge"] + options["staleWhileRevalidate"]:
+                # Unless another request is refreshing the response already
+                if self.claim(key) and not self.refresh():
+                    # The response cannot be refreshed in the background, so
+                    # this request renders the page to refresh it
+                    statistics.increment("caches", self.prefix, "misses")
+                    return None
+                statistics.increment("caches", self.prefix, "stale")
+                return self.serve(response, cached, age, options)
+
+        if options["singleFlight"] and not self.claim(key):
+            # Another request is rendering the response
+            cached = self.wait(store, key, options)
+            if cached is not None:
+                statistics.increment("caches", self.prefix, "collapsed")
+                return self.serve(
+                    response, cached, time.time() - cached.created, options
+                )
+
+        statistics.increment("caches", self.prefix, "misses")
+        return None
+
+    def modifyResponse(self, rulename, response):
+        try:
+            options = self.getOptions(rulename)
+            vary = getCacheKey(self.published, self.request, options["cacheKey"])[1]
+            if options["compress"]:
+                vary += ("Accept-Encoding",)
+            addVary(response, vary)
+            self.storeResponse(rulename, response)
+        finally:
+            releaseFlight(self.request)
+
+    def serve(self, response, cached, age, options=None):
+        """Set the status and headers of a stored response on the response,
+        and return its body, or the ranges of it requested if the ``ranges``
+        option is set.
+        """
+        response.setStatus(cached.status)
+        encoded = False
+        for name, value in cached.headers:
+            response.setHeader(name, value)
+            encoded = encoded or name == "Content-Encoding"
+        if encoded:
+            # The body is already compressed: ZPublisher must not compress it
+            # again
+            disableCompression(response)
+        response.setHeader("Age", str(int(max(age, 0))))
+
+        if options is None or not options["ranges"] or cached.status != 200:
+            return cached.body
+        return self.serveRanges(response, cached)
+
+    def serveRanges(self, response, cached):
+        """Set the status and headers of a ``206`` or ``416`` response if
+        the request asks for ranges of the stored response, and return the
+        body to send.
+        """
+
+        body = cached.body
+        if not canSlice(body):
+            return body
+
+        size = len(body)
+        ranges = getRanges(self.request, cached.headers, size)
+        if ranges is None:
+            response.setHeader("Accept-Ranges", "bytes")
+            return body
+
+        if not ranges:
+            response.setStatus(416)
+            response.setHeader("Content-Range", f"bytes */{size}")
+            _close(body)
+            return b""
+
+        parts, contentType = rangeParts(
+            ranges, size, response.getHeader("Content-Type")
+        )
+        partial = rangeBody(body, parts)
+        response.setStatus(206)
+        response.setHeader("Accept-Ranges", "bytes")
+        if len(ranges) == 1:
+            response.setHeader("Content-Range", contentRange(*ranges[0], size))
+        else:
+            response.setHeader("Content-Type", contentType)
+        # A part of the body must be sent as it is stored
+        disableCompression(response)
+        statistics.increment("caches", self.prefix, "partial")
+        return partial
+
+    def lookup(self, store, key, options):
+        """Return the stored response for ``key`` in the first content coding
+        accepted by the request, or the uncompressed one.
+        """
+
+        # Ranges are served from the uncompressed response
+        if options["compress"] and not (
+            options["ranges"] and self.request.getHeader("Range")
+        ):
+            header = self.request.getHeader("Accept-Encoding")
+            if header:
+                for encoding in options["compress"]:
+                    if acceptsEncoding(header, encoding):
+                        cached = store.get(variantKey(key, encoding))
+                        if cached is None:
+                            break
+                        if time.time() - cached.created < options["maxAge"]:
+                            return cached
+                        # A stale variant is only served if the uncompressed
+                        # response has not been refreshed since
+                        identity = store.get(key)
+                        if identity is None or identity.created <= cached.created:
+                            return cached
+                        _close(cached.body)
+                        return identity
+        return store.get(key)
+
+    def storeResponse(self, rulename, response):
+        """Store the response, if it may be cached."""
+
+        options = self.getOptions(rulename)
+        key = self.cacheKey(rulename, options)
+        if key is None:
+            return
+        vary = getCacheKey(self.published, self.request, options["cacheKey"])[1]
+        if not self.storable(response, vary):
+            return
+
+        body = stream = None
+        # Set if the response is written with response.write()
+        streamed = IStreamedResponse.providedBy(self.request)
+        if not streamed:
+            body = getResponseBody(self.request, response)
+            if body is None:
+                stream = getResponseStream(self.request, response)
+                if stream is None:
+                    return
+
+        headers = []
+        for name in options["headers"]:
+            value = response.getHeader(name)
+            if value is not None:
+                headers.append((name, value))
+
+        store = self.getStore()
+        status = response.getStatus()
+        tags = ()
+        if ITaggedCacheStore.providedBy(store):
+            tags = getCacheTags(self.published, self.request)
+
+        # Variants of a previous response would otherwise outlive it
+        for encoding in ENCODINGS:
+            store.delete(variantKey(key, encoding))
+
+        if body is None:
+            if not options["maxStreamSize"]:
+                return
+            writer = openWriter(store, key, status, headers, tags)
+            # The body is stored after modifyResponse() and possibly after
+            # the request has ended, so requests waiting for it are only
+            # woken up once it is stored or discarded
+            tee = Tee(
+                self.prefix,
+                writer,
+                options["maxStreamSize"],
+                handOverFlight(self.request),
+            )
+            if streamed:
+                teeStreamedResponse(self.request, response, tee)
+            else:
+                replaceResponseStream(self.request, response, teeIterator(stream, tee))
+            return
+
+        cached = CachedResponse(status, headers, body, tags=tags)
+        if store.set(key, cached):
+            statistics.increment("caches", self.prefix, "stored")
+
+        if not options["compress"]:
+            return
+        contentType = response.getHeader("Content-Type") or ""
+        if contentType.split("/")[0] in uncompressableMimeMajorTypes:
+            return
+        # Variants vary on what the response varies on, which storable()
+        # checked the key covers, and on the encodings accepted
+        variantHeaders = [
+            (name, value) for name, value in headers if name.lower() != "vary"
+        ]
+        variantHeaders.append(
+            ("Vary", mergeVary(response.getHeader("Vary"), ("Accept-Encoding",)))
+        )
+        for encoding in options["compress"]:
+            wbits = ENCODINGS.get(encoding)
+            if wbits is None:
+                continue
+            compressor = zlib.compressobj(
+                options["compressionLevel"], zlib.DEFLATED, wbits
+            )
+            compressed = compressor.compress(body) + compressor.flush()
+            if len(compressed) >= len(body):
+                continue
+            variant = CachedResponse(
+                status,
+                variantHeaders + [("Content-Encoding", encoding)],
+                compressed,
+                cached.created,
+                tags=tags,
+            )
+            store.set(variantKey(key, encoding), variant)
+
+    def claim(self, key):
+        """Claim the rendering of the response stored under ``key`` for the
+        current request. Return False if another request in this process is
+        already rendering it.
+
+        The claim is released by ``releaseFlight()`` when the response is
+        stored, or at the latest when the request ends. A body copied to the
+        store as it is sent is stored later, so the claim is handed over to
+        it and released once it is stored or discarded.
+        """
+
+        token = (self.prefix, key)
+        now = time.monotonic()
+        flight = _Flight(now + REFRESH_TIMEOUT)
+        with _flightsLock:
+            current = _flights.get(token)
+            if current is not None and current.deadline > now:
+                return False
+            _flights[token] = flight
+
+        try:
+            setattr(self.request, _FLIGHT_KEY, (token, flight))
+        except AttributeError:
+            pass
+        return True
+
+    def refresh(self):
+        """Refresh the stale response the current request claimed, by
+        re-publishing its URL in a background thread, see
+        ``refreshEnviron()``. Return False if it cannot be refreshed in the
+        background, because the request is not a WSGI request or
+        ``REFRESH_THREADS`` refreshes are running already.
+
+        The claim is handed over to the thread, and released once the
+        response is rendered and stored.
+        """
+
+        environ = refreshEnviron(self.request)
+        if environ is None or not _refreshSlots.acquire(False):
+            return False
+        thread = threading.Thread(
+            target=_refresh,
+            args=(environ, handOverFlight(self.request)),
+            name="plone.caching refresh",
+            daemon=True,
+        )
+        try:
+            thread.start()
+        except BaseException:
+            _refreshSlots.release()
+            raise
+        return True
+
+    def wait(self, store, key, options):
+        """Wait for another request to render the response stored under
+        ``key``, and return it, or None if it is not stored in time.
+        """
+
+        flight = _flights.get((self.prefix, key))
+        if flight is not None and not flight.event.wait(options["singleFlightTimeout"]):
+            statistics.increment("caches", self.prefix, "flightTimeouts")
+            return None
+
+        cached = self.lookup(store, key, options)
+        if cached is None or time.time() - cached.created >= options["maxAge"]:
+            return None
+        return cached
+
+    def getOptions(self, rulename):
+        """Return the options for the given rule, with defaults applied."""
+        options = lookupOptions(self.__class__, rulename)
+        for name, value in options.items():
+            if value is None:
+                options[name] = self.defaults.get(name)
+        return options
+
+    def getStore(self):
+        """Return the ``ICacheStore`` to use."""
+        raise NotImplementedError()
+
+    def cacheKey(self, rulename, options):
+        """Return the key under which the response to the current request is
+        stored, or None if it should not be cached.
+        """
+
+        request = self.request
+        environ = getattr(request, "environ", None) or {}
+        if environ.get("REQUEST_METHOD", "GET") != "GET":
+            return None
+        if options["anonymousOnly"] and not isAnonymous():
+            return None
+        return getCacheKey(self.published, request, options["cacheKey"])[0]
+
+    def storable(self, response, vary=()):
+        """Return True if the response may be stored: it has a ``200``
+        status, sets no cookies, has no ``Content-Encoding``, is not marked
+        ``private`` or ``no-store`` in its ``Cache-Control`` header, and its
+        ``Vary`` header only lists ``Accept-Encoding`` and the request
+        headers in ``vary``, those the cache key depends on.
+        """
+
+        if response.getStatus() != 200 or getattr(response, "cookies", None):
+            return False
+        if response.getHeader("Set-Cookie"):
+            return False
+        # An encoded body would be stored and served as the identity
+        # response, without its Content-Encoding
+        if response.getHeader("Content-Encoding"):
+            return False
+        cacheControl = response.getHeader("Cache-Control")
+        if cacheControl:
+            for directive in cacheControl.split(","):
+                name = directive.split("=", 1)[0].strip().lower()
+                if name in UNCACHEABLE_DIRECTIVES:
+                    return False
+        varyHeader = response.getHeader("Vary")
+        if varyHeader:
+            # The response would otherwise be served to requests it does not
+            # fit. The uncompressed response fits any Accept-Encoding.
+            covered = {name.lower() for name in vary}
+            covered.add("accept-encoding")
+            for name in varyHeader.split(","):
+                name = name.strip().lower()
+                if name and name not in covered:
+                    return False
+        return True
+
+
+@provider(ICachingOperationType)
+class RAMCache(BaseResponseCache):
+    """Caching operation which stores responses in memory, in a least
+    recently used store shared by the threads of this process.
+
+    The store is bounded by the ``maxEntries`` and ``maxSize`` (in bytes)
+    options. These are process-wide, so per-rule values are ignored.
+    """
+
+    title = _("RAM cache")
+    description = _(
+        "Stores responses in memory and serves them without rendering the page again"
+    )
+    prefix = "plone.caching.operations.ramcache"
+    options = BaseResponseCache.options + ("maxEntries", "maxSize")
+    defaults = dict(
+        BaseResponseCache.defaults,
+        maxEntries=1000,
+        maxSize=64 * 1024 * 1024,
+    )
+
+    def getStore(self):
+        options = lookupOptions(self.__class__, None)
+        config = (
+            options["maxEntries"] or self.defaults["maxEntries"],
+            options["maxSize"] or self.defaults["maxSize"],
+        )
+        return getSharedStore(self.prefix, config, self.createStore)
+
+    def createStore(self, previous, maxEntries, maxSize):
+        if previous is None:
+            return RAMStore(self.prefix, maxEntries, maxSize)
+        previous.resize(maxEntries, maxSize)
+        return previous
+
+
+@provider(ICachingOperationType)
+class SharedMemoryCache(BaseResponseCache):
+    """Caching operation which stores responses in a shared memory segment,
+    shared by all processes on the host which use the same segment file.
+
+    The segment is configured by the ``path``, ``size`` (in bytes),
+    ``slabSize`` (the largest response that can be stored, in bytes) and
+    ``stripes`` (the number of locks guarding the segment) options. These are
+    process-wide, so per-rule values are ignored.
+    """
+
+    title = _("Shared memory cache")
+    description = _(
+        "Stores responses in memory shared by all Zope processes on the host "
+        "and serves them without rendering the page again"
+    )
+    prefix = "plone.caching.operations.sharedmemorycache"
+    options = BaseResponseCache.options + ("path", "size", "slabSize", "stripes")
+    defaults = dict(
+        BaseResponseCache.defaults,
+        size=64 * 1024 * 1024,
+        slabSize=64 * 1024,
+        stripes=64,
+    )
+
+    def getStore(self):
+        options = lookupOptions(self.__class__, None)
+        config = (
+            options["path"] or None,
+            options["size"] or self.defaults["size"],
+            options["slabSize"] or self.defaults["slabSize"],
+            options["stripes"] or self.defaults["stripes"],
+        )
+        return getSharedStore(self.prefix, config, self.createStore)
+
+    def createStore(self, previous, path, size, slabSize, stripes):
+        # A previous store may still be in use by other threads, so it is
+        # left to be garbage collected rather than closed.
+        return SharedMemoryStore(self.prefix, path, size, slabSize, stripes)
+
+
+@provider(ICachingOperationType)
+class DiskCache(BaseResponseCache):
+    """Caching operation which stores response bodies in files, for large
+    responses that are too expensive to keep in memory. Hits are served as
+    file stream iterators, so the body is sent in chunks.
+
+    The store is configured by the ``path`` (a directory in which each
+    process uses its own subdirectory), ``maxSize`` (in bytes),
+    ``maxEntries`` and ``minSize`` (the smallest body stored, in bytes)
+    options. These are process-wide, so per-rule values are ignored.
+    """
+
+    title = _("Disk cache")
+    description = _(
+        "Stores large responses on disk and serves them without rendering "
+        "the page again"
+    )
+    prefix = "plone.caching.operations.diskcache"
+    options = BaseResponseCache.options + ("path", "maxSize", "maxEntries", "minSize")
+    defaults = dict(
+        BaseResponseCache.defaults,
+        maxSize=1024 * 1024 * 1024,
+        maxEntries=10000,
+        minSize=0,
+        maxStreamSize=100 * 1024 * 1024,
+    )
+
+    def getStore(self):
+        options = lookupOptions(self.__class__, None)
+        config = (
+            options["path"] or None,
+            options["maxSize"] or self.defaults["maxSize"],
+            options["maxEntries"] or self.defaults["maxEntries"],
+            options["minSize"] or self.defaults["minSize"],
+        )
+        return getSharedStore(self.prefix, config, self.createStore)
+
+    def createStore(self, previous, path, maxSize, maxEntries, minSize):
+        return DiskStore(self.prefix, path, maxSize, maxEntries, minSize)
+
+
+def variantKey(key, encoding):
+    """Return the key of the variant of a stored response in the given
+    content coding.
+    """
+    return f"{key}:{encoding}"
+
+
+def acceptsEncoding(header, encoding):
+    """Return True if the ``Accept-Encoding`` header accepts the given
+    content coding.
+    """
+
+    wildcard = False
+    for item in header.split(","):
+        coding, sep, params = item.partition(";")
+        coding = coding.strip().lower()
+        if coding != encoding and coding != "*":
+            continue
+        accepted = True
+        for param in params.split(";"):
+            name, sep, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    accepted = float(value) > 0
+                except ValueError:
+                    accepted = False
+        if coding == encoding:
+            return accepted
+        wildcard = accepted
+    return wildcard
+
+
+def disableCompression(response):
+    """Prevent ZPublisher from compressing the body of the response."""
+    enableHTTPCompression = getattr(response, "enableHTTPCompression", None)
+    if enableHTTPCompression is not None:
+        enableHTTPCompression(disable=True)
+
+
+def _close(body):
+    close = getattr(body, "close", None)
+    if close is not None:
+        close()
+
+
+def getSharedStore(prefix, config, factory):
+    """Return the store for the operation with the given prefix, shared by
+    all threads of this process.
+
+    ``config`` is a tuple of the options the store is created with. When it
+    changes, ``factory(previous, *config)`` is called to create a new store
+    or reconfigure the previous one, which is None on the first call.
+    """
+
+    store, storeConfig = _stores.get(prefix, (None, None))
+    if storeConfig != config:
+        with _storesLock:
+            store, storeConfig = _stores.get(prefix, (None, None))
+            if storeConfig != config:
+                store = factory(store, *config)
+                _stores[prefix] = (store, config)
+    return store
+
+
+def refreshEnviron(request):
+    """Return the WSGI environ of a ``GET`` request for the same URL as the
+    request, or None if it is not a WSGI request.
+
+    The environ keeps the host, virtual hosting path and headers of the
+    request, including the credentials it was authenticated with (e.g. the
+    ``Authorization`` and ``Cookie`` headers), so that it is published in
+    the security context of the same user. Conditional and range headers are
+    left out, so that the whole page is rendered.
+    """
+
+    environ = getattr(request, "environ", None)
+    if not environ or "SERVER_NAME" not in environ or "PATH_INFO" not in environ:
+        return None
+
+    refreshed = {
+        name: value
+        for name, value in environ.items()
+        if isinstance(value, str)
+        and not name.startswith("wsgi.")
+        and name not in _REFRESH_EXCLUDED
+    }
+    refreshed.setdefault("SERVER_PROTOCOL", "HTTP/1.1")
+    refreshed.update(
+        {
+            "REQUEST_METHOD": "GET",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": environ.get("wsgi.url_scheme", "http"),
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+            REFRESH_ENVIRON_KEY: True,
+        }
+    )
+    return refreshed
+
+
+def _refresh(environ, done):
+    # Runs in a background thread. The publisher opens its own ZODB
+    # connection, authenticates the user and stores the response through
+    # modifyResponse().
+    try:
+        result = publish_module(environ, _startResponse)
+        try:
+            # Bodies sent as stream iterators are stored as they are read
+            for chunk in result:
+                pass
+        finally:
+            _close(result)
+    except Exception:
+        logger.exception("Error refreshing %s", environ.get("PATH_INFO"))
+    finally:
+        _refreshSlots.release()
+        if done is not None:
+            done()
+
+
+def _startResponse(status, headers, exc_info=None):
+    return _discard
+
+
+def _discard(data):
+    pass
+
+
+def releaseFlight(request):
+    """Release the response the request claimed to render, if any, waking
+    up the requests waiting for it.
+    """
+
+    claimed = request.__dict__.pop(_FLIGHT_KEY, None)
+    if claimed is not None:
+        _releaseFlight(*claimed)
+
+
+def handOverFlight(request):
+    """Return a function releasing the response the request claimed to
+    render, or None if it claimed none. The request no longer releases it
+    itself, so that whoever stores the response can release it once it is
+    stored.
+    """
+
+    claimed = request.__dict__.pop(_FLIGHT_KEY, None)
+    if claimed is None:
+        return None
+    return functools.partial(_releaseFlight, *claimed)
+
+
+def _releaseFlight(token, flight):
+    with _flightsLock:
+        # The flight may have timed out and been claimed by another request
+        if _flights.get(token) is flight:
+            del _flights[token]
+    flight.event.set()
+
+
+@adapter(IPubEnd)
+def requestEnded(event):
+    """Release any claim left by a request which did not reach
+    ``modifyResponse()``, e.g. because rendering failed.
+    """
+    releaseFlight(event.request)
+
+
+def invalidateTags(tags):
+    """Remove the responses stored with any of the given tags from all
+    stores of this process which index tags, and return the number of
+    responses removed.
+    """
+
+    removed = 0
+    for store, config in list(_stores.values()):
+        if ITaggedCacheStore.providedBy(store):
+            removed += store.invalidateTags(tags)
+    return removed
+
+
+def queueTagInvalidation(tags):
+    """Invalidate the given tags once the current transaction is committed.
+    Nothing is invalidated if the transaction is aborted.
+    """
+
+    txn = transaction.get()
+    try:
+        queued = txn.data(_tagsKey)
+    except KeyError:
+        queued = {}
+        txn.set_data(_tagsKey, queued)
+        txn.addAfterCommitHook(_invalidateAfterCommit, (queued,))
+    for tag in tags:
+        queued[tag] = None
+
+
+def _invalidateAfterCommit(success, tags):
+    if success and tags:
+        invalidateTags(list(tags))
+
+
+@adapter(IPurgeEvent)
+def invalidateOnPurge(event):
+    """Invalidate the tags of purged content after commit."""
+    tags = getTags(event.object)
+    if tags:
+        queueTagInvalidation(tags)
+
+
+def clearStores():
+    """Discard all stores and their entries."""
+    with _storesLock:
+        for store, config in _stores.values():
+            store.clear()
+            close = getattr(store, "close", None)
+            if close is not None:
+                close()
+        _stores.clear()
+    with _flightsLock:
+        for flight in _flights.values():
+            flight.event.set()
+        _flights.clear()
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(clearStores)
+    del addCleanUp
@@ -0,0 +1,436 @@
+from plone.caching.interfaces import ICacheStore
+from plone.caching.stats import statistics
+from plone.caching.stores import CachedResponse
+from zope.interface import implementer
+
+import getpass
+import hashlib
+import logging
+import marshal
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Without POSIX record locks (on Windows), the store is only safe within
+    # one process
+    fcntl = None
+
+logger = logging.getLogger("plone.caching")
+
+MAGIC = b"PLCSHM02"
+
+# The segment starts with a header page, followed by the slabs. The bytes of
+# the header page are also used as the targets of the inter-process stripe
+# locks, with the last byte reserved for initialisation.
+HEADER_SIZE = 4096
+MAX_STRIPES = HEADER_SIZE - 1
+_INIT_LOCK = HEADER_SIZE - 1
+
+# magic, slab size, number of sets, ways per set, number of lock stripes
+_HEADER = struct.Struct("<8sQQQQ")
+
+# key hash, created, last used, status, key length, headers length,
+# body length. A key hash of 0 marks an empty slab. Headers are stored
+# marshalled, so a hit loads them without parsing them in Python. Since
+# marshal is not safe on untrusted data, a segment file is only used if it
+# belongs to the current user and only they can read and write it, see
+# _openSegmentFile().
+_SLAB = struct.Struct("<QddHHII")
+
+# Number of slabs in each set of the hash index. An entry can only be stored
+# in one of the slabs of the set its key hashes to.
+WAYS = 4
+
+
+_O_BINARY = getattr(os, "O_BINARY", 0)
+_O_NOFOLLOW = getattr(os, "O_NOFOLLOW", 0)
+
+
+def _geometry(size, slabSize, stripes):
+    """Return the ``(slabSize, sets, ways, stripes)`` of a new segment."""
+    slabSize = max(slabSize, _SLAB.size + 1)
+    sets = max(1, (size - HEADER_SIZE) // (slabSize * WAYS))
+    stripes = max(1, min(stripes, MAX_STRIPES))
+    return (slabSize, sets, WAYS, stripes)
+
+
+def _lockFile(fd, offset):
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, offset)
+
+
+def _unlockFile(fd, offset):
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset)
+
+
+def _checkPrivate(st, path, mode, isType):
+    """Raise ``PermissionError`` unless ``st``, the status of ``path``, is of
+    the type tested by ``isType`` (e.g. ``stat.S_ISREG``), belongs to the
+    current user and has the permission bits ``mode``.
+    """
+    if not hasattr(os, "getuid"):
+        # Windows has no owners or permission bits to check
+        return
+    if (
+        not isType(st.st_mode)
+        or st.st_uid != os.getuid()
+        or stat.S_IMODE(st.st_mode) != mode
+    ):
+        raise PermissionError(
+            f"Refusing to use {path}, which must belong to the current user "
+            f"and have mode {mode:o}"
+        )
+
+
+def _openSegmentFile(path):
+    """Open the segment file at ``path`` for reading and writing, creating
+    it with mode 0600 if it does not exist.
+
+    Symbolic links are not followed, and an existing file is only used if it
+    belongs to the current user with mode 0600, so that other local users
+    cannot feed the process data or have it truncate their files.
+    """
+    flags = os.O_RDWR | _O_BINARY | _O_NOFOLLOW
+    try:
+        fd = os.open(path, flags | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        fd = os.open(path, flags)
+    else:
+        if hasattr(os, "fchmod"):
+            # Not restricted by the umask
+            os.fchmod(fd, 0o600)
+    try:
+        _checkPrivate(os.fstat(fd), path, 0o600, stat.S_ISREG)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+# Segments open in this process, keyed by process id and path
+_segments = {}
+_segmentsLock = threading.Lock()
+
+
+class _Segment:
+    """The file descriptor, map and stripe thread locks of a segment file,
+    shared by all stores in a process which use the file.
+
+    POSIX record locks are held per process and file, and closing any
+    descriptor of the file, including the one duplicated by a map, releases
+    all of them. So a process opens and maps each segment file once, and
+    closes it only when no store uses it any more.
+    """
+
+    def __init__(self, path, size, slabSize, stripes):
+        self.path = path
+        self.users = 0
+        self.fd = _openSegmentFile(path)
+        try:
+            _lockFile(self.fd, _INIT_LOCK)
+            try:
+                self._initialize(size, slabSize, stripes)
+            finally:
+                _unlockFile(self.fd, _INIT_LOCK)
+            self.mmap = mmap.mmap(self.fd, self.segmentSize)
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.locks = [threading.Lock() for i in range(self.stripes)]
+
+    @property
+    def geometry(self):
+        return (self.slabSize, self.sets, WAYS, self.stripes)
+
+    def warnGeometry(self):
+        logger.warning(
+            "Using the existing geometry of shared memory cache segment %s",
+            self.path,
+        )
+
+    def _initialize(self, size, slabSize, stripes):
+        geometry = _geometry(size, slabSize, stripes)
+
+        # The file is not mapped yet, and only this thread of the process
+        # uses the descriptor, so it is read and written at an explicit
+        # position rather than with os.pread(), which Windows lacks.
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        existing = os.read(self.fd, _HEADER.size)
+        if len(existing) == _HEADER.size:
+            magic, *existingGeometry = _HEADER.unpack(existing)
+            if magic == MAGIC and existingGeometry[2] == WAYS:
+                self.slabSize, self.sets, ways, self.stripes = existingGeometry
+                if self.geometry != geometry:
+                    self.warnGeometry()
+                return
+
+        self.slabSize, self.sets, ways, self.stripes = geometry
+        os.ftruncate(self.fd, 0)
+        os.ftruncate(self.fd, self.segmentSize)
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        os.write(self.fd, _HEADER.pack(MAGIC, *geometry))
+
+    @property
+    def segmentSize(self):
+        return HEADER_SIZE + self.sets * WAYS * self.slabSize
+
+    def close(self):
+        self.mmap.close()
+        os.close(self.fd)
+
+
+def defaultPath(name):
+    """Return the default path of the segment file for a store, in a
+    directory of the current user with mode 0700, in ``/dev/shm`` if
+    available, or the temporary directory otherwise.
+    """
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    user = os.getuid() if hasattr(os, "getuid") else getpass.getuser()
+    directory = os.path.join(base, f"plone.caching-{user}")
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    else:
+        # Not restricted by the umask
+        os.chmod(directory, 0o700)
+    _checkPrivate(os.lstat(directory), directory, 0o700, stat.S_ISDIR)
+    return os.path.join(directory, name)
+
+
+def _hash(key):
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    # Never 0, which marks an empty slab
+    return int.from_bytes(digest, "little") | 1
+
+
+@implementer(ICacheStore)
+class SharedMemoryStore:
+    """Store shared by all processes on a host which open the same segment
+    file, which should normally live on a memory-backed file system such as
+    ``/dev/shm``.
+
+    The segment is divided into fixed-size slabs, each holding one response.
+    Slabs are grouped in sets of ``WAYS``: a key is hashed to a set, and a new
+    entry replaces an empty or the least recently used slab of that set.
+    Responses larger than a slab are not stored.
+
+    Sets are guarded by striped locks, combining a thread lock with a POSIX
+    record lock on one byte of the segment file, so that processes and
+    threads only contend when they touch sets sharing a stripe. Stores in one
+    process using the same file share its descriptor, map and locks. Without
+    POSIX record locks, as on Windows, the store is only safe within one
+    process.
+
+    The segment file is created with mode 0600, and an existing file is only
+    used if it belongs to the current user with that mode. By default, it is
+    kept in a directory of the current user with mode 0700, see
+    ``defaultPath()``.
+
+    If the segment file already exists with a different geometry (slab size,
+    number of sets or stripes), the existing geometry is used, so that all
+    processes agree on it.
+    """
+
+    def __init__(
+        self, name, path=None, size=64 * 1024 * 1024, slabSize=64 * 1024, stripes=64
+    ):
+        self.name = name
+        self.path = path or defaultPath(name)
+
+        # A segment inherited from the parent of a forked process is not
+        # shared with it, as its thread locks may have been held at the fork.
+        self._segmentKey = (os.getpid(), self.path)
+        with _segmentsLock:
+            segment = _segments.get(self._segmentKey)
+            if segment is None:
+                segment = _Segment(self.path, size, slabSize, stripes)
+                _segments[self._segmentKey] = segment
+            elif segment.geometry != _geometry(size, slabSize, stripes):
+                segment.warnGeometry()
+            segment.users += 1
+
+        self._segment = segment
+        self._fd = segment.fd
+        self._mmap = segment.mmap
+        self._locks = segment.locks
+        self.slabSize = segment.slabSize
+        self.sets = segment.sets
+        self.stripes = segment.stripes
+
+    @property
+    def segmentSize(self):
+        return HEADER_SIZE + self.sets * WAYS * self.slabSize
+
+    def _lockFile(self, offset):
+        _lockFile(self._fd, offset)
+
+    def _unlockFile(self, offset):
+        _unlockFile(self._fd, offset)
+
+    def _acquire(self, index):
+        stripe = index % self.stripes
+        self._locks[stripe].acquire()
+        try:
+            self._lockFile(stripe)
+        except BaseException:
+            self._locks[stripe].release()
+            raise
+        return stripe
+
+    def _release(self, stripe):
+        try:
+            self._unlockFile(stripe)
+        finally:
+            self._locks[stripe].release()
+
+    def _offsets(self, index):
+        start = HEADER_SIZE + index * WAYS * self.slabSize
+        return range(start, start + WAYS * self.slabSize, self.slabSize)
+
+    def _find(self, index, keyHash, key):
+        # Must be called with the stripe lock held
+        mm = self._mmap
+        for offset in self._offsets(index):
+            slab = _SLAB.unpack_from(mm, offset)
+            if slab[0] != keyHash:
+                continue
+            start = offset + _SLAB.size
+            if mm[start : start + slab[4]] == key:
+                return offset, slab
+        return None, None
+
+    def get(self, key):
+        key = key.encode("utf-8")
+        keyHash = _hash(key)
+        index = keyHash % self.sets
+        mm = self._mmap
+
+        stripe = self._acquire(index)
+        try:
+            offset, slab = self._find(index, keyHash, key)
+            if offset is None:
+                return None
+
+            keyHash, created, used, status, keyLength, headersLength, bodyLength = slab
+            struct.pack_into("<d", mm, offset + 16, time.time())
+
+            start = offset + _SLAB.size + keyLength
+            headers = mm[start : start + headersLength]
+            start += headersLength
+            # Slicing the map copies the body out of the segment in one go
+            body = mm[start : start + bodyLength]
+        finally:
+            self._release(stripe)
+
+        return CachedResponse(
+            status,
+            marshal.loads(headers),
+            body,
+            created,
+            size=headersLength + bodyLength,
+        )
+
+    def set(self, key, response):
+        key = key.encode("utf-8")
+        headers = marshal.dumps(
+            tuple((str(name), str(value)) for name, value in response.headers)
+        )
+        body = response.body
+        length = _SLAB.size + len(key) + len(headers) + len(body)
+        if length > self.slabSize or len(key) > 0xFFFF:
+            return False
+
+        keyHash = _hash(key)
+        index = keyHash % self.sets
+        mm = self._mmap
+        evicted = False
+
+        stripe = self._acquire(index)
+        try:
+            offset, slab = self._find(index, keyHash, key)
+            if offset is None:
+                # Use an empty slab, or evict the least recently used one
+                victim = victimUsed = None
+                for candidate in self._offsets(index):
+                    slab = _SLAB.unpack_from(mm, candidate)
+                    if slab[0] == 0:
+                        victim = candidate
+                        break
+                    if victim is None or slab[2] < victimUsed:
+                        victim, victimUsed = candidate, slab[2]
+                else:
+                    evicted = True
+                offset = victim
+
+            start = offset + _SLAB.size
+            end = start + len(key)
+            mm[start:end] = key
+            start, end = end, end + len(headers)
+            mm[start:end] = headers
+            start, end = end, end + len(body)
+            mm[start:end] = body
+            _SLAB.pack_into(
+                mm,
+                offset,
+                keyHash,
+                response.created,
+                time.time(),
+                response.status,
+                len(key),
+                len(headers),
+                len(body),
+            )
+        finally:
+            self._release(stripe)
+
+        if evicted:
+            statistics.increment("caches", self.name, "evictions")
+        return True
+
+    def delete(self, key):
+        key = key.encode("utf-8")
+        keyHash = _hash(key)
+        index = keyHash % self.sets
+
+        stripe = self._acquire(index)
+        try:
+            offset, slab = self._find(index, keyHash, key)
+            if offset is not None:
+                struct.pack_into("<Q", self._mmap, offset, 0)
+        finally:
+            self._release(stripe)
+
+    def clear(self):
+        for index in range(self.sets):
+            stripe = self._acquire(index)
+            try:
+                for offset in self._offsets(index):
+                    struct.pack_into("<Q", self._mmap, offset, 0)
+            finally:
+                self._release(stripe)
+
+    def close(self):
+        """Release the segment. It is unmapped when no other store in this
+        process uses it, and the segment file is left in place for other
+        processes.
+        """
+        segment = self._segment
+        if segment is None:
+            return
+        self._segment = None
+        with _segmentsLock:
+            segment.users -= 1
+            if segment.users:
+                return
+            if _segments.get(self._segmentKey) is segment:
+                del _segments[self._segmentKey]
+        segment.close()
@@ -0,0 +1,175 @@
+from bisect import bisect_left
+from plone.caching.interfaces import ICachingStatistics
+from zope.interface import implementer
+
+import threading
+import weakref
+
+# Upper bounds, in seconds, of the latency histogram buckets: 50 microseconds
+# doubling up to about 1.6 seconds. Observations above the last bound are
+# counted in an implicit +Inf bucket.
+LATENCY_BUCKETS = tuple(0.00005 * 2**i for i in range(16))
+
+
+class _Shard:
+    """The counters and histograms recorded by a single thread."""
+
+    __slots__ = ("counts", "histograms", "thread")
+
+    def __init__(self, thread=None):
+        self.counts = {}
+        # (section, name) -> [bucket counts..., +Inf count, sum]
+        self.histograms = {}
+        self.thread = weakref.ref(thread) if thread is not None else None
+
+    def alive(self):
+        thread = self.thread()
+        return thread is not None and thread.is_alive()
+
+    def merge(self, other):
+        """Add the counters and histograms of another shard to this one."""
+        counts = self.counts
+        for key, value in other.counts.copy().items():
+            counts[key] = counts.get(key, 0) + value
+
+        histograms = self.histograms
+        for key, histogram in other.histograms.copy().items():
+            # list() is atomic, although the sum may be updated a moment
+            # before or after the bucket it belongs to
+            histogram = list(histogram)
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = histogram
+            else:
+                for i, value in enumerate(histogram):
+                    total[i] += value
+
+
+@implementer(ICachingStatistics)
+class CachingStatistics:
+    """Per-rule and per-operation counters and latency histograms.
+
+    Each thread records into its own shard, so that Zope worker threads never
+    contend on a lock when recording. Shards are only ever written by their
+    own thread; snapshots read a copy of each shard and subtract the totals
+    recorded at the last reset, so resetting never loses concurrent
+    increments. The shards of finished threads are folded into a single
+    one, so the memory used is proportional to the number of rules,
+    operations and live threads, not to the number of requests recorded or
+    of threads ever started.
+    """
+
+    buckets = LATENCY_BUCKETS
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._baseline = {}
+        self._histogramBaseline = {}
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._prune()
+                self._shards.append(shard)
+            return shard
+
+    def _prune(self):
+        # Called with the lock held. Finished threads no longer write to
+        # their shards, so they can be merged safely.
+        alive = []
+        for shard in self._shards:
+            if shard.alive():
+                alive.append(shard)
+            else:
+                self._retired.merge(shard)
+        self._shards = alive
+
+    def _totals(self):
+        # Called with the lock held
+        self._prune()
+        totals = _Shard()
+        totals.merge(self._retired)
+        for shard in self._shards:
+            totals.merge(shard)
+        return totals
+
+    def increment(self, section, name, counter, value=1):
+        counts = self._shard().counts
+        key = (section, name, counter)
+        counts[key] = counts.get(key, 0) + value
+
+    def observe(self, section, name, seconds):
+        histograms = self._shard().histograms
+        key = (section, name)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            totals = self._totals().counts
+            baseline = self._baseline
+            if reset:
+                self._baseline = totals
+
+        result = {}
+        for (section, name, counter), value in totals.items():
+            value -= baseline.get((section, name, counter), 0)
+            if value:
+                result.setdefault(section, {}).setdefault(name, {})[counter] = value
+        return result
+
+    def histograms(self, reset=False):
+        with self._lock:
+            totals = self._totals().histograms
+            baseline = self._histogramBaseline
+            if reset:
+                self._histogramBaseline = totals
+
+        result = {}
+        for (section, name), histogram in totals.items():
+            previous = baseline.get((section, name))
+            if previous is not None:
+                histogram = [a - b for a, b in zip(histogram, previous)]
+
+            cumulative = []
+            count = 0
+            for value in histogram[:-1]:
+                count += value
+                cumulative.append(count)
+            if count:
+                result.setdefault(section, {})[name] = {
+                    "buckets": tuple(cumulative),
+                    "count": count,
+                    "sum": histogram[-1],
+                }
+        return result
+
+    def reset(self):
+        # Both baselines are taken at once, so that no snapshot sees the
+        # counters reset but not the histograms, or the other way round
+        with self._lock:
+            totals = self._totals()
+            self._baseline = totals.counts
+            self._histogramBaseline = totals.histograms
+
+
+# The statistics utility fed by the hooks in this package. It is registered
+# as a utility in ZCML, but used directly by the hooks to avoid a lookup.
+statistics = CachingStatistics()
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(statistics.reset)
+    del addCleanUp
@@ -0,0 +1,192 @@
+from collections import OrderedDict
+from plone.caching.interfaces import ICachedResponse
+from plone.caching.interfaces import ICacheWriter
+from plone.caching.interfaces import IStreamingCacheStore
+from plone.caching.interfaces import ITaggedCacheStore
+from plone.caching.stats import statistics
+from zope.interface import implementer
+
+import threading
+import time
+
+
+@implementer(ICachedResponse)
+class CachedResponse:
+    """A response stored in an ``ICacheStore``."""
+
+    __slots__ = ("status", "headers", "body", "created", "size", "tags")
+
+    def __init__(self, status, headers, body, created=None, size=None, tags=()):
+        self.status = status
+        self.headers = tuple(headers)
+        self.body = body
+        self.created = time.time() if created is None else created
+        self.tags = tuple(tags)
+        # Approximate number of bytes used by the response
+        if size is None:
+            size = (
+                len(body)
+                + sum(len(name) + len(value) for name, value in self.headers)
+                + sum(len(tag) for tag in self.tags)
+            )
+        self.size = size
+
+    def __repr__(self):
+        return f"<CachedResponse {self.status} {self.size} bytes>"
+
+
+@implementer(ICacheWriter)
+class BufferedCacheWriter:
+    """Writer for stores which cannot store a body written in chunks. The
+    chunks are kept in memory until the response is committed, and then
+    stored with ``set()``.
+    """
+
+    def __init__(self, store, key, status, headers, tags=()):
+        self.store = store
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.tags = tags
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def commit(self):
+        body = b"".join(self._chunks)
+        self._chunks = []
+        response = CachedResponse(self.status, self.headers, body, tags=self.tags)
+        return self.store.set(self.key, response)
+
+    def abort(self):
+        self._chunks = []
+
+
+def openWriter(store, key, status, headers, tags=()):
+    """Return an ``ICacheWriter`` storing a response under ``key`` in the
+    store, buffering the body in memory unless the store is an
+    ``IStreamingCacheStore``.
+    """
+
+    if IStreamingCacheStore.providedBy(store):
+        return store.open(key, status, headers, tags)
+    return BufferedCacheWriter(store, key, status, headers, tags)
+
+
+@implementer(ITaggedCacheStore)
+class RAMStore:
+    """In-process least recently used store, bounded by the number of
+    entries and by their total size in bytes.
+
+    The store keeps an index from each tag to the keys of the entries stored
+    with it, so that invalidating a tag costs time proportional to the number
+    of entries removed. The index is updated whenever an entry is replaced,
+    deleted or evicted, and its approximate size is counted towards
+    ``maxSize``.
+    """
+
+    def __init__(self, name, maxEntries=1000, maxSize=64 * 1024 * 1024):
+        self.name = name
+        self.maxEntries = maxEntries
+        self.maxSize = maxSize
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # tag -> set of keys
+        self._tags = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+            return response
+
+    def set(self, key, response):
+        size = _cost(key, response)
+        if size > self.maxSize:
+            return False
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._remove(key, previous)
+            self._entries[key] = response
+            self.size += size
+            for tag in response.tags:
+                keys = self._tags.get(tag)
+                if keys is None:
+                    keys = self._tags[tag] = set()
+                keys.add(key)
+            evicted = self._evict()
+
+        if evicted:
+            statistics.increment("caches", self.name, "evictions", evicted)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            response = self._entries.pop(key, None)
+            if response is not None:
+                self._remove(key, response)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.size = 0
+
+    def invalidateTags(self, tags):
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                keys = self._tags.get(tag)
+                if not keys:
+                    continue
+                for key in list(keys):
+                    self._remove(key, self._entries.pop(key))
+                    removed += 1
+
+        if removed:
+            statistics.increment("caches", self.name, "invalidations", removed)
+        return removed
+
+    def resize(self, maxEntries, maxSize):
+        """Change the bounds of the store, evicting entries if required."""
+        with self._lock:
+            self.maxEntries = maxEntries
+            self.maxSize = maxSize
+            evicted = self._evict()
+
+        if evicted:
+            statistics.increment("caches", self.name, "evictions", evicted)
+
+    def _evict(self):
+        # Must be called with the lock held
+        evicted = 0
+        entries = self._entries
+        while entries and (len(entries) > self.maxEntries or self.size > self.maxSize):
+            key, response = entries.popitem(last=False)
+            self._remove(key, response)
+            evicted += 1
+        return evicted
+
+    def _remove(self, key, response):
+        # Must be called with the lock held, once the entry has been removed
+        # from the entries
+        self.size -= _cost(key, response)
+        for tag in response.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+def _cost(key, response):
+    # The size of an entry, including its references in the tag index
+    return response.size + len(key) * len(response.tags)
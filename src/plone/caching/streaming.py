@@ -0,0 +1,317 @@
+from plone.caching.stats import statistics
+from zope.component import adapter
+from zope.interface import implementer
+from ZPublisher.interfaces import IPubEnd
+from ZPublisher.interfaces import IPubSuccess
+from ZPublisher.Iterators import IStreamIterator
+from ZPublisher.Iterators import IUnboundStreamIterator
+
+import io
+import logging
+
+logger = logging.getLogger("plone.caching")
+
+# Name of the request attribute holding the ``Tee`` of a response written
+# with ``response.write()``
+_STREAM_KEY = "_plone_caching_stream"
+
+
+class Tee:
+    """Copies the chunks of a response body to an ``ICacheWriter`` as they
+    are sent to the client.
+
+    The writer is aborted as soon as more than ``maxSize`` bytes are
+    written, so no more than one chunk is held at a time by the tee itself.
+    Errors of the writer are logged and abort it, but never affect the
+    response. ``finished``, if given, is called once the response has been
+    stored or discarded.
+    """
+
+    def __init__(self, name, writer, maxSize, finished=None):
+        self.name = name
+        self.writer = writer
+        self.maxSize = maxSize
+        self.size = 0
+        self.finished = finished
+
+    def write(self, data):
+        writer = self.writer
+        if writer is None:
+            return
+
+        self.size += len(data)
+        if self.size > self.maxSize:
+            self.abort()
+            return
+        try:
+            writer.write(data)
+        except Exception:
+            logger.exception("Error writing streamed response to %s", self.name)
+            self.abort()
+
+    def commit(self):
+        """Store the response, if nothing went wrong while it was written."""
+
+        writer, self.writer = self.writer, None
+        if writer is None:
+            return False
+        try:
+            stored = writer.commit()
+        except Exception:
+            logger.exception("Error storing streamed response in %s", self.name)
+            stored = False
+        if stored:
+            statistics.increment("caches", self.name, "stored")
+        self._finish()
+        return stored
+
+    def abort(self):
+        """Discard the response."""
+
+        writer, self.writer = self.writer, None
+        if writer is None:
+            return
+        try:
+            writer.abort()
+        except Exception:
+            logger.exception("Error discarding streamed response in %s", self.name)
+        self._finish()
+
+    def _finish(self):
+        finished, self.finished = self.finished, None
+        if finished is not None:
+            try:
+                finished()
+            except Exception:
+                logger.exception("Error finishing streamed response in %s", self.name)
+
+
+@implementer(IUnboundStreamIterator)
+class TeeIterator:
+    """Stream iterator passing on the chunks of another one, and copying
+    them to a ``Tee``. The response is stored once the iterator is exhausted,
+    and discarded if it is closed before, e.g. because the client went away.
+    """
+
+    def __init__(self, iterator, tee):
+        self.iterator = iterator
+        self.tee = tee
+        self._next = iter(iterator).__next__
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            data = self._next()
+        except StopIteration:
+            self.tee.commit()
+            raise
+        except BaseException:
+            self.tee.abort()
+            raise
+        self.tee.write(data)
+        return data
+
+    def close(self):
+        self.tee.abort()
+        close = getattr(self.iterator, "close", None)
+        if close is not None:
+            close()
+
+
+@implementer(IStreamIterator)
+class BoundTeeIterator(TeeIterator):
+    """``TeeIterator`` for a stream iterator of known length."""
+
+    def __len__(self):
+        return len(self.iterator)
+
+
+class TeeStream:
+    """Wrapper for the output stream ``response.write()`` writes to, copying
+    what is written to a ``Tee``.
+    """
+
+    def __init__(self, stream, tee):
+        self.stream = stream
+        self.tee = tee
+
+    def write(self, data):
+        result = self.stream.write(data)
+        self.tee.write(data)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def teeIterator(iterator, tee):
+    """Return a stream iterator sending the chunks of ``iterator`` and
+    copying them to ``tee``. It provides ``IStreamIterator`` if ``iterator``
+    does.
+    """
+
+    if IStreamIterator.providedBy(iterator):
+        return BoundTeeIterator(iterator, tee)
+    return TeeIterator(iterator, tee)
+
+
+def teeStreamedResponse(request, response, tee):
+    """Copy everything written with ``response.write()`` to ``tee``. The
+    response is stored when the request ends successfully, and discarded
+    otherwise.
+    """
+
+    previous = request.__dict__.get(_STREAM_KEY)
+    if previous is not None:
+        previous.abort()
+    response.stdout = TeeStream(response.stdout, tee)
+    try:
+        setattr(request, _STREAM_KEY, tee)
+    except AttributeError:
+        tee.abort()
+
+
+def finishStreamedResponse(request, success):
+    """Store or discard the response written with ``response.write()``."""
+
+    tee = request.__dict__.pop(_STREAM_KEY, None)
+    if tee is None:
+        return
+
+    response = request.response
+    body = getattr(response, "body", b"")
+    if not success or response.getStatus() != 200:
+        tee.abort()
+    elif not isinstance(body, bytes):
+        # A stream iterator is sent after the written data
+        tee.abort()
+    else:
+        if body:
+            tee.write(body)
+        tee.commit()
+
+
+@adapter(IPubEnd)
+def requestEnded(event):
+    """Store the response written with ``response.write()`` once the request
+    has succeeded.
+    """
+    finishStreamedResponse(event.request, IPubSuccess.providedBy(event))
+
+
+@implementer(IStreamIterator)
+class BufferStreamIterator:
+    """Stream iterator sending a buffer in chunks of at most ``streamsize``
+    bytes, so that only one chunk at a time is copied out of it.
+    """
+
+    def __init__(self, buffer, streamsize=1 << 16):
+        self.buffer = memoryview(buffer).cast("B")
+        self.streamsize = streamsize
+        self._position = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = self._position
+        if start >= len(self.buffer):
+            raise StopIteration
+        self._position = end = start + self.streamsize
+        return bytes(self.buffer[start:end])
+
+    def __len__(self):
+        return len(self.buffer) - min(self._position, len(self.buffer))
+
+    def close(self):
+        self.buffer.release()
+
+
+@implementer(IUnboundStreamIterator)
+class FileStreamIterator:
+    """Stream iterator reading a file-like object in chunks of at most
+    ``streamsize`` bytes. The file is closed when the iterator is.
+    """
+
+    def __init__(self, file, streamsize=1 << 16):
+        self.file = file
+        self.streamsize = streamsize
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.file.read(self.streamsize)
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self):
+        close = getattr(self.file, "close", None)
+        if close is not None:
+            close()
+
+
+@implementer(IStreamIterator)
+class BoundFileStreamIterator(FileStreamIterator):
+    """``FileStreamIterator`` for a seekable file."""
+
+    def __len__(self):
+        file = self.file
+        position = file.tell()
+        file.seek(0, io.SEEK_END)
+        size = file.tell()
+        file.seek(position)
+        return size - position
+
+
+def publishableBody(body, streamsize=1 << 16):
+    """Return a response body returned by ``interceptResponse()`` in a form
+    ZPublisher sends without reading it into memory or copying it as a
+    whole.
+
+    Strings, stream iterators and seekable ``io`` files are returned
+    unchanged: ZPublisher sends the latter two as they are, using the
+    server's ``wsgi.file_wrapper`` for files. Other file-like objects are
+    read in chunks of ``streamsize`` bytes, since ZPublisher seeks to the end
+    of a file to find its length, which pipes and sockets do not support. A
+    memoryview of a whole byte string is replaced by the byte string, and
+    other buffers larger than ``streamsize`` are sent in chunks, since WSGI
+    only allows byte strings to be sent.
+    """
+
+    if body is None or isinstance(body, (str, bytes)):
+        return body
+    if isinstance(body, io.IOBase) and _seekable(body):
+        return body
+    if IUnboundStreamIterator.providedBy(body):
+        return body
+
+    if isinstance(body, (bytearray, memoryview)):
+        view = memoryview(body)
+        whole = type(view.obj) is bytes and view.nbytes == len(view.obj)
+        if whole and view.c_contiguous:
+            return view.obj
+        if view.nbytes <= streamsize or not view.c_contiguous:
+            return view.tobytes()
+        return BufferStreamIterator(view, streamsize)
+
+    if hasattr(body, "read"):
+        if _seekable(body):
+            return BoundFileStreamIterator(body, streamsize)
+        return FileStreamIterator(body, streamsize)
+
+    return body
+
+
+def _seekable(file):
+    seekable = getattr(file, "seekable", None)
+    if seekable is not None:
+        try:
+            return seekable()
+        except ValueError:
+            # Closed
+            return False
+    return hasattr(file, "seek") and hasattr(file, "tell")
@@ -0,0 +1,84 @@
+from plone.caching.interfaces import _
+from plone.caching.interfaces import ICacheTags
+from plone.caching.interfaces import ICachingOperation
+from plone.caching.interfaces import ICachingOperationType
+from plone.caching.utils import lookupOptions
+from zope.component import adapter
+from zope.component import getAdapters
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.interface import provider
+
+# Name of the request attribute holding the memoised tags of the published
+# object, as a tuple ``(published, tags)``.
+_MEMO_KEY = "_plone_caching_tags"
+
+DEFAULT_HEADERS = ("Surrogate-Key", "xkey")
+
+
+def getTags(obj):
+    """Return a tuple of the tags of all ``ICacheTags`` adapters of an
+    object, without duplicates.
+    """
+
+    tags = {}
+    for name, adapted in getAdapters((obj,), ICacheTags):
+        for tag in adapted() or ():
+            if tag:
+                tags[tag] = None
+    return tuple(tags)
+
+
+def getCacheTags(published, request):
+    """Return the tags of the published object, computed at most once per
+    request.
+    """
+
+    memo = request.__dict__.get(_MEMO_KEY)
+    if memo is not None and memo[0] is published:
+        return memo[1]
+
+    tags = getTags(published)
+    try:
+        setattr(request, _MEMO_KEY, (published, tags))
+    except AttributeError:
+        pass
+    return tags
+
+
+@implementer(ICachingOperation)
+@provider(ICachingOperationType)
+@adapter(Interface, Interface)
+class SurrogateKeys:
+    """Caching operation which sets the ``Surrogate-Key`` and ``xkey``
+    headers, understood by Fastly and by Varnish with the xkey module, to the
+    tags of the published object. The headers set are listed in the
+    ``headers`` option.
+    """
+
+    title = _("Surrogate keys")
+    description = _(
+        "Sets Surrogate-Key and xkey headers from the cache tags of the "
+        "published object, for tag-based invalidation"
+    )
+    prefix = "plone.caching.operations.surrogatekeys"
+    options = ("headers",)
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def interceptResponse(self, rulename, response):
+        return None
+
+    def modifyResponse(self, rulename, response):
+        tags = getCacheTags(self.published, self.request)
+        if not tags:
+            return
+
+        headers = lookupOptions(self.__class__, rulename)["headers"]
+        if headers is None:
+            headers = DEFAULT_HEADERS
+        value = " ".join(tags)
+        for name in headers:
+            response.setHeader(name, value)
@@ -0,0 +1,138 @@
+from plone.caching.cachekey import addVary
+from plone.caching.cachekey import CacheKey
+from plone.caching.cachekey import getCacheKey
+from plone.caching.cachekey import hashKey
+from plone.caching.cachekey import LayersCacheKey
+from plone.caching.cachekey import mergeVary
+from plone.caching.interfaces import ICacheKey
+from plone.caching.testing import IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+from zope.component import provideAdapter
+from zope.interface import alsoProvides
+from zope.interface import Interface
+from zope.interface.verify import verifyClass
+
+import unittest
+
+
+class DummyView:
+    pass
+
+
+class DummyResponse(dict):
+    def setHeader(self, name, value):
+        self[name] = value
+
+    def getHeader(self, name):
+        return self.get(name)
+
+
+class DummyRequest(dict):
+    def __init__(self, url="http://example.com/page", query="", headers=None):
+        self["ACTUAL_URL"] = url
+        self.environ = {"REQUEST_METHOD": "GET", "QUERY_STRING": query}
+        self.headers = headers or {}
+        self.cookies = {}
+
+    def getHeader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class IThemeLayer(Interface):
+    pass
+
+
+class ProtocolCacheKey(CacheKey):
+    headers = ("X-Forwarded-Proto",)
+    cookies = ("I18N_LANGUAGE",)
+
+
+class TestCacheKey(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def key(self, factory, request):
+        return factory(DummyView(), request)()
+
+    def test_interface(self):
+        self.assertTrue(verifyClass(ICacheKey, CacheKey))
+
+    def test_url_and_query(self):
+        key = self.key(CacheKey, DummyRequest(query="b_start=20"))
+        self.assertEqual(hashKey(["http://example.com/page", "b_start=20"]), key)
+        self.assertEqual(32, len(key))
+        self.assertNotEqual(key, self.key(CacheKey, DummyRequest()))
+        self.assertEqual((), CacheKey(DummyView(), DummyRequest()).vary)
+
+    def test_no_url(self):
+        request = DummyRequest()
+        del request["ACTUAL_URL"]
+        self.assertEqual(None, self.key(CacheKey, request))
+
+    def test_headers_and_cookies(self):
+        request = DummyRequest(headers={"X-Forwarded-Proto": "https"})
+        key = self.key(ProtocolCacheKey, request)
+
+        request = DummyRequest(headers={"X-Forwarded-Proto": "http"})
+        self.assertNotEqual(key, self.key(ProtocolCacheKey, request))
+
+        request = DummyRequest(headers={"X-Forwarded-Proto": "https"})
+        request.cookies["I18N_LANGUAGE"] = "de"
+        self.assertNotEqual(key, self.key(ProtocolCacheKey, request))
+
+        self.assertEqual(
+            ("X-Forwarded-Proto", "Cookie"),
+            ProtocolCacheKey(DummyView(), request).vary,
+        )
+
+    def test_layers(self):
+        key = self.key(LayersCacheKey, DummyRequest())
+        request = DummyRequest()
+        alsoProvides(request, IThemeLayer)
+        self.assertNotEqual(key, self.key(LayersCacheKey, request))
+        self.assertEqual(
+            ("Accept-Language",), LayersCacheKey(DummyView(), request).vary
+        )
+
+    def test_getCacheKey_memoised(self):
+        calls = []
+
+        class CountingCacheKey(CacheKey):
+            def __call__(self):
+                calls.append(self)
+                return super().__call__()
+
+        provideAdapter(CountingCacheKey, name="counting")
+        published = DummyView()
+        request = DummyRequest()
+
+        key = getCacheKey(published, request, "counting")
+        self.assertEqual(key, getCacheKey(published, request, "counting"))
+        self.assertEqual(1, len(calls))
+        self.assertEqual((None, ()), getCacheKey(published, request, "unknown"))
+
+    def test_addVary(self):
+        response = DummyResponse()
+        addVary(response, ())
+        self.assertEqual({}, response)
+
+        addVary(response, ("Accept-Language",))
+        self.assertEqual("Accept-Language", response["Vary"])
+
+        addVary(response, ("accept-language", "Cookie"))
+        self.assertEqual("Accept-Language, Cookie", response["Vary"])
+
+        response["Vary"] = "*"
+        addVary(response, ("Cookie",))
+        self.assertEqual("*", response["Vary"])
+
+    def test_mergeVary(self):
+        self.assertEqual(None, mergeVary(None, ()))
+        self.assertEqual("Cookie", mergeVary(None, ("Cookie",)))
+        self.assertEqual("Cookie", mergeVary("Cookie", ("cookie",)))
+        self.assertEqual(
+            "Cookie, Accept-Encoding", mergeVary("Cookie", ("Accept-Encoding",))
+        )
+        self.assertEqual("*", mergeVary("*", ("Cookie",)))
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,250 @@
+from datetime import datetime
+from datetime import timezone
+from plone.caching.conditional import CatalogCounter
+from plone.caching.conditional import ConditionalResponse
+from plone.caching.conditional import getETag
+from plone.caching.conditional import getLastModified
+from plone.caching.conditional import Language
+from plone.caching.conditional import LastModified
+from plone.caching.conditional import PersistentLastModified
+from plone.caching.conditional import UserID
+from plone.caching.interfaces import IETagValue
+from plone.caching.interfaces import ILastModified
+from plone.caching.testing import IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+from plone.registry import field
+from plone.registry import Record
+from plone.registry import Registry
+from plone.registry.interfaces import IRegistry
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.interface import implementer
+from zope.interface import Interface
+
+import unittest
+
+MODIFIED = datetime(2026, 1, 2, 3, 4, 5, 678, tzinfo=timezone.utc)
+
+
+class DummyView:
+    pass
+
+
+class DummyResponse(dict):
+    status = 200
+
+    def setHeader(self, name, value):
+        self[name] = value
+
+    def setStatus(self, value, lock=None):
+        self.status = value
+
+
+class DummyRequest(dict):
+    def __init__(self, published, response, headers=None):
+        self["PUBLISHED"] = published
+        self.response = response
+        self.environ = {"REQUEST_METHOD": "GET"}
+        self.headers = headers or {}
+
+    def getHeader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class TestConditionalResponse(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        self.registry = Registry()
+        provideUtility(self.registry, IRegistry)
+        self.calls = calls = []
+
+        @implementer(IETagValue)
+        @adapter(Interface, Interface)
+        class Counter:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def __call__(self):
+                calls.append("counter")
+                return "42"
+
+        @implementer(ILastModified)
+        @adapter(Interface)
+        class Modified:
+            def __init__(self, published):
+                pass
+
+            def __call__(self):
+                calls.append("modified")
+                return MODIFIED
+
+        provideAdapter(Counter, name="counter")
+        provideAdapter(Modified)
+
+    def setOptions(self, etags=("counter",), lastModified=True):
+        prefix = ConditionalResponse.prefix
+        self.registry.records[f"{prefix}.etags"] = Record(
+            field.Tuple(value_type=field.TextLine()), etags
+        )
+        self.registry.records[f"{prefix}.lastModified"] = Record(
+            field.Bool(), lastModified
+        )
+
+    def publish(self, **headers):
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse(), headers)
+        operation = ConditionalResponse(view, request)
+        value = operation.interceptResponse("testrule", request.response)
+        if value is None:
+            operation.modifyResponse("testrule", request.response)
+        return request, value
+
+    def test_no_options(self):
+        request, value = self.publish(**{"If-None-Match": '"42"'})
+        self.assertEqual(None, value)
+        self.assertEqual({}, dict(request.response))
+
+    def test_headers(self):
+        self.setOptions(etags=("counter", "unknown"))
+        request, value = self.publish()
+
+        self.assertEqual(None, value)
+        self.assertEqual(
+            {
+                "ETag": '"42|"',
+                "Last-Modified": "Fri, 02 Jan 2026 03:04:05 GMT",
+            },
+            dict(request.response),
+        )
+
+    def test_if_none_match(self):
+        self.setOptions()
+        request, value = self.publish(**{"If-None-Match": 'W/"1", "42|"'})
+        self.assertEqual(None, value)
+
+        request, value = self.publish(**{"If-None-Match": '"1", W/"42"'})
+        self.assertEqual("", value)
+        self.assertEqual(304, request.response.status)
+        self.assertEqual('"42"', request.response["ETag"])
+
+        request, value = self.publish(**{"If-None-Match": "*"})
+        self.assertEqual("", value)
+
+    def test_no_etag_values(self):
+        self.setOptions(etags=("unknown", "other"), lastModified=False)
+        request, value = self.publish(**{"If-None-Match": '"|"'})
+        self.assertEqual(None, value)
+        self.assertEqual({}, dict(request.response))
+
+        request, value = self.publish(**{"If-None-Match": "*"})
+        self.assertEqual(None, value)
+
+        self.assertEqual(None, getETag(DummyView(), request, ("unknown",)))
+
+    def test_if_none_match_takes_precedence(self):
+        self.setOptions()
+        request, value = self.publish(
+            **{
+                "If-None-Match": '"1"',
+                "If-Modified-Since": "Fri, 02 Jan 2026 03:04:05 GMT",
+            }
+        )
+        self.assertEqual(None, value)
+
+    def test_if_modified_since(self):
+        self.setOptions(etags=())
+        request, value = self.publish(
+            **{"If-Modified-Since": "Fri, 02 Jan 2026 03:04:05 GMT"}
+        )
+        self.assertEqual("", value)
+        self.assertEqual(304, request.response.status)
+
+        request, value = self.publish(
+            **{"If-Modified-Since": "Fri, 02 Jan 2026 03:04:04 GMT"}
+        )
+        self.assertEqual(None, value)
+
+        request, value = self.publish(**{"If-Modified-Since": "garbage"})
+        self.assertEqual(None, value)
+
+    def test_not_get(self):
+        self.setOptions()
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse(), {"If-None-Match": '"42"'})
+        request.environ["REQUEST_METHOD"] = "POST"
+        operation = ConditionalResponse(view, request)
+        self.assertEqual(
+            None, operation.interceptResponse("testrule", request.response)
+        )
+
+    def test_components_computed_once(self):
+        self.setOptions(etags=("counter", "lastModified"))
+        provideAdapter(LastModified, name="lastModified")
+
+        request, value = self.publish(**{"If-None-Match": '"other"'})
+
+        self.assertEqual(None, value)
+        self.assertEqual(f'"42|{int(MODIFIED.timestamp())}"', request.response["ETag"])
+        self.assertEqual(["counter", "modified"], self.calls)
+
+    def test_memo_per_published(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        getETag(request["PUBLISHED"], request, ("counter",))
+        getETag(DummyView(), request, ("counter",))
+        self.assertEqual(["counter", "counter"], self.calls)
+
+    def test_naive_last_modified(self):
+        @implementer(ILastModified)
+        @adapter(DummyView)
+        class Naive:
+            def __init__(self, published):
+                pass
+
+            def __call__(self):
+                return datetime(2026, 1, 2, 3, 4, 5, 678)
+
+        provideAdapter(Naive)
+        view = DummyView()
+        self.assertEqual(
+            MODIFIED.replace(microsecond=0),
+            getLastModified(view, DummyRequest(view, DummyResponse())),
+        )
+
+
+class TestComponents(unittest.TestCase):
+    def test_persistent_last_modified(self):
+        class Content:
+            _p_mtime = MODIFIED.timestamp()
+
+        class View:
+            context = Content()
+
+        self.assertEqual(MODIFIED, PersistentLastModified(View())())
+        self.assertEqual(MODIFIED, PersistentLastModified(Content())())
+        self.assertEqual(None, PersistentLastModified(DummyView())())
+
+    def test_userid(self):
+        self.assertEqual("", UserID(DummyView(), None)())
+
+    def test_language(self):
+        request = DummyRequest(DummyView(), DummyResponse(), {"Accept-Language": "de"})
+        self.assertEqual("de", Language(DummyView(), request)())
+        request["LANGUAGE"] = "en"
+        self.assertEqual("en", Language(DummyView(), request)())
+
+    def test_catalog_counter(self):
+        class Catalog:
+            def getCounter(self):
+                return 7
+
+        class View:
+            portal_catalog = Catalog()
+
+        self.assertEqual("7", CatalogCounter(View(), None)())
+        self.assertEqual(None, CatalogCounter(DummyView(), None)())
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,237 @@
+from plone.caching.diskstore import _removeProcessDirectory
+from plone.caching.diskstore import DiskStore
+from plone.caching.diskstore import processDirectory
+from plone.caching.interfaces import ICacheWriter
+from plone.caching.interfaces import IStreamingCacheStore
+from plone.caching.stats import statistics
+from plone.caching.stores import CachedResponse
+from zope.interface.verify import verifyObject
+from ZPublisher.Iterators import IStreamIterator
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def makeResponse(body=b"x" * 100, headers=(("Content-Type", "application/pdf"),)):
+    return CachedResponse(200, headers, body, 1000.0)
+
+
+def read(response):
+    with response.body as f:
+        return b"".join(f)
+
+
+class TestDiskStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        statistics.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        statistics.reset()
+
+    def files(self):
+        return sorted(
+            name
+            for directory, dirnames, filenames in os.walk(self.path)
+            for name in filenames
+        )
+
+    def test_interface(self):
+        store = DiskStore("test", self.path)
+        self.assertTrue(verifyObject(IStreamingCacheStore, store))
+        self.assertTrue(verifyObject(ICacheWriter, store.open("a", 200, ())))
+
+    def test_get_set_delete(self):
+        store = DiskStore("test", self.path)
+
+        self.assertEqual(None, store.get("a"))
+        self.assertTrue(store.set("a", makeResponse()))
+
+        response = store.get("a")
+        self.assertTrue(IStreamIterator.providedBy(response.body))
+        self.assertEqual(100, len(response.body))
+        self.assertEqual(b"x" * 100, read(response))
+        self.assertEqual(200, response.status)
+        self.assertEqual((("Content-Type", "application/pdf"),), response.headers)
+        self.assertEqual(1000.0, response.created)
+        self.assertEqual(1, len(self.files()))
+
+        store.delete("a")
+        self.assertEqual(None, store.get("a"))
+        self.assertEqual([], self.files())
+
+    def test_content_addressed(self):
+        store = DiskStore("test", self.path)
+        store.set("a", makeResponse())
+        store.set("b", makeResponse())
+
+        self.assertEqual(1, len(self.files()))
+        self.assertEqual(100, store.size)
+
+        store.delete("a")
+        self.assertEqual(b"x" * 100, read(store.get("b")))
+
+        store.set("b", makeResponse(b"other"))
+        self.assertEqual(1, len(self.files()))
+        self.assertEqual(5, store.size)
+
+    def test_no_temporary_files_left(self):
+        store = DiskStore("test", self.path)
+        store.set("a", makeResponse())
+        self.assertFalse([name for name in self.files() if name.startswith(".tmp")])
+
+    def test_open(self):
+        store = DiskStore("test", self.path)
+        writer = store.open("a", 200, [("Content-Type", "application/pdf")])
+        writer.write(b"x" * 60)
+        writer.write(b"x" * 40)
+        self.assertEqual(None, store.get("a"))
+
+        self.assertTrue(writer.commit())
+        response = store.get("a")
+        self.assertEqual(b"x" * 100, read(response))
+        self.assertEqual((("Content-Type", "application/pdf"),), response.headers)
+        self.assertEqual(100, store.size)
+        self.assertFalse(writer.commit())
+
+        # Same body as an existing entry
+        store.set("b", makeResponse())
+        self.assertEqual(1, len(self.files()))
+        self.assertEqual(100, store.size)
+
+    def test_open_abort(self):
+        store = DiskStore("test", self.path)
+        writer = store.open("a", 200, ())
+        writer.write(b"x" * 100)
+        self.assertEqual(1, len(self.files()))
+
+        writer.abort()
+        self.assertFalse(writer.commit())
+        self.assertEqual(None, store.get("a"))
+        self.assertEqual([], self.files())
+
+    def test_open_dropped(self):
+        store = DiskStore("test", self.path)
+        writer = store.open("a", 200, ())
+        writer.write(b"x" * 100)
+        del writer
+        self.assertEqual([], self.files())
+
+    def test_open_size_limits(self):
+        store = DiskStore("test", self.path, maxSize=50, minSize=10)
+        for size in (5, 100):
+            writer = store.open("a", 200, ())
+            writer.write(b"x" * size)
+            self.assertFalse(writer.commit())
+        self.assertEqual(None, store.get("a"))
+        self.assertEqual([], self.files())
+
+    def test_max_size(self):
+        store = DiskStore("test", self.path, maxSize=250)
+        store.set("a", makeResponse(b"a" * 100))
+        store.set("b", makeResponse(b"b" * 100))
+        store.get("a").body.close()
+        store.set("c", makeResponse(b"c" * 100))
+
+        self.assertEqual(None, store.get("b"))
+        self.assertEqual(2, len(self.files()))
+        self.assertEqual(200, store.size)
+        self.assertEqual({"caches": {"test": {"evictions": 1}}}, statistics.snapshot())
+
+    def test_min_size(self):
+        store = DiskStore("test", self.path, minSize=1000)
+        self.assertFalse(store.set("a", makeResponse()))
+        self.assertEqual([], self.files())
+
+    def test_max_entries(self):
+        store = DiskStore("test", self.path, maxEntries=1)
+        store.set("a", makeResponse(b"a"))
+        store.set("b", makeResponse(b"b"))
+
+        self.assertEqual(1, len(store))
+        self.assertEqual(None, store.get("a"))
+
+    def test_file_removed(self):
+        store = DiskStore("test", self.path)
+        store.set("a", makeResponse())
+        for directory, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                os.unlink(os.path.join(directory, name))
+
+        self.assertEqual(None, store.get("a"))
+        self.assertEqual(0, len(store))
+
+    def test_file_replaced_while_opened(self):
+        class Store(DiskStore):
+            replace = False
+
+            def filename(self, digest):
+                if self.replace:
+                    # Another thread stores a new response for the key
+                    # between the lookup and the opening of the file
+                    self.replace = False
+                    self.set("a", makeResponse(b"new"))
+                    return os.path.join(self.path, "missing")
+                return super().filename(digest)
+
+        store = Store("test", self.path)
+        store.set("a", makeResponse(b"old"))
+        store.replace = True
+
+        self.assertEqual(None, store.get("a"))
+        self.assertEqual(b"new", read(store.get("a")))
+
+    def test_leftovers_removed(self):
+        store = DiskStore("test", self.path)
+        store.set("a", makeResponse())
+        open(os.path.join(store.path, ".tmpleftover"), "wb").close()
+        DiskStore("test", self.path)
+        self.assertEqual([], self.files())
+
+    def test_process_directory(self):
+        store = DiskStore("test", self.path)
+        self.assertEqual(os.path.join(self.path, str(os.getpid())), store.path)
+
+        # Files of another process sharing the directory are left alone
+        other = os.path.join(self.path, "1", "ab")
+        os.makedirs(other)
+        open(os.path.join(other, "ab12"), "wb").close()
+        store.set("a", makeResponse())
+        store.clear()
+        DiskStore("test", self.path)
+
+        self.assertEqual(["ab12"], self.files())
+
+    def test_process_directory_removed(self):
+        directory = processDirectory(self.path)
+        os.makedirs(os.path.join(directory, "ab"))
+
+        _removeProcessDirectory(directory, os.getpid() + 1)
+        self.assertTrue(os.path.isdir(directory))
+
+        _removeProcessDirectory(directory, os.getpid())
+        self.assertFalse(os.path.exists(directory))
+
+    def test_temporary_directory(self):
+        store = DiskStore("test")
+        path = store.path
+        store.set("a", makeResponse())
+        self.assertTrue(os.path.isdir(path))
+
+        del store
+        self.assertFalse(os.path.exists(path))
+
+    def test_clear(self):
+        store = DiskStore("test", self.path)
+        store.set("a", makeResponse())
+        store.clear()
+        self.assertEqual(None, store.get("a"))
+        self.assertEqual([], self.files())
+        self.assertEqual(0, store.size)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
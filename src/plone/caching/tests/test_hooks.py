@@ -1,26 +1,59 @@
 from plone.caching.hooks import intercept
 from plone.caching.hooks import Intercepted
 from plone.caching.hooks import InterceptorResponse
+from plone.caching.hooks import modifyResponseBeforeAbort
+from plone.caching.hooks import modifyResponseBeforeCommit
 from plone.caching.hooks import modifyStreamingResponse
 from plone.caching.hooks import MutatorTransform
 from plone.caching.interfaces import ICacheSettings
 from plone.caching.interfaces import ICachingOperation
+from plone.caching.interfaces import IRequestFilterSettings
 from plone.caching.interfaces import IRulesetLookup
+from plone.caching.interfaces import ITimingSettings
 from plone.caching.lookup import DefaultRulesetLookup
+from plone.caching.operations import Chain
+from plone.caching.stats import statistics
 from plone.caching.testing import IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+from plone.caching.utils import registryRecordChanged
+from plone.caching.utils import replaceResponseStream
+from plone.registry import field
+from plone.registry import Record
 from plone.registry import Registry
 from plone.registry.fieldfactory import persistentFieldAdapter
 from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from plone.transformchain.interfaces import DISABLE_TRANSFORM_REQUEST_KEY
+from plone.transformchain.interfaces import ITransform
+from plone.transformchain.zpublisher import applyTransformOnFailure
+from plone.transformchain.zpublisher import applyTransformOnSuccess
+from zExceptions import NotFound
 from ZODB.POSException import ConflictError
 from zope.component import adapter
+from zope.component import getGlobalSiteManager
 from zope.component import getUtility
 from zope.component import provideAdapter
+from zope.component import provideHandler
 from zope.component import provideUtility
+from zope.configuration import config
+from zope.configuration import xmlconfig
 from zope.globalrequest import clearRequest
 from zope.globalrequest import setRequest
 from zope.interface import implementer
 from zope.interface import Interface
-
+from ZPublisher.HTTPResponse import WSGIResponse
+from ZPublisher.interfaces import IPubBeforeAbort
+from ZPublisher.interfaces import IPubBeforeCommit
+from ZPublisher.Iterators import IStreamIterator
+from ZPublisher.Iterators import IUnboundStreamIterator
+from ZPublisher.pubevents import PubBeforeAbort
+
+import AccessControl
+import io
+import plone.caching
+import Products.Five
+import re
+import sys
+import transaction
 import unittest
 import z3c.caching.registry
 
@@ -367,6 +400,58 @@ class TestMutateResponse(unittest.TestCase):
             dict(request.response),
         )
 
+    def test_replace_stream(self):
+        provideAdapter(DefaultRulesetLookup)
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        settings = registry.forInterface(ICacheSettings)
+        settings.enabled = True
+
+        z3c.caching.registry.register(DummyView, "testrule")
+        settings.operationMapping = {"testrule": "op1"}
+
+        @implementer(IStreamIterator)
+        class DummyStream(list):
+            pass
+
+        replacement = DummyStream([b"replaced"])
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                return None
+
+            def modifyResponse(self, rulename, response):
+                replaceResponseStream(self.request, response, replacement)
+
+        provideAdapter(DummyOperation, name="op1")
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        transform = MutatorTransform(view, request)
+
+        self.assertIs(
+            replacement, transform.transformIterable(DummyStream([b"x"]), "utf-8")
+        )
+        self.assertIs(replacement, request.response.body)
+
+        # The transform chain would read an unbound replacement into a
+        # string, so it is not returned
+        @implementer(IUnboundStreamIterator)
+        class DummyUnboundStream(list):
+            pass
+
+        replacement = DummyUnboundStream([b"replaced"])
+        request = DummyRequest(view, DummyResponse())
+        transform = MutatorTransform(view, request)
+        self.assertIsNone(transform.transformIterable(DummyStream([b"x"]), "utf-8"))
+
     def test_off_switch(self):
         provideAdapter(DefaultRulesetLookup)
         provideUtility(Registry(), IRegistry)
@@ -402,6 +487,160 @@ class TestMutateResponse(unittest.TestCase):
         self.assertEqual({}, dict(request.response))
 
 
+class TestModifyResponseBeforeCommit(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(DefaultRulesetLookup)
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        settings = registry.forInterface(ICacheSettings)
+        settings.enabled = True
+
+        z3c.caching.registry.register(DummyView, "testrule")
+        settings.operationMapping = {"testrule": "op1"}
+
+    def provideOperation(self, error=None):
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                return None
+
+            def modifyResponse(self, rulename, response):
+                if error is not None:
+                    raise error
+                response.addHeader("X-Cache-Foo", "test")
+
+        provideAdapter(DummyOperation, name="op1")
+
+    def test_match(self):
+        self.provideOperation()
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+
+        modifyResponseBeforeCommit(DummyEvent(request))
+
+        self.assertEqual({"PUBLISHED": view}, dict(request))
+        self.assertEqual(
+            {
+                "X-Cache-Rule": ["testrule"],
+                "X-Cache-Operation": ["op1"],
+                "X-Cache-Foo": ["test"],
+            },
+            dict(request.response),
+        )
+
+    def test_transforms_disabled(self):
+        self.provideOperation()
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        request.environ[DISABLE_TRANSFORM_REQUEST_KEY] = True
+
+        modifyResponseBeforeCommit(DummyEvent(request))
+
+        self.assertEqual({}, dict(request.response))
+
+    def test_webdav(self):
+        self.provideOperation()
+        for key, value in (
+            ("REQUEST_METHOD", "PROPFIND"),
+            ("REQUEST_METHOD", "PUT"),
+            ("WEBDAV_SOURCE_PORT", "1980"),
+        ):
+            request = DummyRequest(DummyView(), DummyResponse())
+            request[key] = value
+
+            modifyResponseBeforeCommit(DummyEvent(request))
+
+            self.assertEqual({}, dict(request.response), key)
+
+    def test_post(self):
+        self.provideOperation()
+        request = DummyRequest(DummyView(), DummyResponse())
+        request["REQUEST_METHOD"] = "POST"
+
+        modifyResponseBeforeCommit(DummyEvent(request))
+
+        self.assertEqual(["op1"], request.response["X-Cache-Operation"])
+
+    def test_error_response(self):
+        self.provideOperation()
+        request = DummyRequest(DummyView(), DummyResponse())
+
+        try:
+            raise NotFound()
+        except NotFound:
+            modifyResponseBeforeAbort(PubBeforeAbort(request, sys.exc_info(), False))
+
+        self.assertEqual(NotFound, request.response.status)
+        self.assertEqual(["test"], request.response["X-Cache-Foo"])
+
+    def test_error_response_retried(self):
+        self.provideOperation()
+        request = DummyRequest(DummyView(), DummyResponse())
+
+        try:
+            raise ConflictError()
+        except ConflictError:
+            modifyResponseBeforeAbort(PubBeforeAbort(request, sys.exc_info(), True))
+
+        self.assertEqual({}, dict(request.response))
+
+    def test_dont_swallow_conflict_error(self):
+        self.provideOperation(ConflictError())
+        request = DummyRequest(DummyView(), DummyResponse())
+        self.assertRaises(
+            ConflictError, modifyResponseBeforeCommit, DummyEvent(request)
+        )
+
+    def test_swallow_other_error(self):
+        self.provideOperation(AttributeError("Should be swallowed and logged"))
+        request = DummyRequest(DummyView(), DummyResponse())
+        modifyResponseBeforeCommit(DummyEvent(request))
+
+
+class TestEventMutationConfiguration(unittest.TestCase):
+    layer = UNIT_TESTING
+
+    def handlers(self, event):
+        return [
+            registration.handler
+            for registration in getGlobalSiteManager().registeredHandlers()
+            if registration.required[0].isOrExtends(event)
+        ]
+
+    def test_after_transform_chain(self):
+        context = config.ConfigurationMachine()
+        xmlconfig.registerCommonDirectives(context)
+        context.provideFeature("plone-caching-event-mutation")
+        xmlconfig.file("meta.zcml", Products.Five, context=context)
+        xmlconfig.file("permissions.zcml", AccessControl, context=context)
+        xmlconfig.file("configure.zcml", plone.caching, context=context)
+
+        self.assertEqual(
+            [applyTransformOnSuccess, modifyResponseBeforeCommit],
+            self.handlers(IPubBeforeCommit),
+        )
+        self.assertEqual(
+            [applyTransformOnFailure, modifyResponseBeforeAbort],
+            self.handlers(IPubBeforeAbort),
+        )
+        self.assertFalse(
+            getGlobalSiteManager().queryMultiAdapter(
+                (DummyView(), DummyRequest(DummyView(), DummyResponse())),
+                ITransform,
+                name="plone.caching.mutator",
+            )
+        )
+
+
 class TestMutateResponseStreaming(unittest.TestCase):
     layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
 
@@ -1148,6 +1387,425 @@ class TestIntercept(unittest.TestCase):
         excView = InterceptorResponse(exc, request)
         self.assertEqual("Test", excView())
 
+    def test_exception_view_file(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        body = io.BytesIO(b"x" * 100)
+        excView = InterceptorResponse(Intercepted(200, body), request)
+
+        # The file is sent as it is
+        response = WSGIResponse()
+        response.setBody(excView())
+        self.assertTrue(response.body is body)
+        self.assertEqual("100", response.getHeader("Content-Length"))
+
+    def test_exception_view_buffer(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        data = b"x" * (1 << 17)
+
+        excView = InterceptorResponse(Intercepted(200, memoryview(data)), request)
+        self.assertTrue(excView() is data)
+
+        view = memoryview(data)[1:]
+        excView = InterceptorResponse(Intercepted(200, view), request)
+        response = WSGIResponse()
+        response.setBody(excView())
+        self.assertTrue(IStreamIterator.providedBy(response.body))
+        response.finalize()
+        self.assertEqual(str(len(view)), response.getHeader("Content-Length"))
+        self.assertEqual(data[1:], b"".join(response.body))
+
+
+class TestFindOperationMemo(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        self.settings = settings = registry.forInterface(ICacheSettings)
+        settings.enabled = True
+        settings.operationMapping = {"testrule": "op1"}
+
+        self.lookups = lookups = []
+
+        @implementer(IRulesetLookup)
+        @adapter(Interface, Interface)
+        class CountingRulesetLookup:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def __call__(self):
+                lookups.append(self.published)
+                return "testrule"
+
+        provideAdapter(CountingRulesetLookup)
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                return None
+
+            def modifyResponse(self, rulename, response):
+                response.addHeader("X-Cache-Foo", "test")
+
+        provideAdapter(DummyOperation, name="op1")
+
+    def test_one_lookup_per_request(self):
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+
+        intercept(DummyEvent(request))
+        MutatorTransform(view, request).transformUnicode("", "utf-8")
+
+        self.assertEqual([view], self.lookups)
+        self.assertEqual({"PUBLISHED": view}, dict(request))
+        self.assertEqual(
+            {
+                "X-Cache-Rule": ["testrule"],
+                "X-Cache-Operation": ["op1"],
+                "X-Cache-Foo": ["test"],
+            },
+            dict(request.response),
+        )
+
+    def test_one_lookup_per_request_streaming(self):
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        setRequest(request)
+        try:
+            intercept(DummyEvent(request))
+            modifyStreamingResponse(DummyStreamingEvent(request.response))
+            MutatorTransform(view, request).transformUnicode("", "utf-8")
+        finally:
+            clearRequest()
+
+        self.assertEqual([view], self.lookups)
+
+    def test_disabled_for_request(self):
+        provideHandler(registryRecordChanged)
+        self.settings.enabled = False
+        transaction.commit()
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        intercept(DummyEvent(request))
+
+        # The settings are not read again for the rest of the request
+        self.settings.enabled = True
+        transaction.commit()
+        MutatorTransform(view, request).transformUnicode("", "utf-8")
+        self.assertEqual([], self.lookups)
+        self.assertEqual({}, dict(request.response))
+
+        request = DummyRequest(view, DummyResponse())
+        intercept(DummyEvent(request))
+        self.assertEqual([view], self.lookups)
+
+    def test_published_changed(self):
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+
+        intercept(DummyEvent(request))
+
+        other = DummyView()
+        request["PUBLISHED"] = other
+        MutatorTransform(other, request).transformUnicode("", "utf-8")
+
+        self.assertEqual([view, other], self.lookups)
+
+    def test_published_method(self):
+        resource = DummyResource()
+        request = DummyRequest(resource.index_html, DummyResponse())
+
+        intercept(DummyEvent(request))
+        MutatorTransform(resource, request).transformUnicode("", "utf-8")
+
+        self.assertEqual([resource], self.lookups)
+
+
+class TestRequestFilter(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(DefaultRulesetLookup)
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        self.settings = registry.forInterface(ICacheSettings)
+        self.settings.enabled = True
+        self.settings.operationMapping = {"testrule": "op1"}
+        registry.registerInterface(IRequestFilterSettings)
+        self.filters = registry.forInterface(IRequestFilterSettings)
+
+        z3c.caching.registry.register(DummyView, "testrule")
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                return None
+
+            def modifyResponse(self, rulename, response):
+                response.addHeader("X-Cache-Foo", "test")
+
+        provideAdapter(DummyOperation, name="op1")
+
+    def mutate(self, method="GET", path="/"):
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        request.environ["REQUEST_METHOD"] = method
+        request.environ["PATH_INFO"] = path
+
+        intercept(DummyEvent(request))
+        MutatorTransform(view, request).transformUnicode("", "utf-8")
+        return dict(request.response)
+
+    def test_no_filter(self):
+        self.assertEqual(["testrule"], self.mutate("POST").get("X-Cache-Rule"))
+
+    def test_cacheable_methods(self):
+        self.filters.cacheableMethods = ("GET", "head")
+
+        self.assertEqual(["testrule"], self.mutate("GET").get("X-Cache-Rule"))
+        self.assertEqual(["testrule"], self.mutate("HEAD").get("X-Cache-Rule"))
+        self.assertEqual({}, self.mutate("POST"))
+
+    def test_ignored_path_prefixes(self):
+        self.filters.ignoredPathPrefixes = ("/static/", "/api")
+
+        self.assertEqual(["testrule"], self.mutate(path="/site").get("X-Cache-Rule"))
+        self.assertEqual({}, self.mutate(path="/static/logo.png"))
+        self.assertEqual({}, self.mutate(path="/api/items"))
+
+    def test_ignored_path_segments(self):
+        self.filters.ignoredPathSegments = ("++resource++",)
+
+        self.assertEqual(["testrule"], self.mutate(path="/site").get("X-Cache-Rule"))
+        self.assertEqual({}, self.mutate(path="/site/++resource++foo/bar.js"))
+
+    def test_disabled_skips_lookup(self):
+        self.settings.enabled = False
+
+        @implementer(IRulesetLookup)
+        @adapter(Interface, Interface)
+        class FailingRulesetLookup:
+            def __init__(self, published, request):
+                raise AssertionError("Should not be looked up")
+
+        provideAdapter(FailingRulesetLookup)
+        self.assertEqual({}, self.mutate())
+
+
+class TestServerTiming(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(DefaultRulesetLookup)
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        self.settings = registry.forInterface(ICacheSettings)
+        self.settings.enabled = True
+        self.settings.operationMapping = {"testrule": "op1"}
+        registry.registerInterface(ITimingSettings)
+        self.timing = registry.forInterface(ITimingSettings)
+
+        z3c.caching.registry.register(DummyView, "testrule")
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                if self.request.get("intercept"):
+                    response.setStatus(304)
+                    return ""
+                return None
+
+            def modifyResponse(self, rulename, response):
+                pass
+
+        provideAdapter(DummyOperation, name="op1")
+
+    def metrics(self, response):
+        [value] = response["Server-Timing"]
+        return [re.sub(r"dur=[0-9.]+", "dur=?", metric) for metric in value.split(", ")]
+
+    def test_off(self):
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+
+        intercept(DummyEvent(request))
+        MutatorTransform(view, request).transformUnicode("", "utf-8")
+
+        self.assertNotIn("Server-Timing", request.response)
+
+    def test_header(self):
+        self.timing.serverTiming = True
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+
+        intercept(DummyEvent(request))
+        MutatorTransform(view, request).transformUnicode("", "utf-8")
+
+        self.assertEqual(
+            [
+                'caching-ruleset;dur=?;desc="testrule"',
+                'caching-operation;dur=?;desc="op1"',
+                'caching-intercept;dur=?;desc="op1"',
+                'caching-modify;dur=?;desc="op1"',
+            ],
+            self.metrics(request.response),
+        )
+
+    def test_header_intercepted(self):
+        self.timing.serverTiming = True
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        request["intercept"] = True
+
+        self.assertRaises(Intercepted, intercept, DummyEvent(request))
+        self.assertEqual(
+            [
+                'caching-ruleset;dur=?;desc="testrule"',
+                'caching-operation;dur=?;desc="op1"',
+                'caching-intercept;dur=?;desc="op1"',
+            ],
+            self.metrics(request.response),
+        )
+
+    def test_header_chain(self):
+        self.timing.serverTiming = True
+        self.settings.operationMapping = {"testrule": "chain"}
+        provideAdapter(Chain, name="chain")
+        provideUtility(Chain, name="chain")
+        registry = getUtility(IRegistry)
+        registry.records[f"{Chain.prefix}.operations"] = Record(
+            field.List(value_type=field.Text()), ["op1", "op1"]
+        )
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+
+        intercept(DummyEvent(request))
+        MutatorTransform(view, request).transformUnicode("", "utf-8")
+
+        self.assertEqual(
+            [
+                'caching-ruleset;dur=?;desc="testrule"',
+                'caching-operation;dur=?;desc="chain"',
+                'caching-chain-intercept-0;dur=?;desc="op1"',
+                'caching-chain-intercept-1;dur=?;desc="op1"',
+                'caching-intercept;dur=?;desc="chain"',
+                'caching-chain-modify-0;dur=?;desc="op1"',
+                'caching-chain-modify-1;dur=?;desc="op1"',
+                'caching-modify;dur=?;desc="chain"',
+            ],
+            self.metrics(request.response),
+        )
+
+    def test_log(self):
+        self.timing.logTiming = True
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        request.environ["PATH_INFO"] = "/front-page"
+
+        with self.assertLogs("plone.caching", "INFO") as logs:
+            intercept(DummyEvent(request))
+            MutatorTransform(view, request).transformUnicode("", "utf-8")
+
+        self.assertNotIn("Server-Timing", request.response)
+        [message] = logs.output
+        self.assertIn("Caching phases for ", message)
+        self.assertIn("caching-modify (op1)", message)
+
+
+class TestStatistics(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(DefaultRulesetLookup)
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        settings = registry.forInterface(ICacheSettings)
+        settings.enabled = True
+        settings.operationMapping = {"testrule": "op1", "otherrule": "notfound"}
+
+        z3c.caching.registry.register(DummyView, "testrule")
+        z3c.caching.registry.register(DummyResource, "otherrule")
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                if self.request.get("intercept"):
+                    return ""
+                return None
+
+            def modifyResponse(self, rulename, response):
+                pass
+
+        provideAdapter(DummyOperation, name="op1")
+        statistics.reset()
+
+    def publish(self, published, intercepted=False):
+        request = DummyRequest(published, DummyResponse())
+        request.response.status = 200
+        request["intercept"] = intercepted
+        try:
+            intercept(DummyEvent(request))
+        except Intercepted:
+            return
+        MutatorTransform(published, request).transformUnicode("", "utf-8")
+
+    def test_counters(self):
+        self.publish(DummyView())
+        self.publish(DummyView())
+        self.publish(DummyView(), intercepted=True)
+        self.publish(DummyResource())
+
+        self.assertEqual(
+            {
+                "rules": {
+                    "testrule": {"requests": 3},
+                    "otherrule": {"requests": 1, "noOperation": 1},
+                },
+                "operations": {
+                    "op1": {"intercepted": 1, "notIntercepted": 2, "modified": 2},
+                },
+            },
+            statistics.snapshot(),
+        )
+
+        histograms = statistics.histograms()
+        self.assertEqual(3, histograms["intercept"]["op1"]["count"])
+        self.assertEqual(2, histograms["modify"]["op1"]["count"])
+
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
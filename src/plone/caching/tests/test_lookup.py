@@ -1,5 +1,16 @@
+from plone.caching import lookup
+from plone.caching.interfaces import IVolatileRuleset
 from plone.caching.lookup import DefaultRulesetLookup
+from plone.caching.lookup import rulesetRegistrationChanged
 from plone.caching.testing import IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+from z3c.caching.registry import CacheRule
+from z3c.caching.registry import ICacheRule
+from zope.component import getGlobalSiteManager
+from zope.component import getSiteManager
+from zope.component import provideHandler
+from zope.component.event import objectEventNotify
+from zope.interface import classImplements
+from zope.interface.registry import Components
 
 import unittest
 import z3c.caching.registry
@@ -34,6 +45,96 @@ class TestLookup(unittest.TestCase):
         request = DummyRequest(view, DummyResponse())
         self.assertEqual("testrule", DefaultRulesetLookup(view, request)())
 
+    def test_cached_by_spec(self):
+        z3c.caching.registry.register(DummyView, "testrule")
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        self.assertEqual("testrule", DefaultRulesetLookup(view, request)())
+
+        # No invalidation handler is registered, so the cached rule is used
+        z3c.caching.registry.unregister(DummyView)
+
+        other = DummyView()
+        self.assertEqual("testrule", DefaultRulesetLookup(other, request)())
+
+    def test_expires(self):
+        z3c.caching.registry.register(DummyView, "testrule")
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        self.assertEqual("testrule", DefaultRulesetLookup(view, request)())
+
+        # As if another ZEO client unregistered the rule, which fires no
+        # event here
+        z3c.caching.registry.unregister(DummyView)
+        self.assertEqual("testrule", DefaultRulesetLookup(view, request)())
+
+        lookup._rulesetCaches[getSiteManager()].expires = 0
+        self.assertEqual(None, DefaultRulesetLookup(view, request)())
+
+    def test_invalidated_on_register(self):
+        provideHandler(objectEventNotify)
+        provideHandler(rulesetRegistrationChanged)
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        self.assertEqual(None, DefaultRulesetLookup(view, request)())
+
+        z3c.caching.registry.register(DummyView, "testrule")
+        self.assertEqual("testrule", DefaultRulesetLookup(view, request)())
+
+        z3c.caching.registry.unregister(DummyView)
+        self.assertEqual(None, DefaultRulesetLookup(view, request)())
+
+    def test_volatile(self):
+        class VolatileView:
+            rule = "testrule1"
+
+            def __conform__(self, iface):
+                if iface is ICacheRule:
+                    return CacheRule(self.rule)
+
+        classImplements(VolatileView, IVolatileRuleset)
+
+        view = VolatileView()
+        request = DummyRequest(view, DummyResponse())
+        self.assertEqual("testrule1", DefaultRulesetLookup(view, request)())
+
+        view.rule = "testrule2"
+        self.assertEqual("testrule2", DefaultRulesetLookup(view, request)())
+
+    def test_conform(self):
+        class ConformingView:
+            rule = "testrule1"
+
+            def __conform__(self, iface):
+                if iface is ICacheRule:
+                    return CacheRule(self.rule)
+
+        view = ConformingView()
+        request = DummyRequest(view, DummyResponse())
+        self.assertEqual("testrule1", DefaultRulesetLookup(view, request)())
+
+        view.rule = "testrule2"
+        self.assertEqual("testrule2", DefaultRulesetLookup(view, request)())
+
+    def test_cached_per_site(self):
+        z3c.caching.registry.register(DummyView, "testrule")
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        self.assertEqual("testrule", DefaultRulesetLookup(view, request)())
+
+        site = Components(bases=(getGlobalSiteManager(),))
+        site.registerAdapter(
+            lambda published: CacheRule("localrule"), (DummyView,), ICacheRule
+        )
+        getSiteManager.sethook(lambda context=None: site)
+        try:
+            self.assertEqual("localrule", DefaultRulesetLookup(view, request)())
+        finally:
+            getSiteManager.reset()
+
+        self.assertEqual("testrule", DefaultRulesetLookup(view, request)())
+
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
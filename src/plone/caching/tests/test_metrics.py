@@ -0,0 +1,96 @@
+from plone.caching.metrics import MetricsView
+from plone.caching.metrics import PROMETHEUS_CONTENT_TYPE
+from plone.caching.metrics import renderMetrics
+from plone.caching.stats import CachingStatistics
+from plone.caching.stats import statistics
+
+import unittest
+
+
+class DummyResponse(dict):
+    def setHeader(self, name, value):
+        self[name] = value
+
+
+class DummyRequest(dict):
+    def __init__(self):
+        self.response = DummyResponse()
+
+
+class TestRenderMetrics(unittest.TestCase):
+    def test_empty(self):
+        text = renderMetrics(CachingStatistics())
+        self.assertIn("# TYPE plone_caching_rule_requests_total counter\n", text)
+        self.assertIn(
+            "# TYPE plone_caching_intercept_duration_seconds histogram\n", text
+        )
+        self.assertFalse([line for line in text.splitlines() if line[:1] != "#"])
+
+    def test_counters(self):
+        stats = CachingStatistics()
+        stats.increment("rules", "testrule", "requests", 3)
+        stats.increment("rules", "testrule", "noOperation")
+        stats.increment("operations", "op1", "intercepted", 2)
+        stats.increment("operations", 'op"2', "modified")
+
+        lines = renderMetrics(stats).splitlines()
+        self.assertIn('plone_caching_rule_requests_total{rule="testrule"} 3', lines)
+        self.assertIn('plone_caching_rule_no_operation_total{rule="testrule"} 1', lines)
+        self.assertIn(
+            'plone_caching_operation_intercepted_total{operation="op1"} 2', lines
+        )
+        self.assertIn(
+            'plone_caching_operation_modified_total{operation="op\\"2"} 1', lines
+        )
+        self.assertNotIn(
+            'plone_caching_operation_modified_total{operation="op1"} 0', lines
+        )
+
+    def test_histograms(self):
+        stats = CachingStatistics()
+        stats.observe("modify", "op1", 0.00003)
+        stats.observe("modify", "op1", 5.0)
+
+        lines = [
+            line
+            for line in renderMetrics(stats).splitlines()
+            if line.startswith("plone_caching_modify_duration_seconds")
+        ]
+        self.assertEqual(len(stats.buckets) + 3, len(lines))
+        self.assertEqual(
+            'plone_caching_modify_duration_seconds_bucket{operation="op1",le="5e-05"} 1',
+            lines[0],
+        )
+        self.assertEqual(
+            'plone_caching_modify_duration_seconds_bucket{operation="op1",le="+Inf"} 2',
+            lines[-3],
+        )
+        self.assertEqual(
+            'plone_caching_modify_duration_seconds_sum{operation="op1"} 5.00003',
+            lines[-2],
+        )
+        self.assertEqual(
+            'plone_caching_modify_duration_seconds_count{operation="op1"} 2',
+            lines[-1],
+        )
+
+
+class TestMetricsView(unittest.TestCase):
+    def setUp(self):
+        statistics.reset()
+
+    def tearDown(self):
+        statistics.reset()
+
+    def test_view(self):
+        statistics.increment("rules", "testrule", "requests")
+        request = DummyRequest()
+
+        text = MetricsView(None, request)()
+
+        self.assertEqual(PROMETHEUS_CONTENT_TYPE, request.response["Content-Type"])
+        self.assertIn('plone_caching_rule_requests_total{rule="testrule"} 1\n', text)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -1,17 +1,29 @@
+from plone.caching import operations
+from plone.caching import utils
 from plone.caching.interfaces import ICachingOperation
 from plone.caching.operations import Chain
+from plone.caching.operations import operationRegistrationChanged
 from plone.caching.testing import IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+from plone.caching.utils import registryRecordChanged
 from plone.registry import field
 from plone.registry import Record
 from plone.registry import Registry
 from plone.registry.interfaces import IRegistry
 from zope.component import adapter
+from zope.component import getGlobalSiteManager
+from zope.component import getSiteManager
 from zope.component import provideAdapter
+from zope.component import provideHandler
 from zope.component import provideUtility
+from zope.component.event import objectEventNotify
 from zope.interface import implementer
 from zope.interface import Interface
+from zope.interface.registry import Components
 
+import gc
+import transaction
 import unittest
+import weakref
 
 _marker = object()
 
@@ -34,6 +46,20 @@ class DummyRequest(dict):
         self.response = response
 
 
+@implementer(ICachingOperation)
+@adapter(Interface, Interface)
+class DummyChainedOperation:
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def interceptResponse(self, rulename, response):
+        return None
+
+    def modifyResponse(self, rulename, response):
+        response["X-Mutated"] = rulename
+
+
 class TestChain(unittest.TestCase):
     layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
 
@@ -198,6 +224,203 @@ class TestChain(unittest.TestCase):
             dict(request.response),
         )
 
+    def test_compiled_once(self):
+        self.registry.records[f"{Chain.prefix}.operations"] = Record(
+            field.List(value_type=field.Text()), ["op1", "op2"]
+        )
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                return None
+
+            def modifyResponse(self, rulename, response):
+                response["X-Mutated"] = rulename
+
+        provideAdapter(DummyOperation, name="op1")
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        compiled = Chain(view, request).compile("testrule")
+
+        self.assertEqual(("op1",), compiled.names)
+        self.assertEqual(("op1",), compiled.headers)
+        self.assertIs(compiled, Chain(DummyView(), request).compile("testrule"))
+        self.assertIsNot(compiled, Chain(view, request).compile("otherrule"))
+
+    def test_not_recompiled_when_options_reread(self):
+        key = f"{Chain.prefix}.operations"
+        self.registry.records[key] = Record(
+            field.List(value_type=field.Text()), ["op1"]
+        )
+        provideAdapter(DummyChainedOperation, name="op1")
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+
+        # Options are re-read once they expire, as an equal value
+        maxAge = utils.SETTINGS_MAX_AGE
+        utils.SETTINGS_MAX_AGE = -1
+        try:
+            compiled = Chain(view, request).compile("testrule")
+            self.registry.records._values[key] = ["op1"]
+            self.assertIs(compiled, Chain(view, request).compile("testrule"))
+        finally:
+            utils.SETTINGS_MAX_AGE = maxAge
+
+    def test_site_manager_not_kept_alive(self):
+        self.registry.records[f"{Chain.prefix}.operations"] = Record(
+            field.List(value_type=field.Text()), ["op1"]
+        )
+        provideAdapter(DummyChainedOperation, name="op1")
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        site = Components(bases=(getGlobalSiteManager(),))
+        getSiteManager.sethook(lambda context=None, site=site: site)
+        try:
+            self.assertEqual(("op1",), Chain(view, request).compile("testrule").names)
+        finally:
+            getSiteManager.reset()
+        Chain(view, request).compile("testrule")
+
+        ref = weakref.ref(site)
+        del site
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_recompiled_when_option_changes(self):
+        provideHandler(registryRecordChanged)
+        self.registry.records[f"{Chain.prefix}.operations"] = Record(
+            field.List(value_type=field.Text()), ["op1"]
+        )
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                return None
+
+            def modifyResponse(self, rulename, response):
+                response["X-Mutated"] = rulename
+
+        provideAdapter(DummyOperation, name="op1")
+        provideAdapter(DummyOperation, name="op2")
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        Chain(view, request).modifyResponse("testrule", request.response)
+        self.assertEqual("op1", request.response["X-Cache-Chain-Operations"])
+
+        self.registry[f"{Chain.prefix}.operations"] = ["op1", "op2"]
+        transaction.commit()
+
+        request = DummyRequest(view, DummyResponse())
+        Chain(view, request).modifyResponse("testrule", request.response)
+        self.assertEqual("op1; op2", request.response["X-Cache-Chain-Operations"])
+
+    def test_recompiled_when_operation_registered(self):
+        provideHandler(objectEventNotify)
+        provideHandler(operationRegistrationChanged)
+        self.registry.records[f"{Chain.prefix}.operations"] = Record(
+            field.List(value_type=field.Text()), ["op1"]
+        )
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        self.assertEqual((), Chain(view, request).compile("testrule").names)
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+        getGlobalSiteManager().registerAdapter(DummyOperation, name="op1")
+        self.assertEqual(("op1",), Chain(view, request).compile("testrule").names)
+
+    def test_expires(self):
+        self.registry.records[f"{Chain.prefix}.operations"] = Record(
+            field.List(value_type=field.Text()), ["op1"]
+        )
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+        self.assertEqual((), Chain(view, request).compile("testrule").names)
+
+        # As if another ZEO client registered the operation, which fires no
+        # event here
+        provideAdapter(DummyChainedOperation, name="op1")
+        self.assertEqual((), Chain(view, request).compile("testrule").names)
+
+        operations._chainCaches[getSiteManager()].expires = 0
+        self.assertEqual(("op1",), Chain(view, request).compile("testrule").names)
+
+    def test_factory_declines(self):
+        self.registry.records[f"{Chain.prefix}.operations"] = Record(
+            field.List(value_type=field.Text()), ["op1", "op2", "op3"]
+        )
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class DummyOperation:
+            def __init__(self, published, request):
+                self.published = published
+                self.request = request
+
+            def interceptResponse(self, rulename, response):
+                return None
+
+            def modifyResponse(self, rulename, response):
+                response.addHeader("X-Mutated", rulename)
+
+        @implementer(ICachingOperation)
+        @adapter(Interface, Interface)
+        class InterceptingOperation(DummyOperation):
+            def interceptResponse(self, rulename, response):
+                return "foo"
+
+        @adapter(Interface, Interface)
+        def declining(published, request):
+            return None
+
+        provideAdapter(DummyOperation, name="op1")
+        provideAdapter(declining, provides=ICachingOperation, name="op2")
+        provideAdapter(InterceptingOperation, name="op3")
+
+        view = DummyView()
+        request = DummyRequest(view, DummyResponse())
+
+        chain = Chain(view, request)
+        ret = chain.interceptResponse("testrule", request.response)
+
+        self.assertEqual("foo", ret)
+        self.assertEqual(
+            {"X-Cache-Chain-Operations": "op1; op3"}, dict(request.response)
+        )
+
+        request = DummyRequest(view, DummyResponse())
+        chain = Chain(view, request)
+        chain.modifyResponse("testrule", request.response)
+
+        self.assertEqual(
+            {
+                "X-Mutated": ["testrule", "testrule"],
+                "X-Cache-Chain-Operations": "op1; op3",
+            },
+            dict(request.response),
+        )
+
 
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
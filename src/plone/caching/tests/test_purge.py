@@ -0,0 +1,457 @@
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from plone.caching import purge
+from plone.caching.interfaces import IPurgingSettings
+from plone.caching.purge import getPurgingSettings
+from plone.caching.purge import PurgeDispatcher
+from plone.caching.purge import queuePurge
+from plone.caching.purge import queuePurgeEvent
+from plone.caching.purge import rewritePaths
+from plone.caching.purge import stopDispatcher
+from plone.caching.stats import statistics
+from plone.caching.testing import IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+from plone.registry import field
+from plone.registry import Record
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from z3c.caching.interfaces import IPurgePaths
+from z3c.caching.purge import Purge
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.globalrequest import clearRequest
+from zope.globalrequest import setRequest
+from zope.interface import implementer
+from zope.interface import Interface
+
+import threading
+import time
+import transaction
+import unittest
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_PURGE(self):
+        server = self.server
+        server.release.wait(10)
+        with server.lock:
+            server.connections.add(self.client_address)
+            if server.failures:
+                server.failures -= 1
+                status = 503
+            else:
+                server.purged.append(self.path)
+                server.hosts.append(self.headers["Host"])
+                status = 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        if server.closeIdle:
+            # Close the connection without announcing it, as proxies do when
+            # a kept-alive connection times out
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Proxy(ThreadingHTTPServer):
+    """Local stand-in for a caching proxy, recording purged paths."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ProxyHandler)
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.purged = []
+        self.hosts = []
+        self.failures = 0
+        self.closeIdle = False
+        # Cleared to hold purges until it is set again
+        self.release = threading.Event()
+        self.release.set()
+        self.thread = threading.Thread(
+            target=self.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def close(self):
+        self.release.set()
+        self.shutdown()
+        self.server_close()
+
+
+class DummyContent:
+    pass
+
+
+@implementer(IPurgePaths)
+@adapter(DummyContent)
+class DummyPurgePaths:
+    def __init__(self, context):
+        self.context = context
+
+    def getRelativePaths(self):
+        return ["/plone/doc", "/plone/doc/view"]
+
+    def getAbsolutePaths(self):
+        return ["/plone/doc"]
+
+
+class DummyRequest(dict):
+    pass
+
+
+def settings(**values):
+    result = {
+        name: IPurgingSettings[name].default
+        for name in ("enabled", "threads", "batchSize", "retries", "timeout")
+    }
+    result.update(proxies=(), backoff=0.0)
+    result.update(values)
+    return result
+
+
+class TestPurgeDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.proxy = Proxy()
+        self.dispatcher = PurgeDispatcher(threads=1)
+        statistics.reset()
+
+    def tearDown(self):
+        self.dispatcher.stop()
+        self.proxy.close()
+
+    def test_batches_over_persistent_connection(self):
+        paths = [f"/page{i}" for i in range(5)]
+        self.dispatcher.dispatch(
+            settings(proxies=(self.proxy.url,), batchSize=2), paths
+        )
+        self.assertTrue(self.dispatcher.join(10))
+
+        self.assertEqual(paths, self.proxy.purged)
+        self.assertEqual(1, len(self.proxy.connections))
+        self.assertEqual(
+            {"purges": {self.proxy.url: {"purged": 5}}}, statistics.snapshot()
+        )
+
+    def test_proxy_path_prefix(self):
+        self.dispatcher.dispatch(
+            settings(proxies=(self.proxy.url + "/varnish/",)), ["/page"]
+        )
+        self.assertTrue(self.dispatcher.join(10))
+        self.assertEqual(["/varnish/page"], self.proxy.purged)
+
+    def test_retry(self):
+        self.proxy.failures = 2
+        self.dispatcher.dispatch(
+            settings(proxies=(self.proxy.url,), retries=3), ["/a", "/b"]
+        )
+        self.assertTrue(self.dispatcher.join(10))
+
+        self.assertEqual(["/a", "/b"], self.proxy.purged)
+        self.assertEqual(
+            {"purges": {self.proxy.url: {"purged": 2, "retried": 2}}},
+            statistics.snapshot(),
+        )
+
+    def test_give_up(self):
+        self.proxy.failures = 10
+        self.dispatcher.dispatch(settings(proxies=(self.proxy.url,), retries=1), ["/a"])
+        self.assertTrue(self.dispatcher.join(10))
+
+        self.assertEqual([], self.proxy.purged)
+        self.assertEqual(
+            {"purges": {self.proxy.url: {"retried": 1, "failed": 1}}},
+            statistics.snapshot(),
+        )
+
+    def test_reconnect(self):
+        self.proxy.closeIdle = True
+        self.dispatcher.dispatch(
+            settings(proxies=(self.proxy.url,), retries=0), ["/a", "/b", "/c"]
+        )
+        self.assertTrue(self.dispatcher.join(10))
+
+        self.assertEqual(["/a", "/b", "/c"], self.proxy.purged)
+        self.assertEqual(3, len(self.proxy.connections))
+        self.assertEqual(
+            {"purges": {self.proxy.url: {"purged": 3}}}, statistics.snapshot()
+        )
+
+    def test_connection_refused(self):
+        self.proxy.close()
+        self.dispatcher.dispatch(settings(proxies=(self.proxy.url,), retries=0), ["/a"])
+        self.assertTrue(self.dispatcher.join(10))
+        self.assertEqual(
+            {"purges": {self.proxy.url: {"failed": 1}}}, statistics.snapshot()
+        )
+
+    def test_host(self):
+        self.dispatcher.dispatch(
+            settings(proxies=(self.proxy.url,)), ["/page"], "www.example.com"
+        )
+        self.dispatcher.dispatch(settings(proxies=(self.proxy.url,)), ["/other"])
+        self.assertTrue(self.dispatcher.join(10))
+
+        self.assertEqual(["/page", "/other"], self.proxy.purged)
+        self.assertEqual(
+            ["www.example.com", self.proxy.url[len("http://") :]], self.proxy.hosts
+        )
+
+    def test_stop_without_waiting(self):
+        self.dispatcher.stop()
+        self.dispatcher = PurgeDispatcher(threads=1, queueSize=1)
+        self.proxy.release.clear()
+        values = settings(proxies=(self.proxy.url,))
+        self.dispatcher.dispatch(values, ["/a"])
+        # Wait for the thread to take the batch off the queue
+        while not self.dispatcher._queue.empty():
+            time.sleep(0.01)
+        self.dispatcher.dispatch(values, ["/b"])
+        self.assertTrue(self.dispatcher._queue.full())
+
+        # The queue is full and the thread busy, but stopping does not block
+        self.dispatcher.stop(wait=False)
+        self.proxy.release.set()
+        self.dispatcher._workers[0].join(10)
+
+        self.assertFalse(self.dispatcher._workers[0].is_alive())
+        self.assertEqual(["/a"], self.proxy.purged)
+        self.assertEqual(
+            {"purges": {self.proxy.url: {"purged": 1, "dropped": 1}}},
+            statistics.snapshot(),
+        )
+
+    def test_queue_full(self):
+        self.dispatcher.stop()
+        # Without threads, nothing is taken off the queue
+        self.dispatcher = PurgeDispatcher(threads=0, queueSize=1)
+        self.dispatcher.dispatch(
+            settings(proxies=(self.proxy.url,), batchSize=1), ["/a", "/b"]
+        )
+        self.assertEqual(
+            {"purges": {self.proxy.url: {"dropped": 1}}}, statistics.snapshot()
+        )
+
+
+class TestQueuePurge(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        self.proxy = Proxy()
+        self.registry = Registry()
+        self.registry.registerInterface(IPurgingSettings)
+        self.registry[f"{IPurgingSettings.__identifier__}.enabled"] = True
+        self.registry[f"{IPurgingSettings.__identifier__}.proxies"] = (self.proxy.url,)
+        provideUtility(self.registry, IRegistry)
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        stopDispatcher()
+        self.proxy.close()
+
+    def join(self):
+        self.assertTrue(purge._dispatcher.join(10))
+
+    def test_settings(self):
+        values = getPurgingSettings(self.registry)
+        self.assertEqual(True, values["enabled"])
+        self.assertEqual((self.proxy.url,), values["proxies"])
+        self.assertEqual(3, values["retries"])
+
+    def test_commit(self):
+        queuePurge(["/a", "/b"])
+        queuePurge(["/b", "/c"])
+        self.assertEqual([], self.proxy.purged)
+
+        transaction.commit()
+        self.join()
+        self.assertEqual(["/a", "/b", "/c"], sorted(self.proxy.purged))
+
+    def test_abort(self):
+        queuePurge(["/a"])
+        transaction.abort()
+
+        transaction.begin()
+        queuePurge(["/b"])
+        transaction.commit()
+        self.join()
+        self.assertEqual(["/b"], self.proxy.purged)
+
+    def test_disabled(self):
+        self.registry[f"{IPurgingSettings.__identifier__}.enabled"] = False
+        queuePurge(["/a"])
+        transaction.commit()
+
+        self.assertIsNone(purge._dispatcher)
+
+    def test_purge_event(self):
+        provideAdapter(DummyPurgePaths, name="test")
+        queuePurgeEvent(Purge(DummyContent()))
+        transaction.commit()
+        self.join()
+        self.assertEqual(["/plone/doc", "/plone/doc/view"], sorted(self.proxy.purged))
+
+    def test_purge_event_virtual_hosting(self):
+        self.registry[f"{IPurgingSettings.__identifier__}.virtualHosting"] = True
+        provideAdapter(DummyPurgePaths, name="test")
+        setRequest(
+            DummyRequest(
+                SERVER_URL="https://www.example.com",
+                VIRTUAL_URL_PARTS=("https://www.example.com", "doc"),
+                VirtualRootPhysicalPath=("", "plone"),
+            )
+        )
+        try:
+            queuePurgeEvent(Purge(DummyContent()))
+        finally:
+            clearRequest()
+        transaction.commit()
+        self.join()
+
+        # Absolute paths are purged as they are, for the host of the proxy
+        prefix = "/VirtualHostBase/https/www.example.com/plone/VirtualHostRoot"
+        self.assertEqual(
+            sorted(
+                [
+                    (prefix + "/plone/doc", "www.example.com"),
+                    (prefix + "/plone/doc/view", "www.example.com"),
+                    ("/plone/doc", self.proxy.url[len("http://") :]),
+                ]
+            ),
+            sorted(zip(self.proxy.purged, self.proxy.hosts)),
+        )
+
+    def test_absolute(self):
+        request = DummyRequest(SERVER_URL="https://www.example.com")
+        queuePurge(["/a"], request, absolute=True)
+        transaction.commit()
+        self.join()
+
+        self.assertEqual(["/a"], self.proxy.purged)
+        self.assertEqual([self.proxy.url[len("http://") :]], self.proxy.hosts)
+
+    def test_purge_event_cachepurging_enabled(self):
+        self.registry.records[
+            "plone.cachepurging.interfaces.ICachePurgingSettings.enabled"
+        ] = Record(field.Bool(), True)
+        provideAdapter(DummyPurgePaths, name="test")
+        queuePurgeEvent(Purge(DummyContent()))
+        transaction.commit()
+
+        self.assertIsNone(purge._dispatcher)
+
+    def test_request_domain(self):
+        request = DummyRequest(SERVER_URL="https://www.example.com")
+        queuePurge(["/a"], request)
+        transaction.commit()
+        self.join()
+
+        self.assertEqual(["/a"], self.proxy.purged)
+        self.assertEqual(["www.example.com"], self.proxy.hosts)
+
+    def test_global_request(self):
+        setRequest(DummyRequest(SERVER_URL="https://www.example.com"))
+        try:
+            queuePurge(["/a"])
+        finally:
+            clearRequest()
+        transaction.commit()
+        self.join()
+
+        self.assertEqual(["www.example.com"], self.proxy.hosts)
+
+    def test_purge_event_no_paths(self):
+        queuePurgeEvent(Purge(Interface))
+        transaction.commit()
+
+        self.assertIsNone(purge._dispatcher)
+
+
+class TestRewritePaths(unittest.TestCase):
+    def virtualHostedRequest(self, parts=("https://www.example.com", "doc")):
+        return DummyRequest(
+            SERVER_URL=parts[0],
+            VIRTUAL_URL_PARTS=parts,
+            VirtualRootPhysicalPath=("", "plone"),
+        )
+
+    def test_no_domain(self):
+        self.assertEqual([(None, "/a")], rewritePaths(["/a"], settings()))
+
+    def test_request_domain(self):
+        request = DummyRequest(SERVER_URL="http://localhost:8080")
+        self.assertEqual(
+            [("localhost:8080", "/a")], rewritePaths(["/a"], settings(), request)
+        )
+
+    def test_domains(self):
+        request = DummyRequest(SERVER_URL="http://localhost:8080")
+        values = settings(domains=("https://www.example.com", "http://example.com"))
+        self.assertEqual(
+            [("www.example.com", "/a"), ("example.com", "/a")],
+            rewritePaths(["a"], values, request),
+        )
+
+    def test_virtual_hosting(self):
+        values = settings(virtualHosting=True)
+        self.assertEqual(
+            [
+                (
+                    "www.example.com",
+                    "/VirtualHostBase/https/www.example.com/plone"
+                    "/VirtualHostRoot/doc",
+                )
+            ],
+            rewritePaths(["/doc"], values, self.virtualHostedRequest()),
+        )
+
+    def test_virtual_hosting_domains(self):
+        values = settings(virtualHosting=True, domains=("http://example.com:81",))
+        self.assertEqual(
+            [
+                (
+                    "example.com:81",
+                    "/VirtualHostBase/http/example.com:81/plone/VirtualHostRoot/doc",
+                )
+            ],
+            rewritePaths(["/doc"], values, self.virtualHostedRequest()),
+        )
+
+    def test_virtual_hosting_path_prefix(self):
+        request = self.virtualHostedRequest(
+            ("https://www.example.com", "site/en", "doc")
+        )
+        values = settings(virtualHosting=True)
+        self.assertEqual(
+            [
+                (
+                    "www.example.com",
+                    "/VirtualHostBase/https/www.example.com/plone"
+                    "/VirtualHostRoot/_vh_site/_vh_en/site/en/doc",
+                )
+            ],
+            rewritePaths(["/site/en/doc"], values, request),
+        )
+
+    def test_virtual_hosting_without_virtual_host(self):
+        request = DummyRequest(SERVER_URL="http://localhost:8080")
+        values = settings(virtualHosting=True)
+        self.assertEqual(
+            [("localhost:8080", "/doc")], rewritePaths(["/doc"], values, request)
+        )
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
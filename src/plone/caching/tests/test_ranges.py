@@ -0,0 +1,137 @@
+from io import BytesIO
+from plone.caching.ranges import getRanges
+from plone.caching.ranges import MAX_RANGES
+from plone.caching.ranges import rangeBody
+from plone.caching.ranges import rangeParts
+from plone.caching.ranges import RangeStreamIterator
+from ZPublisher.Iterators import IStreamIterator
+
+import unittest
+
+
+class DummyRequest:
+    def __init__(self, **headers):
+        self.headers = headers
+
+    def getHeader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+HEADERS = (
+    ("ETag", '"abc"'),
+    ("Last-Modified", "Tue, 01 Oct 2024 10:00:00 GMT"),
+)
+
+
+class TestGetRanges(unittest.TestCase):
+    def ranges(self, size=100, headers=HEADERS, **requestHeaders):
+        return getRanges(DummyRequest(**requestHeaders), headers, size)
+
+    def test_no_range(self):
+        self.assertEqual(None, self.ranges())
+
+    def test_ranges(self):
+        self.assertEqual([(0, 10)], self.ranges(Range="bytes=0-9"))
+        self.assertEqual([(90, 100)], self.ranges(Range="bytes=-10"))
+        self.assertEqual([(50, 100)], self.ranges(Range="bytes=50-"))
+        self.assertEqual([(90, 100)], self.ranges(Range="bytes=90-200"))
+        self.assertEqual(
+            [(0, 1), (10, 20)], self.ranges(Range="bytes=0-0, 10-19, 200-300")
+        )
+
+    def test_unsatisfiable(self):
+        self.assertEqual([], self.ranges(Range="bytes=100-"))
+
+    def test_invalid(self):
+        self.assertEqual(None, self.ranges(Range="bytes=9-0"))
+        self.assertEqual(None, self.ranges(Range="items=0-9"))
+
+    def test_too_many(self):
+        header = "bytes=" + ",".join(f"{i}-{i}" for i in range(MAX_RANGES + 1))
+        self.assertEqual(None, self.ranges(Range=header))
+
+    def test_if_range_etag(self):
+        self.assertEqual(
+            [(0, 10)], self.ranges(Range="bytes=0-9", **{"If-Range": '"abc"'})
+        )
+        self.assertEqual(None, self.ranges(Range="bytes=0-9", **{"If-Range": '"def"'}))
+        self.assertEqual(
+            None, self.ranges(Range="bytes=0-9", **{"If-Range": 'W/"abc"'})
+        )
+        self.assertEqual(
+            None,
+            self.ranges(Range="bytes=0-9", headers=(), **{"If-Range": '"abc"'}),
+        )
+
+    def test_if_range_date(self):
+        self.assertEqual(
+            [(0, 10)],
+            self.ranges(
+                Range="bytes=0-9", **{"If-Range": "Tue, 01 Oct 2024 10:00:00 GMT"}
+            ),
+        )
+        self.assertEqual(
+            None,
+            self.ranges(
+                Range="bytes=0-9", **{"If-Range": "Tue, 01 Oct 2024 10:00:01 GMT"}
+            ),
+        )
+        self.assertEqual(
+            None, self.ranges(Range="bytes=0-9", **{"If-Range": "yesterday"})
+        )
+
+
+class TestRangeBody(unittest.TestCase):
+    body = bytes(range(100))
+
+    def test_single(self):
+        parts, contentType = rangeParts([(10, 20)], 100, "application/pdf")
+        self.assertEqual("application/pdf", contentType)
+        body = rangeBody(self.body, parts)
+        self.assertTrue(isinstance(body, memoryview))
+        self.assertEqual(self.body[10:20], body)
+
+    def test_multipart(self):
+        parts, contentType = rangeParts([(0, 2), (98, 100)], 100, "application/pdf")
+        boundary = contentType.split("boundary=")[1]
+        self.assertTrue(contentType.startswith("multipart/byteranges; "))
+        self.assertEqual(
+            (
+                f"\r\n--{boundary}\r\n"
+                "Content-Type: application/pdf\r\n"
+                "Content-Range: bytes 0-1/100\r\n\r\n"
+            ).encode()
+            + b"\x00\x01"
+            + (
+                f"\r\n--{boundary}\r\n"
+                "Content-Type: application/pdf\r\n"
+                "Content-Range: bytes 98-99/100\r\n\r\n"
+            ).encode()
+            + b"\x62\x63"
+            + f"\r\n--{boundary}--\r\n".encode(),
+            rangeBody(self.body, parts),
+        )
+
+    def test_file(self):
+        parts, contentType = rangeParts([(0, 2), (50, 60)], 100, None)
+        expected = rangeBody(self.body, parts)
+
+        body = rangeBody(BytesIO(self.body), parts)
+        self.assertTrue(isinstance(body, RangeStreamIterator))
+        self.assertTrue(IStreamIterator.providedBy(body))
+        self.assertEqual(len(expected), len(body))
+        self.assertEqual(expected, b"".join(body))
+
+    def test_file_chunks(self):
+        file = BytesIO(self.body)
+        body = RangeStreamIterator(file, [(0, 50)], streamsize=20)
+        self.assertEqual([20, 20, 10], [len(chunk) for chunk in body])
+        body.close()
+        self.assertTrue(file.closed)
+
+    def test_iterator(self):
+        self.assertEqual(None, rangeBody(iter([self.body]), [(0, 2)]))
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
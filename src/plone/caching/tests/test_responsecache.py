@@ -0,0 +1,1071 @@
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.users import SimpleUser
+from io import BytesIO
+from plone.caching import responsecache
+from plone.caching.cachekey import CacheKey
+from plone.caching.cachekey import hashKey
+from plone.caching.cachekey import LanguageCacheKey
+from plone.caching.hooks import IStreamedResponse
+from plone.caching.hooks import modifyResponseBeforeCommit
+from plone.caching.hooks import MutatorTransform
+from plone.caching.interfaces import ICacheSettings
+from plone.caching.interfaces import ICacheTags
+from plone.caching.interfaces import ICachingOperation
+from plone.caching.lookup import DefaultRulesetLookup
+from plone.caching.responsecache import _flights
+from plone.caching.responsecache import _stores
+from plone.caching.responsecache import acceptsEncoding
+from plone.caching.responsecache import clearStores
+from plone.caching.responsecache import DiskCache
+from plone.caching.responsecache import invalidateOnPurge
+from plone.caching.responsecache import invalidateTags
+from plone.caching.responsecache import RAMCache
+from plone.caching.responsecache import REFRESH_ENVIRON_KEY
+from plone.caching.responsecache import REFRESH_THREADS
+from plone.caching.responsecache import refreshEnviron
+from plone.caching.responsecache import releaseFlight
+from plone.caching.responsecache import requestEnded
+from plone.caching.responsecache import SharedMemoryCache
+from plone.caching.responsecache import variantKey
+from plone.caching.stats import statistics
+from plone.caching.streaming import finishStreamedResponse
+from plone.caching.testing import IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+from plone.caching.utils import registryRecordChanged
+from plone.caching.utils import setResponseBody
+from plone.registry import field
+from plone.registry import Record
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.transformchain.interfaces import ITransformer
+from plone.transformchain.transformer import Transformer
+from plone.transformchain.zpublisher import applyTransformOnSuccess
+from z3c.caching.purge import Purge
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideHandler
+from zope.component import provideUtility
+from zope.interface import alsoProvides
+from zope.interface import implementer
+from zope.interface import implementer_only
+from zope.interface.verify import verifyClass
+from ZPublisher.HTTPResponse import WSGIResponse
+from ZPublisher.Iterators import IStreamIterator
+from ZPublisher.Iterators import IUnboundStreamIterator
+from ZPublisher.pubevents import PubBeforeCommit
+from ZPublisher.pubevents import PubSuccess
+
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import transaction
+import unittest
+import z3c.caching.registry
+
+
+class DummyView:
+    pass
+
+
+@implementer(ICacheTags)
+@adapter(DummyView)
+class DummyTags:
+    def __init__(self, published):
+        self.published = published
+
+    def __call__(self):
+        return getattr(self.published, "tags", ())
+
+
+class DummyResponse(dict):
+    status = 200
+    cookies = None
+    body = b""
+
+    def setHeader(self, name, value):
+        self[name] = value
+
+    def getHeader(self, name):
+        return self.get(name)
+
+    def setStatus(self, value, lock=None):
+        self.status = value
+
+    def getStatus(self):
+        return self.status
+
+    def enableHTTPCompression(self, REQUEST={}, force=0, disable=0, query=0):
+        self.compression = not disable
+
+
+@implementer(IStreamIterator)
+class DummyStreamIterator:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self._iterator = iter(chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+
+class DummyRequest(dict):
+    def __init__(self, published, response, url="http://example.com/page"):
+        self["PUBLISHED"] = published
+        self["ACTUAL_URL"] = url
+        self.response = response
+        self.environ = {"REQUEST_METHOD": "GET"}
+        self.headers = {}
+
+    def getHeader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class TestRAMCache(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        self.registry = Registry()
+        provideUtility(self.registry, IRegistry)
+        provideAdapter(CacheKey, name="url")
+        statistics.reset()
+
+    def tearDown(self):
+        noSecurityManager()
+
+    def setOption(self, name, value, rulename=None):
+        key = (
+            f"{RAMCache.prefix}.{rulename}.{name}"
+            if rulename
+            else f"{RAMCache.prefix}.{name}"
+        )
+        if isinstance(value, bool):
+            record = Record(field.Bool(), value)
+        elif isinstance(value, str):
+            record = Record(field.ASCIILine(), value)
+        elif isinstance(value, tuple):
+            record = Record(field.Tuple(value_type=field.ASCIILine()), value)
+        else:
+            record = Record(field.Int(), value)
+        self.registry.records[key] = record
+
+    def render(self, body=b"<html>page</html>", request=None, **headers):
+        request = request or DummyRequest(DummyView(), DummyResponse())
+        operation = RAMCache(request["PUBLISHED"], request)
+        response = request.response
+
+        value = operation.interceptResponse("testrule", response)
+        if value is not None:
+            return request, value
+
+        response.update(headers)
+        setResponseBody(request, body, "utf-8")
+        operation.modifyResponse("testrule", response)
+        return request, None
+
+    def test_interface(self):
+        self.assertTrue(verifyClass(ICachingOperation, RAMCache))
+
+    def test_store_and_hit(self):
+        request, value = self.render(**{"Content-Type": "text/html", "X-Other": "1"})
+        self.assertEqual(None, value)
+
+        request, value = self.render()
+        self.assertEqual(b"<html>page</html>", value)
+        self.assertEqual(200, request.response.status)
+        self.assertEqual(
+            {"Content-Type": "text/html", "Age": "0", "Accept-Ranges": "bytes"},
+            dict(request.response),
+        )
+        self.assertEqual(
+            {
+                "caches": {
+                    RAMCache.prefix: {"hits": 1, "misses": 1, "stored": 1},
+                },
+            },
+            statistics.snapshot(),
+        )
+
+    def test_query_string_in_key(self):
+        self.render()
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.environ["QUERY_STRING"] = "b_start=20"
+        request, value = self.render(request=request)
+
+        self.assertEqual(None, value)
+        self.assertEqual(2, len(_stores[RAMCache.prefix][0]))
+
+    def test_cache_key_option(self):
+        provideAdapter(LanguageCacheKey, name="language")
+        self.setOption("cacheKey", "language", "testrule")
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request["LANGUAGE"] = "en"
+        request.response["Vary"] = "Accept-Encoding"
+        self.render(request=request)
+        self.assertEqual("Accept-Encoding, Accept-Language", request.response["Vary"])
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request["LANGUAGE"] = "de"
+        request, value = self.render(request=request)
+        self.assertEqual(None, value)
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request["LANGUAGE"] = "en"
+        request, value = self.render(request=request)
+        self.assertEqual(b"<html>page</html>", value)
+        self.assertEqual("Accept-Encoding, Accept-Language", request.response["Vary"])
+
+    def test_unknown_cache_key(self):
+        self.setOption("cacheKey", "unknown", "testrule")
+        self.render()
+        request, value = self.render()
+        self.assertEqual(None, value)
+        self.assertNotIn(RAMCache.prefix, _stores)
+
+    def test_compressed_variants(self):
+        self.setOption("compress", ("gzip", "deflate"), "testrule")
+        body = b"<html>" + b"page " * 100 + b"</html>"
+        request, value = self.render(body, **{"Content-Type": "text/html"})
+        self.assertEqual("Accept-Encoding", request.response["Vary"])
+        self.assertEqual(3, len(_stores[RAMCache.prefix][0]))
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Accept-Encoding"] = "deflate, gzip;q=0.5"
+        request, value = self.render(request=request)
+        self.assertEqual(body, gzip.decompress(value))
+        self.assertEqual("gzip", request.response["Content-Encoding"])
+        self.assertEqual("Accept-Encoding", request.response["Vary"])
+        self.assertFalse(request.response.compression)
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Accept-Encoding"] = "gzip;q=0"
+        request, value = self.render(request=request)
+        self.assertEqual(body, value)
+        self.assertNotIn("Content-Encoding", request.response)
+
+    def test_variant_vary(self):
+        provideAdapter(LanguageCacheKey, name="language")
+        self.setOption("cacheKey", "language", "testrule")
+        self.setOption("compress", ("gzip",), "testrule")
+        self.setOption("headers", ("Content-Type",), "testrule")
+        body = b"<html>" + b"page " * 100 + b"</html>"
+        self.render(body, **{"Content-Type": "text/html", "Vary": "Accept-Language"})
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Accept-Encoding"] = "gzip"
+        request, value = self.render(request=request)
+        self.assertEqual("gzip", request.response["Content-Encoding"])
+        self.assertEqual("Accept-Language, Accept-Encoding", request.response["Vary"])
+
+    def test_variant_vary_not_in_key(self):
+        self.setOption("compress", ("gzip",), "testrule")
+        body = b"<html>" + b"page " * 100 + b"</html>"
+        self.render(body, **{"Content-Type": "text/html", "Vary": "Cookie"})
+        self.assertEqual(0, len(_stores[RAMCache.prefix][0]))
+
+    def test_variants_replaced(self):
+        self.setOption("compress", ("gzip",), "testrule")
+        body = b"<html>" + b"page " * 100 + b"</html>"
+        self.render(body, **{"Content-Type": "text/html"})
+        self.assertEqual(2, len(_stores[RAMCache.prefix][0]))
+
+        # The new response does not compress, so it has no variant, and the
+        # variant of the previous one is removed
+        self.age(70)
+        self.render(b"new", **{"Content-Type": "text/html"})
+        self.assertEqual(1, len(_stores[RAMCache.prefix][0]))
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Accept-Encoding"] = "gzip"
+        request, value = self.render(request=request)
+        self.assertEqual(b"new", value)
+        self.assertNotIn("Content-Encoding", request.response)
+
+    def test_stale_variant(self):
+        self.setOption("compress", ("gzip",), "testrule")
+        body = b"<html>" + b"page " * 100 + b"</html>"
+        self.render(body, **{"Content-Type": "text/html"})
+
+        # The uncompressed response was refreshed, e.g. by another process
+        # sharing the store, but the variant was not
+        store = _stores[RAMCache.prefix][0]
+        key = hashKey(["http://example.com/page", ""])
+        variant = store.get(variantKey(key, "gzip"))
+        variant.created -= 70
+        store.get(key).created -= 10
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Accept-Encoding"] = "gzip"
+        request, value = self.render(request=request)
+        self.assertEqual(body, value)
+        self.assertNotIn("Content-Encoding", request.response)
+
+    def test_already_encoded(self):
+        self.setOption("compress", ("gzip",), "testrule")
+        body = gzip.compress(b"<html>" + b"page " * 100 + b"</html>")
+        self.render(body, **{"Content-Type": "text/html", "Content-Encoding": "gzip"})
+        self.assertEqual(0, len(_stores[RAMCache.prefix][0]))
+
+    def test_already_encoded_stream(self):
+        self.render(
+            DummyStreamIterator([gzip.compress(b"<html>")]),
+            **{"Content-Encoding": "gzip"},
+        )
+        self.assertEqual(None, self.render()[1])
+
+    def test_uncompressable_type(self):
+        self.setOption("compress", ("gzip",), "testrule")
+        self.render(b"\0" * 1000, **{"Content-Type": "image/png"})
+        self.assertEqual(1, len(_stores[RAMCache.prefix][0]))
+
+    def test_acceptsEncoding(self):
+        self.assertTrue(acceptsEncoding("gzip, deflate, br", "gzip"))
+        self.assertTrue(acceptsEncoding("GZIP;q=0.1", "gzip"))
+        self.assertTrue(acceptsEncoding("*", "gzip"))
+        self.assertFalse(acceptsEncoding("*, gzip;q=0", "gzip"))
+        self.assertFalse(acceptsEncoding("br", "gzip"))
+        self.assertFalse(acceptsEncoding("gzip;q=0.0", "gzip"))
+
+    def test_invalidate_tags(self):
+        provideAdapter(DummyTags, name="test")
+        for url, tags in (("http://a", ["uid1"]), ("http://b", ["uid1", "uid2"])):
+            view = DummyView()
+            view.tags = tags
+            self.render(request=DummyRequest(view, DummyResponse(), url))
+        self.render(request=DummyRequest(DummyView(), DummyResponse(), "http://c"))
+
+        store = _stores[RAMCache.prefix][0]
+        self.assertEqual(3, len(store))
+        self.assertEqual(1, invalidateTags(["uid2"]))
+        self.assertEqual(2, len(store))
+        self.assertEqual(1, invalidateTags(["uid1"]))
+        self.assertEqual(1, len(store))
+
+    def test_invalidate_on_purge(self):
+        provideAdapter(DummyTags, name="test")
+        view = DummyView()
+        view.tags = ["uid1"]
+        self.render(request=DummyRequest(view, DummyResponse()))
+        store = _stores[RAMCache.prefix][0]
+
+        transaction.begin()
+        invalidateOnPurge(Purge(view))
+        transaction.abort()
+        self.assertEqual(1, len(store))
+
+        transaction.begin()
+        invalidateOnPurge(Purge(view))
+        self.assertEqual(1, len(store))
+        transaction.commit()
+        self.assertEqual(0, len(store))
+
+    def test_expired(self):
+        self.setOption("maxAge", 0, "testrule")
+        self.render()
+        request, value = self.render()
+        self.assertEqual(None, value)
+
+    def age(self, seconds, url="http://example.com/page"):
+        key = hashKey([url, ""])
+        _stores[RAMCache.prefix][0].get(key).created -= seconds
+
+    def test_stale_while_revalidate(self):
+        self.setOption("staleWhileRevalidate", 30, "testrule")
+        self.render(b"old")
+        self.age(70)
+
+        # The first request refreshes the response
+        refreshing = DummyRequest(DummyView(), DummyResponse())
+        operation = RAMCache(refreshing["PUBLISHED"], refreshing)
+        self.assertEqual(
+            None, operation.interceptResponse("testrule", refreshing.response)
+        )
+
+        # Others get the stale response meanwhile
+        request, value = self.render()
+        self.assertEqual(b"old", value)
+        self.assertEqual("70", request.response["Age"])
+
+        setResponseBody(refreshing, b"new", "utf-8")
+        operation.modifyResponse("testrule", refreshing.response)
+
+        self.assertEqual(b"new", self.render()[1])
+        self.assertEqual(
+            {"hits": 1, "misses": 2, "stale": 1, "stored": 2},
+            statistics.snapshot()["caches"][RAMCache.prefix],
+        )
+
+    def wsgiRequest(self, **environ):
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.environ.update(
+            SERVER_NAME="example.com",
+            SERVER_PORT="80",
+            PATH_INFO="/page",
+            HTTP_COOKIE="__ac=secret",
+            HTTP_IF_NONE_MATCH='"etag"',
+            **environ,
+        )
+        return request
+
+    def test_stale_refreshed_in_background(self):
+        self.setOption("staleWhileRevalidate", 30, "testrule")
+        self.render(b"old")
+        self.age(70)
+
+        published = []
+        release = threading.Event()
+
+        def publish(environ, start_response):
+            release.wait(10)
+            published.append(environ)
+            request = DummyRequest(DummyView(), DummyResponse())
+            request.environ = environ
+            self.render(b"new", request)
+            start_response("200 OK", [])
+            return [b"new"]
+
+        original = responsecache.publish_module
+        responsecache.publish_module = publish
+        try:
+            # The first request after expiry is served the stale response too
+            request, value = self.render(request=self.wsgiRequest())
+            self.assertEqual(b"old", value)
+            self.assertEqual(1, len(_flights))
+            flight = list(_flights.values())[0]
+
+            # The request ending does not release the refresh
+            requestEnded(PubSuccess(request))
+            self.assertEqual(b"old", self.render(request=self.wsgiRequest())[1])
+
+            release.set()
+            self.assertTrue(flight.event.wait(10))
+        finally:
+            responsecache.publish_module = original
+
+        self.assertEqual({}, _flights)
+        self.assertEqual(b"new", self.render()[1])
+        self.assertEqual(1, len(published))
+        self.assertEqual("__ac=secret", published[0]["HTTP_COOKIE"])
+        self.assertEqual(True, published[0][REFRESH_ENVIRON_KEY])
+        self.assertEqual(
+            {"hits": 1, "misses": 1, "stale": 2, "refreshes": 1, "stored": 2},
+            statistics.snapshot()["caches"][RAMCache.prefix],
+        )
+
+    def test_stale_refresh_error(self):
+        self.setOption("staleWhileRevalidate", 30, "testrule")
+        self.render(b"old")
+        self.age(70)
+
+        release = threading.Event()
+
+        def publish(environ, start_response):
+            release.wait(10)
+            raise ValueError()
+
+        original = responsecache.publish_module
+        responsecache.publish_module = publish
+        try:
+            self.assertEqual(b"old", self.render(request=self.wsgiRequest())[1])
+            flight = list(_flights.values())[0]
+            release.set()
+            self.assertTrue(flight.event.wait(10))
+        finally:
+            responsecache.publish_module = original
+
+        # The claim was released, so the next request refreshes again
+        self.assertEqual({}, _flights)
+        self.assertEqual(None, self.render(b"new")[1])
+
+    def test_stale_refresh_threads_busy(self):
+        self.setOption("staleWhileRevalidate", 30, "testrule")
+        self.render(b"old")
+        self.age(70)
+
+        for i in range(REFRESH_THREADS):
+            responsecache._refreshSlots.acquire()
+        try:
+            # The request refreshes the response itself
+            request = self.wsgiRequest()
+            self.assertEqual(None, self.render(b"new", request)[1])
+        finally:
+            for i in range(REFRESH_THREADS):
+                responsecache._refreshSlots.release()
+        self.assertEqual(b"new", self.render()[1])
+
+    def test_refresh_environ(self):
+        self.assertEqual(None, refreshEnviron(DummyRequest(DummyView(), None)))
+
+        request = self.wsgiRequest(
+            REQUEST_METHOD="HEAD",
+            QUERY_STRING="a=1",
+            HTTP_RANGE="bytes=0-1",
+            HTTP_AUTHORIZATION="Basic secret",
+        )
+        request.environ["wsgi.input"] = BytesIO(b"body")
+        environ = refreshEnviron(request)
+
+        self.assertEqual("GET", environ["REQUEST_METHOD"])
+        self.assertEqual("/page", environ["PATH_INFO"])
+        self.assertEqual("a=1", environ["QUERY_STRING"])
+        self.assertEqual("Basic secret", environ["HTTP_AUTHORIZATION"])
+        self.assertEqual("HTTP/1.1", environ["SERVER_PROTOCOL"])
+        self.assertEqual(b"", environ["wsgi.input"].read())
+        self.assertNotIn("HTTP_RANGE", environ)
+        self.assertNotIn("HTTP_IF_NONE_MATCH", environ)
+
+    def test_stale_refresh_failed(self):
+        self.setOption("staleWhileRevalidate", 30, "testrule")
+        self.render(b"old")
+        self.age(70)
+
+        response = DummyResponse()
+        response.status = 500
+        self.render(request=DummyRequest(DummyView(), response))
+
+        # The claim was released, so the next request refreshes again
+        self.assertEqual(None, self.render(b"new")[1])
+        self.assertEqual(b"new", self.render()[1])
+
+    def test_stale_window_passed(self):
+        self.setOption("staleWhileRevalidate", 30, "testrule")
+        self.render(b"old")
+        self.age(100)
+
+        self.assertEqual(None, self.render(b"new")[1])
+        self.assertEqual(b"new", self.render()[1])
+
+    def test_single_flight(self):
+        self.setOption("singleFlight", True, "testrule")
+
+        leader = DummyRequest(DummyView(), DummyResponse())
+        operation = RAMCache(leader["PUBLISHED"], leader)
+        self.assertEqual(None, operation.interceptResponse("testrule", leader.response))
+
+        results = []
+        follower = threading.Thread(target=lambda: results.append(self.render()))
+        follower.start()
+        follower.join(0.1)
+        self.assertTrue(follower.is_alive())
+
+        setResponseBody(leader, b"rendered once", "utf-8")
+        operation.modifyResponse("testrule", leader.response)
+        follower.join()
+
+        self.assertEqual(b"rendered once", results[0][1])
+        self.assertEqual(
+            {"misses": 1, "collapsed": 1, "stored": 1},
+            statistics.snapshot()["caches"][RAMCache.prefix],
+        )
+
+    def test_single_flight_timeout(self):
+        self.setOption("singleFlight", True, "testrule")
+        self.setOption("singleFlightTimeout", 0, "testrule")
+
+        leader = DummyRequest(DummyView(), DummyResponse())
+        RAMCache(leader["PUBLISHED"], leader).interceptResponse(
+            "testrule", leader.response
+        )
+
+        self.assertEqual(None, self.render()[1])
+        self.assertEqual(
+            {"misses": 2, "flightTimeouts": 1, "stored": 1},
+            statistics.snapshot()["caches"][RAMCache.prefix],
+        )
+
+    def test_single_flight_stream_iterator(self):
+        self.setOption("singleFlight", True, "testrule")
+
+        leader = DummyRequest(DummyView(), DummyResponse())
+        operation = RAMCache(leader["PUBLISHED"], leader)
+        operation.interceptResponse("testrule", leader.response)
+        setResponseBody(leader, DummyStreamIterator([b"<html>", b"</html>"]), "")
+        operation.modifyResponse("testrule", leader.response)
+
+        # The body is stored as it is sent, after the request has ended, so
+        # the claim is held until then
+        requestEnded(PubSuccess(leader))
+        self.assertEqual(1, len(_flights))
+
+        results = []
+        follower = threading.Thread(target=lambda: results.append(self.render()))
+        follower.start()
+        follower.join(0.1)
+        self.assertTrue(follower.is_alive())
+
+        self.assertEqual([b"<html>", b"</html>"], list(leader.response.body))
+        follower.join()
+
+        self.assertEqual({}, _flights)
+        self.assertEqual(b"<html></html>", results[0][1])
+
+    def test_single_flight_stream_discarded(self):
+        self.setOption("singleFlight", True, "testrule")
+        self.setOption("maxStreamSize", 9)
+
+        leader = DummyRequest(DummyView(), DummyResponse())
+        operation = RAMCache(leader["PUBLISHED"], leader)
+        operation.interceptResponse("testrule", leader.response)
+        setResponseBody(leader, DummyStreamIterator([b"<html>", b"</html>"]), "")
+        operation.modifyResponse("testrule", leader.response)
+        self.assertEqual(1, len(_flights))
+
+        self.assertEqual(b"<html>", next(leader.response.body))
+        self.assertEqual(1, len(_flights))
+        # Too large to be stored, so the claim is released
+        self.assertEqual(b"</html>", next(leader.response.body))
+        self.assertEqual({}, _flights)
+
+    def test_single_flight_response_write(self):
+        self.setOption("singleFlight", True, "testrule")
+
+        leader = DummyRequest(DummyView(), DummyResponse())
+        alsoProvides(leader, IStreamedResponse)
+        leader.response.stdout = BytesIO()
+        operation = RAMCache(leader["PUBLISHED"], leader)
+        operation.interceptResponse("testrule", leader.response)
+        operation.modifyResponse("testrule", leader.response)
+        leader.response.stdout.write(b"<html>page</html>")
+        self.assertEqual(1, len(_flights))
+
+        finishStreamedResponse(leader, True)
+        self.assertEqual({}, _flights)
+        self.assertEqual(b"<html>page</html>", self.render()[1])
+
+    def test_single_flight_late_release(self):
+        self.setOption("singleFlight", True, "testrule")
+
+        first = DummyRequest(DummyView(), DummyResponse())
+        RAMCache(first["PUBLISHED"], first).interceptResponse(
+            "testrule", first.response
+        )
+        # The claim timed out and was taken over by another request
+        for flight in _flights.values():
+            flight.deadline = 0
+        second = DummyRequest(DummyView(), DummyResponse())
+        RAMCache(second["PUBLISHED"], second).interceptResponse(
+            "testrule", second.response
+        )
+
+        releaseFlight(first)
+        self.assertEqual(1, len(_flights))
+        releaseFlight(second)
+        self.assertEqual({}, _flights)
+
+    def test_single_flight_released_at_request_end(self):
+        self.setOption("singleFlight", True, "testrule")
+
+        leader = DummyRequest(DummyView(), DummyResponse())
+        RAMCache(leader["PUBLISHED"], leader).interceptResponse(
+            "testrule", leader.response
+        )
+        self.assertEqual(1, len(_flights))
+
+        requestEnded(PubSuccess(leader))
+        self.assertEqual({}, _flights)
+
+        # The next request renders without waiting
+        self.assertEqual(None, self.render()[1])
+        self.assertEqual(
+            {"misses": 2, "stored": 1},
+            statistics.snapshot()["caches"][RAMCache.prefix],
+        )
+
+    def test_not_get(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.environ["REQUEST_METHOD"] = "POST"
+        self.render(request=request)
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_not_200(self):
+        response = DummyResponse()
+        response.status = 404
+        self.render(request=DummyRequest(DummyView(), response))
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_cookies(self):
+        response = DummyResponse()
+        response.cookies = {"__ac": {"value": "x"}}
+        self.render(request=DummyRequest(DummyView(), response))
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_set_cookie_header(self):
+        self.render(**{"Set-Cookie": "__ac=x; Path=/"})
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_cache_control_private(self):
+        self.render(**{"Cache-Control": "max-age=60, Private"})
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_cache_control_private_field(self):
+        self.render(**{"Cache-Control": 'private="Set-Cookie", max-age=60'})
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_cache_control_no_store(self):
+        self.render(**{"Cache-Control": "public, no-store"})
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_cache_control_public(self):
+        self.render(**{"Cache-Control": "public, max-age=60"})
+
+        self.assertEqual(b"<html>page</html>", self.render()[1])
+
+    def test_vary_star(self):
+        self.render(Vary="*")
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_vary_not_in_key(self):
+        self.render(Vary="Accept-Encoding, Accept-Language")
+
+        self.assertEqual(None, self.render()[1])
+
+    def test_vary_in_key(self):
+        provideAdapter(LanguageCacheKey, name="language")
+        self.setOption("cacheKey", "language", "testrule")
+        self.render(Vary="accept-language, Accept-Encoding")
+
+        self.assertEqual(b"<html>page</html>", self.render()[1])
+
+    def test_authenticated(self):
+        newSecurityManager(None, SimpleUser("user", "", ("Member",), []))
+        self.render()
+        self.assertEqual(None, self.render()[1])
+
+        noSecurityManager()
+        self.assertEqual(None, self.render()[1])
+
+    def test_authenticated_allowed(self):
+        self.setOption("anonymousOnly", False)
+        newSecurityManager(None, SimpleUser("user", "", ("Member",), []))
+        self.render()
+        self.assertEqual(b"<html>page</html>", self.render()[1])
+
+    def test_range(self):
+        self.render(**{"Content-Type": "text/html", "ETag": '"abc"'})
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Range"] = "bytes=6-9"
+        request, value = self.render(request=request)
+        self.assertEqual(b"page", value)
+        self.assertEqual(206, request.response.status)
+        self.assertEqual("bytes 6-9/17", request.response["Content-Range"])
+        self.assertEqual("text/html", request.response["Content-Type"])
+        self.assertFalse(request.response.compression)
+        self.assertEqual(
+            {"hits": 1, "misses": 1, "partial": 1, "stored": 1},
+            statistics.snapshot()["caches"][RAMCache.prefix],
+        )
+
+    def test_multiple_ranges(self):
+        self.render(**{"Content-Type": "text/html"})
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Range"] = "bytes=0-5,-7"
+        request, value = self.render(request=request)
+        self.assertEqual(206, request.response.status)
+        contentType = request.response["Content-Type"]
+        self.assertTrue(contentType.startswith("multipart/byteranges; boundary="))
+        self.assertIn(b"Content-Range: bytes 0-5/17\r\n\r\n<html>\r\n", value)
+        self.assertIn(b"Content-Range: bytes 10-16/17\r\n\r\n</html>\r\n", value)
+
+    def test_range_not_satisfiable(self):
+        self.render()
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Range"] = "bytes=100-"
+        request, value = self.render(request=request)
+        self.assertEqual(b"", value)
+        self.assertEqual(416, request.response.status)
+        self.assertEqual("bytes */17", request.response["Content-Range"])
+
+    def test_if_range_mismatch(self):
+        self.render(**{"ETag": '"abc"'})
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Range"] = "bytes=6-9"
+        request.headers["If-Range"] = '"def"'
+        request, value = self.render(request=request)
+        self.assertEqual(b"<html>page</html>", value)
+        self.assertEqual(200, request.response.status)
+
+    def test_range_uncompressed(self):
+        self.setOption("compress", ("gzip",))
+        self.render(
+            b"<html>" + b"page" * 100 + b"</html>", **{"Content-Type": "text/html"}
+        )
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Range"] = "bytes=6-9"
+        request.headers["Accept-Encoding"] = "gzip"
+        request, value = self.render(request=request)
+        self.assertEqual(b"page", value)
+        self.assertNotIn("Content-Encoding", request.response)
+
+    def test_ranges_disabled(self):
+        self.setOption("ranges", False)
+        self.render()
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Range"] = "bytes=6-9"
+        request, value = self.render(request=request)
+        self.assertEqual(b"<html>page</html>", value)
+        self.assertNotIn("Accept-Ranges", request.response)
+
+    def test_stream_iterator(self):
+        chunks = [b"<html>", b"page", b"</html>"]
+        request, value = self.render(DummyStreamIterator(chunks))
+        body = request.response.body
+        self.assertTrue(IStreamIterator.providedBy(body))
+        self.assertEqual(17, len(body))
+
+        # Stored once the whole body is sent
+        self.assertEqual(b"<html>", next(body))
+        store = _stores[RAMCache.prefix][0]
+        self.assertEqual(None, store.get(hashKey(["http://example.com/page", ""])))
+        self.assertEqual(chunks[1:], list(body))
+
+        self.assertEqual(b"<html>page</html>", self.render()[1])
+        self.assertEqual(1, statistics.snapshot()["caches"][RAMCache.prefix]["stored"])
+
+    def test_stream_iterator_too_large(self):
+        self.setOption("maxStreamSize", 9)
+        request, value = self.render(DummyStreamIterator([b"<html>", b"page"]))
+        self.assertEqual([b"<html>", b"page"], list(request.response.body))
+        self.assertEqual(None, self.render()[1])
+
+    def test_stream_iterator_disabled(self):
+        self.setOption("maxStreamSize", 0)
+        self.render(DummyStreamIterator([b"<html>"]))
+        self.assertEqual(None, self.render()[1])
+
+    def test_response_write(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        alsoProvides(request, IStreamedResponse)
+        response = request.response
+        response.stdout = BytesIO()
+        operation = RAMCache(request["PUBLISHED"], request)
+        operation.interceptResponse("testrule", response)
+        operation.modifyResponse("testrule", response)
+
+        response.stdout.write(b"<html>")
+        response.stdout.write(b"page</html>")
+        self.assertEqual(None, self.render()[1])
+
+        finishStreamedResponse(request, True)
+        self.assertEqual(b"<html>page</html>", self.render()[1])
+
+    def test_store_options(self):
+        provideHandler(registryRecordChanged)
+        self.setOption("maxEntries", 1)
+        self.render(request=DummyRequest(DummyView(), DummyResponse(), "http://a"))
+        self.render(request=DummyRequest(DummyView(), DummyResponse(), "http://b"))
+
+        store = _stores[RAMCache.prefix][0]
+        self.assertEqual(1, len(store))
+
+        self.registry["plone.caching.operations.ramcache.maxEntries"] = 10
+        transaction.commit()
+        self.render(request=DummyRequest(DummyView(), DummyResponse(), "http://c"))
+        self.assertEqual(10, store.maxEntries)
+        self.assertEqual(2, len(store))
+
+
+class TestSharedMemoryCache(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.registry = Registry()
+        provideUtility(self.registry, IRegistry)
+        provideAdapter(CacheKey, name="url")
+        self.registry.records[f"{SharedMemoryCache.prefix}.path"] = Record(
+            field.TextLine(), os.path.join(self.tempdir, "segment")
+        )
+        self.registry.records[f"{SharedMemoryCache.prefix}.size"] = Record(
+            field.Int(), 1024 * 1024
+        )
+
+    def tearDown(self):
+        clearStores()
+        shutil.rmtree(self.tempdir)
+
+    def test_store_and_hit(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        operation = SharedMemoryCache(request["PUBLISHED"], request)
+        self.assertEqual(
+            None, operation.interceptResponse("testrule", request.response)
+        )
+
+        request.response["Content-Type"] = "text/html"
+        setResponseBody(request, b"<html>page</html>", "utf-8")
+        operation.modifyResponse("testrule", request.response)
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        operation = SharedMemoryCache(request["PUBLISHED"], request)
+        value = operation.interceptResponse("testrule", request.response)
+
+        self.assertEqual(b"<html>page</html>", value)
+        self.assertEqual("text/html", request.response["Content-Type"])
+
+        store = _stores[SharedMemoryCache.prefix][0]
+        self.assertEqual(os.path.join(self.tempdir, "segment"), store.path)
+        self.assertEqual(3, store.sets)
+        self.assertEqual(64 * 1024, store.slabSize)
+
+
+class TestDiskCache(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.registry = Registry()
+        provideUtility(self.registry, IRegistry)
+        provideAdapter(CacheKey, name="url")
+        self.registry.records[f"{DiskCache.prefix}.path"] = Record(
+            field.TextLine(), self.tempdir
+        )
+
+    def tearDown(self):
+        clearStores()
+        shutil.rmtree(self.tempdir)
+
+    def test_store_and_hit(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        operation = DiskCache(request["PUBLISHED"], request)
+        self.assertEqual(
+            None, operation.interceptResponse("testrule", request.response)
+        )
+
+        request.response["Content-Type"] = "application/pdf"
+        setResponseBody(request, b"%PDF" * 1000, "utf-8")
+        operation.modifyResponse("testrule", request.response)
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        operation = DiskCache(request["PUBLISHED"], request)
+        value = operation.interceptResponse("testrule", request.response)
+
+        self.assertTrue(IStreamIterator.providedBy(value))
+        with value:
+            self.assertEqual(b"%PDF" * 1000, b"".join(value))
+        self.assertEqual("application/pdf", request.response["Content-Type"])
+
+    def test_range(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        operation = DiskCache(request["PUBLISHED"], request)
+        operation.interceptResponse("testrule", request.response)
+        setResponseBody(request, bytes(range(256)) * 1000, "utf-8")
+        operation.modifyResponse("testrule", request.response)
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        request.headers["Range"] = "bytes=1000-1009"
+        operation = DiskCache(request["PUBLISHED"], request)
+        value = operation.interceptResponse("testrule", request.response)
+
+        self.assertEqual(206, request.response.status)
+        self.assertTrue(IStreamIterator.providedBy(value))
+        self.assertEqual(10, len(value))
+        self.assertEqual(bytes(range(232, 242)), b"".join(value))
+        value.close()
+
+    def test_stream_iterator(self):
+        request = DummyRequest(DummyView(), DummyResponse())
+        operation = DiskCache(request["PUBLISHED"], request)
+        operation.interceptResponse("testrule", request.response)
+
+        request.response.body = DummyStreamIterator([b"%PDF"] * 1000)
+        operation.modifyResponse("testrule", request.response)
+        self.assertEqual(4000, len(b"".join(request.response.body)))
+
+        request = DummyRequest(DummyView(), DummyResponse())
+        operation = DiskCache(request["PUBLISHED"], request)
+        value = operation.interceptResponse("testrule", request.response)
+        with value:
+            self.assertEqual(b"%PDF" * 1000, b"".join(value))
+
+
+@implementer_only(IUnboundStreamIterator)
+class DummyUnboundStreamIterator(DummyStreamIterator):
+    __len__ = None
+
+
+class TestStreamMutation(unittest.TestCase):
+    """Unbound stream iterator bodies through the transform chain and the
+    publisher event mutation hook.
+    """
+
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    # Not valid UTF-8, as the transform chain would decode a joined body
+    chunks = [b"\x89PNG\r\n", b"\xff\xfe\x00"]
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(DefaultRulesetLookup)
+        provideAdapter(CacheKey, name="url")
+        provideAdapter(RAMCache, name=RAMCache.prefix)
+        provideAdapter(MutatorTransform, name="plone.caching.mutator")
+        provideUtility(Transformer(), ITransformer)
+        self.registry = Registry()
+        provideUtility(self.registry, IRegistry)
+        self.registry.registerInterface(ICacheSettings)
+        settings = self.registry.forInterface(ICacheSettings)
+        settings.enabled = True
+        z3c.caching.registry.register(DummyView, "testrule")
+        settings.operationMapping = {"testrule": RAMCache.prefix}
+        self.registry.records[f"{RAMCache.prefix}.singleFlight"] = Record(
+            field.Bool(), True
+        )
+        statistics.reset()
+
+    def makeRequest(self):
+        response = WSGIResponse()
+        response.setHeader("Content-Type", "image/png")
+        request = DummyRequest(DummyView(), response)
+        response.setBody(DummyUnboundStreamIterator(self.chunks))
+        RAMCache(request["PUBLISHED"], request).interceptResponse("testrule", response)
+        return request
+
+    def test_transform_chain(self):
+        request = self.makeRequest()
+        body = request.response.body
+
+        applyTransformOnSuccess(PubBeforeCommit(request))
+
+        # Left alone rather than read into a string
+        self.assertIs(body, request.response.body)
+        self.assertEqual(self.chunks, list(request.response.body))
+        self.assertEqual({}, _flights)
+        self.assertEqual(0, len(_stores[RAMCache.prefix][0]))
+
+    def test_event_mutation(self):
+        request = self.makeRequest()
+
+        modifyResponseBeforeCommit(PubBeforeCommit(request))
+
+        body = request.response.body
+        self.assertTrue(IUnboundStreamIterator.providedBy(body))
+        self.assertEqual(self.chunks, list(body))
+        self.assertEqual({}, _flights)
+        self.assertEqual(1, len(_stores[RAMCache.prefix][0]))
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
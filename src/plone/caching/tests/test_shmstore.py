@@ -0,0 +1,217 @@
+from plone.caching import shmstore
+from plone.caching.interfaces import ICacheStore
+from plone.caching.shmstore import defaultPath
+from plone.caching.shmstore import HEADER_SIZE
+from plone.caching.shmstore import SharedMemoryStore
+from plone.caching.shmstore import WAYS
+from plone.caching.stats import statistics
+from plone.caching.stores import CachedResponse
+from zope.interface.verify import verifyObject
+
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import unittest.mock
+
+
+def makeResponse(body=b"x" * 100, headers=(("Content-Type", "text/html"),)):
+    return CachedResponse(200, headers, body, 1000.0)
+
+
+def _storeInChild(path):
+    store = SharedMemoryStore("test", path, size=HEADER_SIZE + 8 * 4096, slabSize=4096)
+    store.set("child", makeResponse(b"from child"))
+    store.close()
+
+
+class TestSharedMemoryStore(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "segment")
+        self.stores = []
+        statistics.reset()
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.tempdir)
+        statistics.reset()
+
+    def makeStore(self, sets=8, slabSize=4096, stripes=4):
+        store = SharedMemoryStore(
+            "test",
+            self.path,
+            size=HEADER_SIZE + sets * WAYS * slabSize,
+            slabSize=slabSize,
+            stripes=stripes,
+        )
+        self.stores.append(store)
+        return store
+
+    def test_interface(self):
+        self.assertTrue(verifyObject(ICacheStore, self.makeStore()))
+
+    def test_geometry(self):
+        store = self.makeStore()
+        self.assertEqual(8, store.sets)
+        self.assertEqual(4096, store.slabSize)
+        self.assertEqual(4, store.stripes)
+        self.assertEqual(store.segmentSize, os.path.getsize(self.path))
+
+    def test_get_set_delete(self):
+        store = self.makeStore()
+
+        self.assertEqual(None, store.get("a"))
+        self.assertTrue(store.set("a", makeResponse()))
+
+        response = store.get("a")
+        self.assertEqual(200, response.status)
+        self.assertEqual((("Content-Type", "text/html"),), response.headers)
+        self.assertEqual(b"x" * 100, response.body)
+        self.assertEqual(1000.0, response.created)
+
+        store.delete("a")
+        self.assertEqual(None, store.get("a"))
+
+    def test_replace(self):
+        store = self.makeStore()
+        store.set("a", makeResponse())
+        store.set("a", makeResponse(b"y", ()))
+
+        response = store.get("a")
+        self.assertEqual(b"y", response.body)
+        self.assertEqual((), response.headers)
+
+    def test_too_large(self):
+        store = self.makeStore()
+        self.assertFalse(store.set("a", makeResponse(b"x" * 4096)))
+        self.assertEqual(None, store.get("a"))
+
+    def test_evict_least_recently_used(self):
+        store = self.makeStore(sets=1)
+        for i in range(WAYS):
+            store.set(str(i), makeResponse())
+        store.get("0")
+        store.set("new", makeResponse())
+
+        self.assertIsNotNone(store.get("0"))
+        self.assertIsNotNone(store.get("new"))
+        self.assertEqual(None, store.get("1"))
+        self.assertEqual({"caches": {"test": {"evictions": 1}}}, statistics.snapshot())
+
+    def test_clear(self):
+        store = self.makeStore()
+        store.set("a", makeResponse())
+        store.clear()
+        self.assertEqual(None, store.get("a"))
+
+    def test_shared_between_stores(self):
+        store = self.makeStore()
+        store.set("a", makeResponse())
+
+        other = self.makeStore()
+        self.assertEqual(b"x" * 100, other.get("a").body)
+
+    def test_segment_shared_within_process(self):
+        store = self.makeStore()
+        other = self.makeStore()
+        self.assertEqual(store._fd, other._fd)
+        self.assertIs(store._locks, other._locks)
+
+        # Closing one store must not close the descriptor, which would
+        # release the record locks the other store holds
+        store.set("a", makeResponse())
+        store.close()
+        self.stores.remove(store)
+        os.fstat(other._fd)
+        self.assertEqual(b"x" * 100, other.get("a").body)
+
+        other.close()
+        self.stores.remove(other)
+        self.assertRaises(OSError, os.fstat, other._fd)
+
+    def test_close_twice(self):
+        store = self.makeStore()
+        other = self.makeStore()
+        store.close()
+        store.close()
+        self.stores.remove(store)
+
+        self.assertEqual(None, other.get("a"))
+
+    def test_headers(self):
+        store = self.makeStore()
+        headers = (("Content-Type", "text/html; charset=utf-8"), ("X-Empty", ""))
+        store.set("a", makeResponse(b"body", headers))
+
+        response = store.get("a")
+        self.assertEqual(headers, response.headers)
+
+    def test_existing_geometry_used(self):
+        self.makeStore(sets=8, stripes=4)
+        store = self.makeStore(sets=16, stripes=8)
+
+        self.assertEqual(8, store.sets)
+        self.assertEqual(4, store.stripes)
+
+    def test_created_private(self):
+        umask = os.umask(0)
+        try:
+            self.makeStore()
+        finally:
+            os.umask(umask)
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    def test_symlink_refused(self):
+        target = os.path.join(self.tempdir, "target")
+        with open(target, "wb") as f:
+            f.write(b"data")
+        os.chmod(target, 0o600)
+        os.symlink(target, self.path)
+
+        self.assertRaises(OSError, self.makeStore)
+        with open(target, "rb") as f:
+            self.assertEqual(b"data", f.read())
+
+    def test_other_mode_refused(self):
+        self.makeStore().close()
+        os.chmod(self.path, 0o644)
+        self.assertRaises(PermissionError, self.makeStore)
+
+    def test_default_path(self):
+        previous = tempfile.tempdir
+        tempfile.tempdir = self.tempdir
+        try:
+            with unittest.mock.patch.object(
+                shmstore.os.path, "isdir", return_value=False
+            ):
+                path = defaultPath("test")
+                self.assertEqual(path, defaultPath("test"))
+
+                directory = os.path.dirname(path)
+                self.assertEqual(self.tempdir, os.path.dirname(directory))
+                self.assertEqual(0o700, stat.S_IMODE(os.stat(directory).st_mode))
+
+                os.chmod(directory, 0o755)
+                self.assertRaises(PermissionError, defaultPath, "test")
+        finally:
+            tempfile.tempdir = previous
+
+    def test_shared_between_processes(self):
+        store = self.makeStore()
+
+        process = multiprocessing.get_context("fork").Process(
+            target=_storeInChild, args=(self.path,)
+        )
+        process.start()
+        process.join()
+
+        self.assertEqual(0, process.exitcode)
+        self.assertEqual(b"from child", store.get("child").body)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,122 @@
+from plone.caching.interfaces import ICachingStatistics
+from plone.caching.stats import CachingStatistics
+from zope.interface.verify import verifyObject
+
+import threading
+import unittest
+
+
+class TestCachingStatistics(unittest.TestCase):
+    def test_interface(self):
+        self.assertTrue(verifyObject(ICachingStatistics, CachingStatistics()))
+
+    def test_empty(self):
+        self.assertEqual({}, CachingStatistics().snapshot())
+
+    def test_increment(self):
+        stats = CachingStatistics()
+        stats.increment("rules", "testrule", "requests")
+        stats.increment("rules", "testrule", "requests")
+        stats.increment("operations", "op1", "modified", 3)
+
+        self.assertEqual(
+            {
+                "rules": {"testrule": {"requests": 2}},
+                "operations": {"op1": {"modified": 3}},
+            },
+            stats.snapshot(),
+        )
+
+    def test_snapshot_reset(self):
+        stats = CachingStatistics()
+        stats.increment("rules", "testrule", "requests")
+
+        self.assertEqual(
+            {"rules": {"testrule": {"requests": 1}}}, stats.snapshot(reset=True)
+        )
+        self.assertEqual({}, stats.snapshot())
+
+        stats.increment("rules", "testrule", "requests")
+        self.assertEqual({"rules": {"testrule": {"requests": 1}}}, stats.snapshot())
+
+        stats.reset()
+        self.assertEqual({}, stats.snapshot())
+
+    def test_observe(self):
+        stats = CachingStatistics()
+        stats.observe("intercept", "op1", 0.00001)
+        stats.observe("intercept", "op1", 0.00005)
+        stats.observe("intercept", "op1", 0.0003)
+        stats.observe("intercept", "op1", 10.0)
+
+        histogram = stats.histograms()["intercept"]["op1"]
+        self.assertEqual(4, histogram["count"])
+        self.assertAlmostEqual(10.00036, histogram["sum"])
+        self.assertEqual(len(stats.buckets) + 1, len(histogram["buckets"]))
+        self.assertEqual((2, 2, 2, 3, 3), histogram["buckets"][:5])
+        self.assertEqual((3, 4), histogram["buckets"][-2:])
+
+    def test_histograms_reset(self):
+        stats = CachingStatistics()
+        stats.observe("modify", "op1", 0.001)
+        stats.increment("rules", "testrule", "requests")
+
+        self.assertEqual(1, stats.histograms(reset=True)["modify"]["op1"]["count"])
+        self.assertEqual({}, stats.histograms())
+        self.assertEqual({"rules": {"testrule": {"requests": 1}}}, stats.snapshot())
+
+        stats.observe("modify", "op1", 0.002)
+        histogram = stats.histograms()["modify"]["op1"]
+        self.assertEqual(1, histogram["count"])
+        self.assertAlmostEqual(0.002, histogram["sum"])
+
+        stats.reset()
+        self.assertEqual({}, stats.histograms())
+        self.assertEqual({}, stats.snapshot())
+
+    def test_threads(self):
+        stats = CachingStatistics()
+        barrier = threading.Barrier(4)
+
+        def work():
+            barrier.wait()
+            for i in range(1000):
+                stats.increment("rules", "testrule", "requests")
+                stats.observe("modify", "op1", 0.001)
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual({"rules": {"testrule": {"requests": 4000}}}, stats.snapshot())
+        self.assertEqual(4000, stats.histograms()["modify"]["op1"]["count"])
+
+        # The shards of the finished threads have been folded together
+        self.assertEqual([], stats._shards)
+
+    def test_finished_threads_reset(self):
+        stats = CachingStatistics()
+
+        def work():
+            stats.increment("rules", "testrule", "requests")
+            stats.observe("modify", "op1", 0.001)
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        stats.reset()
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        stats.increment("rules", "testrule", "requests")
+
+        self.assertEqual(1, len(stats._shards))
+        self.assertEqual({"rules": {"testrule": {"requests": 2}}}, stats.snapshot())
+        self.assertEqual(1, stats.histograms()["modify"]["op1"]["count"])
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
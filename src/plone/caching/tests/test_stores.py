@@ -0,0 +1,141 @@
+from plone.caching.interfaces import ICachedResponse
+from plone.caching.interfaces import ITaggedCacheStore
+from plone.caching.stats import statistics
+from plone.caching.stores import CachedResponse
+from plone.caching.stores import RAMStore
+from zope.interface.verify import verifyObject
+
+import unittest
+
+
+def makeResponse(body=b"x" * 100, headers=(), tags=()):
+    return CachedResponse(200, headers, body, tags=tags)
+
+
+class TestCachedResponse(unittest.TestCase):
+    def test_interface(self):
+        self.assertTrue(verifyObject(ICachedResponse, makeResponse()))
+
+    def test_size(self):
+        response = makeResponse(b"abc", [("ETag", '"1"')])
+        self.assertEqual(3 + 4 + 3, response.size)
+        self.assertEqual((("ETag", '"1"'),), response.headers)
+
+        response = makeResponse(b"abc", tags=["uid1", "uid2"])
+        self.assertEqual(3 + 4 + 4, response.size)
+        self.assertEqual(("uid1", "uid2"), response.tags)
+
+
+class TestRAMStore(unittest.TestCase):
+    def setUp(self):
+        statistics.reset()
+
+    def tearDown(self):
+        statistics.reset()
+
+    def test_interface(self):
+        self.assertTrue(verifyObject(ITaggedCacheStore, RAMStore("test")))
+
+    def test_get_set_delete(self):
+        store = RAMStore("test")
+        response = makeResponse()
+
+        self.assertEqual(None, store.get("a"))
+        self.assertTrue(store.set("a", response))
+        self.assertIs(response, store.get("a"))
+        self.assertEqual(100, store.size)
+
+        store.delete("a")
+        store.delete("a")
+        self.assertEqual(None, store.get("a"))
+        self.assertEqual(0, store.size)
+
+    def test_replace(self):
+        store = RAMStore("test")
+        store.set("a", makeResponse())
+        store.set("a", makeResponse(b"y" * 50))
+
+        self.assertEqual(1, len(store))
+        self.assertEqual(50, store.size)
+
+    def test_max_entries(self):
+        store = RAMStore("test", maxEntries=2)
+        store.set("a", makeResponse())
+        store.set("b", makeResponse())
+        store.get("a")
+        store.set("c", makeResponse())
+
+        self.assertEqual(2, len(store))
+        self.assertEqual(None, store.get("b"))
+        self.assertIsNotNone(store.get("a"))
+        self.assertIsNotNone(store.get("c"))
+        self.assertEqual({"caches": {"test": {"evictions": 1}}}, statistics.snapshot())
+
+    def test_max_size(self):
+        store = RAMStore("test", maxSize=250)
+        store.set("a", makeResponse())
+        store.set("b", makeResponse())
+        store.set("c", makeResponse())
+
+        self.assertEqual(2, len(store))
+        self.assertEqual(200, store.size)
+        self.assertEqual(None, store.get("a"))
+
+    def test_too_large(self):
+        store = RAMStore("test", maxSize=50)
+        self.assertFalse(store.set("a", makeResponse()))
+        self.assertEqual(0, len(store))
+
+    def test_resize(self):
+        store = RAMStore("test")
+        for key in "abcd":
+            store.set(key, makeResponse())
+
+        store.resize(2, 1000)
+
+        self.assertEqual(2, len(store))
+        self.assertEqual(None, store.get("a"))
+        self.assertIsNotNone(store.get("d"))
+
+    def test_clear(self):
+        store = RAMStore("test")
+        store.set("a", makeResponse())
+        store.clear()
+        self.assertEqual(0, len(store))
+        self.assertEqual(0, store.size)
+
+    def test_invalidate_tags(self):
+        store = RAMStore("test")
+        store.set("a", makeResponse(tags=("t1", "t2")))
+        store.set("b", makeResponse(tags=("t2",)))
+        store.set("c", makeResponse())
+        # Bodies, tags and the references to the keys in the index
+        self.assertEqual(300 + 6 + 3, store.size)
+
+        self.assertEqual(2, store.invalidateTags(["t2", "unknown"]))
+        self.assertEqual(None, store.get("a"))
+        self.assertEqual(None, store.get("b"))
+        self.assertIsNotNone(store.get("c"))
+        self.assertEqual({}, store._tags)
+        self.assertEqual(100, store.size)
+        self.assertEqual(0, store.invalidateTags(["t1"]))
+        self.assertEqual(
+            {"caches": {"test": {"invalidations": 2}}}, statistics.snapshot()
+        )
+
+    def test_tags_follow_replace_and_eviction(self):
+        store = RAMStore("test", maxEntries=1)
+        store.set("a", makeResponse(tags=("t1",)))
+        store.set("a", makeResponse(tags=("t2",)))
+        self.assertEqual({"t2": {"a"}}, store._tags)
+
+        store.set("b", makeResponse(tags=("t3",)))
+        self.assertEqual({"t3": {"b"}}, store._tags)
+
+        store.delete("b")
+        self.assertEqual({}, store._tags)
+        self.assertEqual(0, store.size)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,301 @@
+from io import BytesIO
+from plone.caching.interfaces import ICacheWriter
+from plone.caching.stats import statistics
+from plone.caching.stores import BufferedCacheWriter
+from plone.caching.stores import openWriter
+from plone.caching.stores import RAMStore
+from plone.caching.streaming import BoundFileStreamIterator
+from plone.caching.streaming import BoundTeeIterator
+from plone.caching.streaming import BufferStreamIterator
+from plone.caching.streaming import FileStreamIterator
+from plone.caching.streaming import finishStreamedResponse
+from plone.caching.streaming import publishableBody
+from plone.caching.streaming import Tee
+from plone.caching.streaming import teeIterator
+from plone.caching.streaming import teeStreamedResponse
+from zope.interface import implementer
+from zope.interface.verify import verifyClass
+from ZPublisher.Iterators import IStreamIterator
+from ZPublisher.Iterators import IUnboundStreamIterator
+
+import os
+import unittest
+
+
+@implementer(IStreamIterator)
+class DummyStreamIterator:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+        self._iterator = iter(chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+@implementer(ICacheWriter)
+class DummyWriter:
+    def __init__(self):
+        self.chunks = []
+        self.state = "open"
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def commit(self):
+        self.state = "committed"
+        return True
+
+    def abort(self):
+        self.state = "aborted"
+
+
+class DummyResponse:
+    def __init__(self):
+        self.stdout = BytesIO()
+        self.body = b""
+        self.status = 200
+
+    def write(self, data):
+        self.stdout.write(data)
+
+    def getStatus(self):
+        return self.status
+
+
+class DummyRequest(dict):
+    def __init__(self):
+        self.response = DummyResponse()
+
+
+class TestTee(unittest.TestCase):
+    def setUp(self):
+        statistics.reset()
+
+    def test_iterator(self):
+        writer = DummyWriter()
+        stream = DummyStreamIterator([b"abc", b"def"])
+        iterator = teeIterator(stream, Tee("test", writer, 100))
+
+        self.assertTrue(isinstance(iterator, BoundTeeIterator))
+        self.assertTrue(IStreamIterator.providedBy(iterator))
+        self.assertEqual(6, len(iterator))
+
+        self.assertEqual(b"abc", next(iterator))
+        self.assertEqual("open", writer.state)
+        self.assertEqual([b"def"], list(iterator))
+        self.assertEqual([b"abc", b"def"], writer.chunks)
+        self.assertEqual("committed", writer.state)
+        self.assertEqual({"caches": {"test": {"stored": 1}}}, statistics.snapshot())
+
+        iterator.close()
+        self.assertEqual("committed", writer.state)
+        self.assertTrue(stream.closed)
+
+    def test_unbound_iterator(self):
+        iterator = teeIterator(iter([b"abc"]), Tee("test", DummyWriter(), 100))
+        self.assertTrue(IUnboundStreamIterator.providedBy(iterator))
+        self.assertFalse(IStreamIterator.providedBy(iterator))
+        self.assertEqual([b"abc"], list(iterator))
+
+    def test_closed_before_end(self):
+        writer = DummyWriter()
+        iterator = teeIterator(
+            DummyStreamIterator([b"abc", b"def"]), Tee("test", writer, 100)
+        )
+        next(iterator)
+        iterator.close()
+        self.assertEqual("aborted", writer.state)
+        self.assertEqual({}, statistics.snapshot())
+
+    def test_iterator_error(self):
+        def chunks():
+            yield b"abc"
+            raise OSError()
+
+        writer = DummyWriter()
+        iterator = teeIterator(chunks(), Tee("test", writer, 100))
+        self.assertRaises(OSError, list, iterator)
+        self.assertEqual("aborted", writer.state)
+
+    def test_too_large(self):
+        writer = DummyWriter()
+        chunks = [b"x" * 10] * 5
+        iterator = teeIterator(DummyStreamIterator(chunks), Tee("test", writer, 25))
+
+        # The client is still sent the whole body
+        self.assertEqual(chunks, list(iterator))
+        self.assertEqual([b"x" * 10] * 2, writer.chunks)
+        self.assertEqual("aborted", writer.state)
+
+    def test_writer_error(self):
+        class BrokenWriter(DummyWriter):
+            def write(self, data):
+                raise OSError()
+
+        writer = BrokenWriter()
+        iterator = teeIterator(DummyStreamIterator([b"abc"]), Tee("test", writer, 100))
+        self.assertEqual([b"abc"], list(iterator))
+        self.assertEqual("aborted", writer.state)
+
+    def test_streamed_response(self):
+        writer = DummyWriter()
+        request = DummyRequest()
+        response = request.response
+        teeStreamedResponse(request, response, Tee("test", writer, 100))
+
+        response.write(b"abc")
+        response.write(b"def")
+        self.assertEqual(b"abcdef", response.stdout.getvalue())
+
+        response.body = b"ghi"
+        finishStreamedResponse(request, True)
+        self.assertEqual([b"abc", b"def", b"ghi"], writer.chunks)
+        self.assertEqual("committed", writer.state)
+
+        # Only once
+        finishStreamedResponse(request, True)
+        self.assertEqual(1, statistics.snapshot()["caches"]["test"]["stored"])
+
+    def test_streamed_response_failed(self):
+        writer = DummyWriter()
+        request = DummyRequest()
+        teeStreamedResponse(request, request.response, Tee("test", writer, 100))
+        request.response.write(b"abc")
+        finishStreamedResponse(request, False)
+        self.assertEqual("aborted", writer.state)
+
+    def test_streamed_response_error_status(self):
+        writer = DummyWriter()
+        request = DummyRequest()
+        teeStreamedResponse(request, request.response, Tee("test", writer, 100))
+        request.response.write(b"abc")
+        request.response.status = 500
+        finishStreamedResponse(request, True)
+        self.assertEqual("aborted", writer.state)
+
+    def test_not_streamed(self):
+        request = DummyRequest()
+        finishStreamedResponse(request, True)
+        self.assertEqual({}, statistics.snapshot())
+
+
+class DummyFile:
+    """File-like object which is not an ``io`` file"""
+
+    def __init__(self, data):
+        self.file = BytesIO(data)
+        self.read = self.file.read
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class DummySeekableFile(DummyFile):
+    def __init__(self, data):
+        super().__init__(data)
+        self.seek = self.file.seek
+        self.tell = self.file.tell
+
+
+class TestPublishableBody(unittest.TestCase):
+    def test_unchanged(self):
+        for body in (None, "", "abc", b"abc", BytesIO(b"abc")):
+            self.assertTrue(publishableBody(body) is body)
+        stream = DummyStreamIterator([b"abc"])
+        self.assertTrue(publishableBody(stream) is stream)
+        self.assertEqual(1, publishableBody(1))
+
+    def test_whole_memoryview(self):
+        data = b"abcdef"
+        self.assertTrue(publishableBody(memoryview(data)) is data)
+
+    def test_small_buffer(self):
+        data = b"abcdef"
+        self.assertEqual(b"bcde", publishableBody(memoryview(data)[1:5]))
+        self.assertEqual(b"abc", publishableBody(bytearray(b"abc")))
+        self.assertEqual(data[::2], publishableBody(memoryview(data)[::2]))
+
+    def test_buffer(self):
+        data = bytes(range(100))
+        body = publishableBody(memoryview(data)[10:], streamsize=40)
+        self.assertTrue(isinstance(body, BufferStreamIterator))
+        self.assertTrue(IStreamIterator.providedBy(body))
+        self.assertEqual(90, len(body))
+        self.assertEqual(data[10:50], next(body))
+        self.assertEqual(50, len(body))
+        self.assertEqual([data[50:90], data[90:]], list(body))
+        self.assertEqual(0, len(body))
+        body.close()
+
+        body = publishableBody(bytearray(data), streamsize=40)
+        self.assertEqual(data, b"".join(body))
+
+    def test_file(self):
+        file = DummySeekableFile(b"abcdef")
+        file.seek(1)
+        body = publishableBody(file, streamsize=4)
+        self.assertTrue(isinstance(body, BoundFileStreamIterator))
+        self.assertEqual(5, len(body))
+        self.assertEqual([b"bcde", b"f"], list(body))
+        body.close()
+        self.assertTrue(file.closed)
+
+    def test_unseekable_file(self):
+        body = publishableBody(DummyFile(b"abcdef"), streamsize=4)
+        self.assertTrue(isinstance(body, FileStreamIterator))
+        self.assertTrue(IUnboundStreamIterator.providedBy(body))
+        self.assertFalse(IStreamIterator.providedBy(body))
+        self.assertEqual([b"abcd", b"ef"], list(body))
+
+    def test_unseekable_io_file(self):
+        read, write = os.pipe()
+        with open(write, "wb") as file:
+            file.write(b"abcdef")
+        file = open(read, "rb")
+        body = publishableBody(file, streamsize=4)
+        self.assertTrue(isinstance(body, FileStreamIterator))
+        self.assertFalse(IStreamIterator.providedBy(body))
+        self.assertEqual([b"abcd", b"ef"], list(body))
+        body.close()
+        self.assertTrue(file.closed)
+
+
+class TestBufferedCacheWriter(unittest.TestCase):
+    def test_interface(self):
+        self.assertTrue(verifyClass(ICacheWriter, BufferedCacheWriter))
+
+    def test_commit(self):
+        store = RAMStore("test")
+        writer = openWriter(store, "a", 200, [("Content-Type", "text/plain")], ("t",))
+        self.assertTrue(isinstance(writer, BufferedCacheWriter))
+        writer.write(b"abc")
+        writer.write(b"def")
+        self.assertEqual(None, store.get("a"))
+
+        self.assertTrue(writer.commit())
+        response = store.get("a")
+        self.assertEqual(b"abcdef", response.body)
+        self.assertEqual((("Content-Type", "text/plain"),), response.headers)
+        self.assertEqual(("t",), response.tags)
+
+    def test_abort(self):
+        store = RAMStore("test")
+        writer = openWriter(store, "a", 200, [])
+        writer.write(b"abc")
+        writer.abort()
+        self.assertEqual(None, store.get("a"))
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
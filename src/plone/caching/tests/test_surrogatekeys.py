@@ -0,0 +1,114 @@
+from plone.caching.interfaces import ICacheTags
+from plone.caching.interfaces import ICachingOperation
+from plone.caching.surrogatekeys import getCacheTags
+from plone.caching.surrogatekeys import getTags
+from plone.caching.surrogatekeys import SurrogateKeys
+from plone.caching.testing import IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+from plone.registry import field
+from plone.registry import Record
+from plone.registry import Registry
+from plone.registry.interfaces import IRegistry
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.interface import implementer
+from zope.interface.verify import verifyClass
+
+import unittest
+
+
+class DummyView:
+    pass
+
+
+class DummyResponse(dict):
+    def setHeader(self, name, value):
+        self[name] = value
+
+
+class DummyRequest(dict):
+    def __init__(self, published, response):
+        self["PUBLISHED"] = published
+        self.response = response
+
+
+calls = []
+
+
+@implementer(ICacheTags)
+@adapter(DummyView)
+class ListingTags:
+    def __init__(self, published):
+        self.published = published
+
+    def __call__(self):
+        calls.append(self)
+        return ["uid1", "uid2", ""]
+
+
+@implementer(ICacheTags)
+@adapter(DummyView)
+class SiteTags:
+    def __init__(self, published):
+        self.published = published
+
+    def __call__(self):
+        return ["uid2", "site"]
+
+
+class TestSurrogateKeys(unittest.TestCase):
+    layer = IMPLICIT_RULESET_REGISTRY_UNIT_TESTING
+
+    def setUp(self):
+        self.registry = Registry()
+        provideUtility(self.registry, IRegistry)
+        provideAdapter(ListingTags, name="listing")
+        provideAdapter(SiteTags, name="site")
+        del calls[:]
+
+    def test_interface(self):
+        self.assertTrue(verifyClass(ICachingOperation, SurrogateKeys))
+
+    def test_getTags(self):
+        self.assertEqual(["site", "uid1", "uid2"], sorted(getTags(DummyView())))
+        self.assertEqual((), getTags(object()))
+
+    def test_getCacheTags_memoised(self):
+        published = DummyView()
+        request = DummyRequest(published, DummyResponse())
+        tags = getCacheTags(published, request)
+        self.assertIs(tags, getCacheTags(published, request))
+        self.assertEqual(1, len(calls))
+
+    def test_headers(self):
+        published = DummyView()
+        request = DummyRequest(published, DummyResponse())
+        operation = SurrogateKeys(published, request)
+
+        self.assertEqual(
+            None, operation.interceptResponse("testrule", request.response)
+        )
+        operation.modifyResponse("testrule", request.response)
+
+        tags = set(request.response["Surrogate-Key"].split(" "))
+        self.assertEqual({"uid1", "uid2", "site"}, tags)
+        self.assertEqual(request.response["Surrogate-Key"], request.response["xkey"])
+
+    def test_headers_option(self):
+        self.registry.records[f"{SurrogateKeys.prefix}.headers"] = Record(
+            field.Tuple(value_type=field.ASCIILine()), ("xkey",)
+        )
+        published = DummyView()
+        request = DummyRequest(published, DummyResponse())
+        SurrogateKeys(published, request).modifyResponse("testrule", request.response)
+        self.assertEqual(["xkey"], list(request.response))
+
+    def test_no_tags(self):
+        published = object()
+        request = DummyRequest(published, DummyResponse())
+        SurrogateKeys(published, request).modifyResponse("testrule", request.response)
+        self.assertEqual({}, dict(request.response))
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
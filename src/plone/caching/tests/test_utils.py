@@ -1,15 +1,27 @@
+from plone.caching import utils
+from plone.caching.interfaces import ICacheSettings
 from plone.caching.interfaces import ICachingOperationType
+from plone.caching.interfaces import IRequestFilterSettings
+from plone.caching.utils import getCacheSettings
+from plone.caching.utils import getResponseBody
 from plone.caching.utils import lookupOption
 from plone.caching.utils import lookupOptions
+from plone.caching.utils import prefetchOptions
+from plone.caching.utils import registryRecordChanged
+from plone.caching.utils import setResponseBody
 from plone.registry import field
 from plone.registry import FieldRef
 from plone.registry import Record
 from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
 from plone.registry.interfaces import IRegistry
 from zope.component import getUtility
+from zope.component import provideAdapter
+from zope.component import provideHandler
 from zope.component import provideUtility
 from zope.interface import provider
 
+import transaction
 import unittest
 import zope.component.testing
 
@@ -162,5 +174,263 @@ class TestLookupOptions(unittest.TestCase):
         self.assertEqual({"test1": _marker, "test2": "foo"}, result)
 
 
+class TestCacheSettings(unittest.TestCase):
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        provideHandler(registryRecordChanged)
+
+    def tearDown(self):
+        transaction.abort()
+        zope.component.testing.tearDown()
+
+    def test_no_registry(self):
+        self.assertIsNone(getCacheSettings())
+
+    def test_no_records(self):
+        provideUtility(Registry(), IRegistry)
+        settings = getCacheSettings()
+        self.assertIsNone(settings.enabled)
+        self.assertIsNone(settings.operationMapping)
+
+    def test_baseline_records(self):
+        # Records of sites set up before the optional settings were added
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        registry.forInterface(ICacheSettings).enabled = True
+
+        settings = getCacheSettings()
+        self.assertTrue(settings.enabled)
+        self.assertIsNone(settings.cacheableMethods)
+        self.assertIsNone(settings.serverTiming)
+        self.assertTrue(settings.accepts(object()))
+
+    def test_request_filter_records(self):
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        registry.registerInterface(IRequestFilterSettings)
+        registry.forInterface(IRequestFilterSettings).cacheableMethods = ("GET",)
+        self.assertEqual(("GET",), getCacheSettings().cacheableMethods)
+
+    def test_snapshot(self):
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        proxy = registry.forInterface(ICacheSettings)
+        proxy.enabled = True
+        proxy.operationMapping = {"testrule": "op1"}
+
+        settings = getCacheSettings()
+        self.assertTrue(settings.enabled)
+        self.assertEqual({"testrule": "op1"}, dict(settings.operationMapping))
+        self.assertIs(settings, getCacheSettings())
+
+        with self.assertRaises(TypeError):
+            settings.operationMapping["testrule"] = "op2"
+        with self.assertRaises(AttributeError):
+            settings.enabled = False
+
+    def test_rebuilt_on_record_modified(self):
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        proxy = registry.forInterface(ICacheSettings)
+        proxy.enabled = True
+
+        settings = getCacheSettings()
+        self.assertTrue(settings.enabled)
+
+        # Only once the change is committed
+        proxy.enabled = False
+        self.assertTrue(getCacheSettings().enabled)
+        transaction.commit()
+        self.assertFalse(getCacheSettings().enabled)
+
+    def test_dropped_on_abort(self):
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+        proxy = registry.forInterface(ICacheSettings)
+        proxy.enabled = True
+        transaction.commit()
+
+        # Settings read after the change, e.g. once the snapshot expired,
+        # are not kept once it is aborted
+        proxy.enabled = False
+        utils.invalidateCacheSettings()
+        settings = getCacheSettings()
+        self.assertFalse(settings.enabled)
+        transaction.abort()
+        self.assertIsNot(settings, getCacheSettings())
+
+    def test_not_rebuilt_on_unrelated_record(self):
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+
+        settings = getCacheSettings()
+        registry.records["plone.caching.tests.test"] = Record(field.TextLine(), "a")
+        self.assertIs(settings, getCacheSettings())
+
+    def test_rebuilt_when_expired(self):
+        provideUtility(Registry(), IRegistry)
+        registry = getUtility(IRegistry)
+        registry.registerInterface(ICacheSettings)
+
+        settings = getCacheSettings()
+
+        # Simulate a change committed by another ZEO client, which does not
+        # fire an event in this process.
+        registry.records._values["plone.caching.interfaces.ICacheSettings.enabled"] = (
+            True
+        )
+        self.assertIs(settings, getCacheSettings())
+
+        maxAge = utils.SETTINGS_MAX_AGE
+        utils.SETTINGS_MAX_AGE = -1
+        try:
+            utils.invalidateCacheSettings()
+            getCacheSettings()
+            registry.records._values[
+                "plone.caching.interfaces.ICacheSettings.enabled"
+            ] = False
+            self.assertFalse(getCacheSettings().enabled)
+        finally:
+            utils.SETTINGS_MAX_AGE = maxAge
+
+
+class TestOptionsCache(unittest.TestCase):
+    def setUp(self):
+        provideHandler(registryRecordChanged)
+        provideUtility(Registry(), IRegistry)
+        self.registry = getUtility(IRegistry)
+
+        @provider(ICachingOperationType)
+        class DummyOperation:
+            title = ""
+            description = ""
+            prefix = "plone.caching.tests"
+            options = (
+                "test1",
+                "test2",
+            )
+
+        self.DummyOperation = DummyOperation
+
+    def tearDown(self):
+        transaction.abort()
+        zope.component.testing.tearDown()
+
+    def test_prefetchOptions(self):
+        self.registry.records["plone.caching.tests.test1"] = Record(
+            field.TextLine(), "foo"
+        )
+        self.registry.records["plone.caching.tests.testrule.test1"] = Record(
+            field.TextLine(), "bar"
+        )
+        self.registry.records["plone.caching.testsuite.test1"] = Record(
+            field.TextLine(), "baz"
+        )
+        self.registry.records["plone.caching.other"] = Record(field.TextLine(), "qux")
+
+        self.assertEqual(
+            {"test1": "foo", "testrule.test1": "bar"},
+            dict(prefetchOptions("plone.caching.tests")),
+        )
+
+    def test_lookupOptions_cached(self):
+        self.registry.records["plone.caching.tests.test1"] = Record(
+            field.TextLine(), "foo"
+        )
+        lookupOptions(self.DummyOperation, "testrule")
+
+        # Bypass the registry API, so no event is fired
+        self.registry.records._values["plone.caching.tests.test1"] = "bar"
+
+        result = lookupOptions(self.DummyOperation, "testrule", default=_marker)
+        self.assertEqual({"test1": "foo", "test2": _marker}, result)
+        self.assertEqual(
+            "foo", lookupOption("plone.caching.tests", "testrule", "test1")
+        )
+
+    def test_lookupOptions_returns_copy(self):
+        result = lookupOptions(self.DummyOperation, "testrule")
+        result["test1"] = "changed"
+
+        result = lookupOptions(self.DummyOperation, "testrule")
+        self.assertEqual({"test1": None, "test2": None}, result)
+
+    def test_lookupOptions_invalidated_on_change(self):
+        self.registry.records["plone.caching.tests.test1"] = Record(
+            field.TextLine(), "foo"
+        )
+        result = lookupOptions(self.DummyOperation, "testrule")
+        self.assertEqual({"test1": "foo", "test2": None}, result)
+
+        # Only once the change is committed
+        self.registry["plone.caching.tests.test1"] = "bar"
+        result = lookupOptions(self.DummyOperation, "testrule")
+        self.assertEqual({"test1": "foo", "test2": None}, result)
+        transaction.commit()
+        result = lookupOptions(self.DummyOperation, "testrule")
+        self.assertEqual({"test1": "bar", "test2": None}, result)
+
+        self.registry.records["plone.caching.tests.testrule.test2"] = Record(
+            field.TextLine(), "baz"
+        )
+        transaction.commit()
+        result = lookupOptions(self.DummyOperation, "testrule")
+        self.assertEqual({"test1": "bar", "test2": "baz"}, result)
+
+        del self.registry.records["plone.caching.tests.test1"]
+        transaction.commit()
+        result = lookupOptions(self.DummyOperation, "testrule")
+        self.assertEqual({"test1": None, "test2": "baz"}, result)
+
+    def test_lookupOptions_other_prefix_not_invalidated(self):
+        self.registry.records["plone.caching.tests.test1"] = Record(
+            field.TextLine(), "foo"
+        )
+        transaction.commit()
+        lookupOptions(self.DummyOperation, "testrule")
+        self.registry.records._values["plone.caching.tests.test1"] = "bar"
+
+        self.registry.records["plone.caching.testsuite.test1"] = Record(
+            field.TextLine(), "baz"
+        )
+        transaction.commit()
+        result = lookupOptions(self.DummyOperation, "testrule")
+        self.assertEqual({"test1": "foo", "test2": None}, result)
+
+
+class TestResponseBody(unittest.TestCase):
+    class DummyRequest(dict):
+        pass
+
+    class DummyResponse:
+        body = b"original"
+
+    def test_response_body(self):
+        request = self.DummyRequest()
+        self.assertEqual(b"original", getResponseBody(request, self.DummyResponse()))
+
+    def test_recorded_body(self):
+        request = self.DummyRequest()
+        response = self.DummyResponse()
+
+        setResponseBody(request, b"bytes", "utf-8")
+        self.assertEqual(b"bytes", getResponseBody(request, response))
+
+        setResponseBody(request, "t\xe9xt", "latin-1")
+        self.assertEqual(b"t\xe9xt", getResponseBody(request, response))
+
+        setResponseBody(request, [b"a", "b"], "utf-8")
+        self.assertEqual(b"ab", getResponseBody(request, response))
+
+        setResponseBody(request, iter([b"a"]), "utf-8")
+        self.assertEqual(None, getResponseBody(request, response))
+
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,94 @@
+from time import perf_counter
+
+import logging
+
+logger = logging.getLogger("plone.caching")
+
+SERVER_TIMING_HEADER = "Server-Timing"
+
+# Name of the request attribute holding the PhaseTimer for the request
+_TIMER_KEY = "_plone_caching_timer"
+
+
+class PhaseTimer:
+    """Collects the durations of the caching phases of a request, and
+    reports them in a ``Server-Timing`` header and/or a log record.
+
+    Phases are recorded with a name, which is used as the ``Server-Timing``
+    metric name, and an optional description, e.g. the operation name.
+    """
+
+    __slots__ = ("header", "log", "phases", "finished")
+
+    def __init__(self, header=True, log=False):
+        self.header = header
+        self.log = log
+        self.phases = []
+        self.finished = False
+
+    def record(self, name, start, description=None):
+        """Record a phase which started at ``start``, as returned by
+        ``time.perf_counter()``, and ended now.
+        """
+        self.phases.append((name, perf_counter() - start, description))
+
+    def headerValue(self):
+        metrics = []
+        for name, duration, description in self.phases:
+            metric = f"{name};dur={duration * 1000:.3f}"
+            if description:
+                metric += f';desc="{description}"'
+            metrics.append(metric)
+        return ", ".join(metrics)
+
+    def finish(self, request, response):
+        """Emit the recorded timings for the request. This only has an
+        effect the first time it is called.
+        """
+
+        if self.finished or not self.phases:
+            return
+        self.finished = True
+
+        if self.header:
+            response.addHeader(SERVER_TIMING_HEADER, self.headerValue())
+
+        if self.log:
+            logger.info(
+                "Caching phases for %s: %s",
+                request.get("PATH_INFO", None) or repr(request.get("PUBLISHED")),
+                "; ".join(
+                    (
+                        f"{name} ({description}) {duration * 1000:.3f}ms"
+                        if description
+                        else f"{name} {duration * 1000:.3f}ms"
+                    )
+                    for name, duration, description in self.phases
+                ),
+            )
+
+
+def startTimer(request, settings):
+    """Return a new ``PhaseTimer`` stored on the request if timing is enabled
+    in the given ``ICacheSettings`` snapshot, otherwise None.
+    """
+
+    if not (settings.serverTiming or settings.logTiming):
+        return None
+
+    timer = PhaseTimer(header=bool(settings.serverTiming), log=bool(settings.logTiming))
+    try:
+        setattr(request, _TIMER_KEY, timer)
+    except AttributeError:
+        pass
+    return timer
+
+
+def queryTimer(request):
+    """Return the ``PhaseTimer`` for the request, or None if timing is not
+    enabled.
+    """
+
+    # Look in the instance dictionary directly, since a missing attribute on
+    # a Zope request falls back to a full request variable lookup.
+    return request.__dict__.get(_TIMER_KEY)
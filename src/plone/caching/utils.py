@@ -1,13 +1,271 @@
 from plone.caching.interfaces import ICacheSettings
 from plone.caching.interfaces import ICachingOperation
 from plone.caching.interfaces import ICachingOperationType
+from plone.caching.interfaces import IRequestFilterSettings
 from plone.caching.interfaces import IRulesetLookup
+from plone.caching.interfaces import ITimingSettings
+from plone.caching.stats import statistics
+from plone.caching.timing import startTimer
+from plone.registry.interfaces import IRecordEvent
 from plone.registry.interfaces import IRegistry
+from time import perf_counter
+from types import MappingProxyType
+from zope.component import adapter
+from zope.component import getSiteManager
 from zope.component import getUtility
 from zope.component import queryMultiAdapter
 from zope.component import queryUtility
-
+from zope.interface.interfaces import IRegistrationEvent
+from zope.interface.interfaces import IUtilityRegistration
+from zope.schema import getFieldNames
+from ZPublisher.Iterators import IStreamIterator
+from ZPublisher.Iterators import IUnboundStreamIterator
+
+import threading
+import time
+import transaction
 import types
+import weakref
+
+# Name of the request attribute holding the memoised result of
+# findOperation(). It stores a tuple ``(published, result)``, or
+# ``(_disabled, result)`` if caching was disabled for the request.
+_OPERATION_MEMO_KEY = "_plone_caching_operation"
+
+# Name of the request attribute holding the response body as it was passed
+# to the mutator by the transform chain. It stores a tuple
+# ``(result, encoding)``.
+_BODY_KEY = "_plone_caching_body"
+
+# Maximum age, in seconds, of cached settings and options. Changes made in
+# this process are picked up through registry events once they are committed,
+# but changes committed by other ZEO clients do not fire events here, so cached
+# values are re-read from the registry at least this often.
+SETTINGS_MAX_AGE = 60
+
+# Interfaces of the registry records read into settings snapshots
+_SETTINGS_INTERFACES = (ICacheSettings, IRequestFilterSettings, ITimingSettings)
+_SETTINGS_PREFIXES = tuple(
+    interface.__identifier__ + "." for interface in _SETTINGS_INTERFACES
+)
+
+_settingsLock = threading.Lock()
+_settingsGeneration = 0
+_settingsSnapshots = weakref.WeakKeyDictionary()
+_siteSnapshots = weakref.WeakKeyDictionary()
+_lastSiteSnapshot = (None, None)
+_optionsCaches = weakref.WeakKeyDictionary()
+
+# Key of the names of the registry records changed in a transaction, in the
+# transaction's data
+_changedKey = object()
+
+_marker = object()
+_disabled = object()
+_noOperation = (None, None, None)
+
+
+class CacheSettingsSnapshot:
+    """Immutable, process-wide copy of the ``ICacheSettings``,
+    ``IRequestFilterSettings`` and ``ITimingSettings`` records.
+
+    Attributes are named after the fields of these interfaces, and are None
+    for missing records. Mappings are frozen, so the snapshot can be shared
+    between threads.
+    """
+
+    def __init__(self, values, generation, expires):
+        d = self.__dict__
+        d.update(values)
+        d["generation"] = generation
+        d["expires"] = expires
+
+        methods = values.get("cacheableMethods")
+        d["_methods"] = (
+            frozenset(method.upper() for method in methods) if methods else None
+        )
+        d["_pathPrefixes"] = tuple(values.get("ignoredPathPrefixes") or ())
+        d["_pathSegments"] = tuple(values.get("ignoredPathSegments") or ())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Settings snapshots are read-only")
+
+    def accepts(self, request):
+        """Return False if the request is excluded from caching operations
+        by the ``cacheableMethods``, ``ignoredPathPrefixes`` or
+        ``ignoredPathSegments`` settings.
+        """
+
+        if self._methods is None and not self._pathPrefixes and not self._pathSegments:
+            return True
+
+        environ = getattr(request, "environ", None) or {}
+
+        if (
+            self._methods is not None
+            and environ.get("REQUEST_METHOD", "GET") not in self._methods
+        ):
+            return False
+
+        path = environ.get("PATH_INFO", "")
+        if self._pathPrefixes and path.startswith(self._pathPrefixes):
+            return False
+        for segment in self._pathSegments:
+            if segment in path:
+                return False
+
+        return True
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType(dict(value))
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def getCacheSettings(registry=None):
+    """Return a ``CacheSettingsSnapshot`` of the ``ICacheSettings``,
+    ``IRequestFilterSettings`` and ``ITimingSettings`` records in the given
+    registry (or the current ``IRegistry`` utility), or None if there is no
+    registry.
+
+    The snapshot is rebuilt only when a transaction adding, modifying or
+    removing one of these records in this process ends, or when it is
+    older than ``SETTINGS_MAX_AGE`` seconds. Until then, the transaction
+    making the change still sees the previous settings.
+
+    When called without a registry, the snapshot is also cached per site
+    manager, so that the common case does not involve a utility lookup.
+    """
+
+    if registry is not None:
+        return _getSnapshot(registry)
+
+    sm = getSiteManager()
+
+    # Fast path: the same site as last time, with a current snapshot. This
+    # avoids the weak reference created by every WeakKeyDictionary lookup.
+    lastSite, snapshot = _lastSiteSnapshot
+    if lastSite is sm:
+        if (
+            snapshot.generation == _settingsGeneration
+            and snapshot.expires > time.monotonic()
+        ):
+            return snapshot
+    else:
+        snapshot = _siteSnapshots.get(sm)
+        if (
+            snapshot is not None
+            and snapshot.generation == _settingsGeneration
+            and snapshot.expires > time.monotonic()
+        ):
+            _setLastSiteSnapshot(sm, snapshot)
+            return snapshot
+
+    registry = sm.queryUtility(IRegistry)
+    if registry is None:
+        return None
+
+    snapshot = _getSnapshot(registry)
+    _siteSnapshots[sm] = snapshot
+    _setLastSiteSnapshot(sm, snapshot)
+    return snapshot
+
+
+def _setLastSiteSnapshot(sm, snapshot):
+    global _lastSiteSnapshot
+    _lastSiteSnapshot = (sm, snapshot)
+
+
+def _clearSiteSnapshots():
+    _setLastSiteSnapshot(None, None)
+    _siteSnapshots.clear()
+
+
+def _getSnapshot(registry):
+    snapshot = _settingsSnapshots.get(registry)
+    if (
+        snapshot is not None
+        and snapshot.generation == _settingsGeneration
+        and snapshot.expires > time.monotonic()
+    ):
+        return snapshot
+
+    generation = _settingsGeneration
+    values = {}
+    for interface, prefix in zip(_SETTINGS_INTERFACES, _SETTINGS_PREFIXES):
+        for name in getFieldNames(interface):
+            values[name] = _freeze(registry.get(prefix + name, None))
+
+    snapshot = CacheSettingsSnapshot(
+        values, generation, time.monotonic() + SETTINGS_MAX_AGE
+    )
+    _settingsSnapshots[registry] = snapshot
+    return snapshot
+
+
+def invalidateCacheSettings():
+    """Force all settings snapshots to be rebuilt on next access."""
+
+    global _settingsGeneration
+    with _settingsLock:
+        _settingsGeneration += 1
+        _clearSiteSnapshots()
+
+
+@adapter(IRecordEvent)
+def registryRecordChanged(event):
+    """Invalidate cached settings and options once the transaction in which
+    a relevant registry record is added, modified or removed is committed or
+    aborted.
+
+    Invalidating them before the commit would let other threads cache the
+    previous values again, read through connections which do not see the
+    change yet.
+    """
+
+    name = getattr(event.record, "__name__", None)
+    if name:
+        _queueInvalidation(name)
+
+
+def _queueInvalidation(name):
+    txn = transaction.get()
+    try:
+        queued = txn.data(_changedKey)
+    except KeyError:
+        queued = {}
+        txn.set_data(_changedKey, queued)
+        txn.addAfterCommitHook(_invalidateAfterCommit, (queued,))
+        txn.addAfterAbortHook(_invalidate, (queued,))
+    queued[name] = None
+
+
+def _invalidateAfterCommit(success, names):
+    # Settings read in a transaction whose commit failed may hold changes
+    # which are now discarded, so they are dropped either way
+    _invalidate(names)
+
+
+def _invalidate(names):
+    if any(name.startswith(_SETTINGS_PREFIXES) for name in names):
+        invalidateCacheSettings()
+
+    for cache in list(_optionsCaches.values()):
+        for name in names:
+            cache.invalidate(name)
+
+
+@adapter(IUtilityRegistration, IRegistrationEvent)
+def registryRegistrationChanged(registration, event):
+    """Invalidate cached settings when an ``IRegistry`` utility is registered
+    or unregistered with a component registry.
+    """
+
+    if registration.provided is IRegistry:
+        invalidateCacheSettings()
 
 
 def lookupOptions(type_, rulename, default=None):
@@ -21,19 +279,40 @@ def lookupOptions(type_, rulename, default=None):
     ``rulename`` is the name of the rule being executed.
 
     ``default`` is the default value to use for options that cannot be found.
+
+    The resolved options are cached per ``(prefix, rulename)`` until a
+    change to a registry record under the operation's prefix is committed,
+    or for at most ``SETTINGS_MAX_AGE`` seconds. A new dictionary
+    is returned on each call, so callers may modify it.
     """
 
     if not ICachingOperationType.providedBy(type_):
         type_ = getUtility(ICachingOperationType, name=type_)
 
-    options = {}
     registry = queryUtility(IRegistry)
+    names = tuple(getattr(type_, "options", ()))
 
-    for option in getattr(type_, "options", ()):
-        options[option] = lookupOption(
-            type_.prefix, rulename, option, default, registry
-        )
-
+    if registry is None:
+        return dict.fromkeys(names, default)
+
+    cache = _getOptionsCache(registry)
+    key = (type_.prefix, rulename, names)
+
+    entry = cache.resolved.get(key)
+    if entry is None or entry[0] <= time.monotonic():
+        generation = cache.generation
+        records = cache.prefetch(registry, type_.prefix)
+        resolved = {
+            option: _resolveOption(records, type_.prefix, rulename, option)
+            for option in names
+        }
+        entry = (time.monotonic() + SETTINGS_MAX_AGE, resolved)
+        cache.store(cache.resolved, key, entry, generation)
+
+    options = entry[1].copy()
+    for option, value in options.items():
+        if value is _marker:
+            options[option] = default
     return options
 
 
@@ -52,7 +331,7 @@ def lookupOption(prefix, rulename, option, default=None, _registry=None):
     """
 
     # Avoid looking this up multiple times if we are being called
-    # from lookupOptions
+    # from elsewhere in this module
     registry = _registry
 
     if registry is None:
@@ -61,45 +340,184 @@ def lookupOption(prefix, rulename, option, default=None, _registry=None):
     if registry is None:
         return default
 
-    key = ".".join(
-        (
-            prefix,
-            rulename,
-            option,
-        )
-    )
-    if key in registry:
-        return registry[key]
+    records = _getOptionsCache(registry).prefetch(registry, prefix)
+    value = _resolveOption(records, prefix, rulename, option)
+    if value is _marker:
+        return default
+    return value
 
-    key = ".".join(
-        (
+
+def prefetchOptions(prefix, _registry=None):
+    """Return a mapping of all registry records under ``prefix``, keyed by
+    record name relative to the prefix (e.g. ``option`` or
+    ``rulename.option``).
+
+    The records are read in a single pass over the registry and cached until
+    a change to a record under the prefix is committed, or for at most
+    ``SETTINGS_MAX_AGE`` seconds.
+    """
+
+    registry = _registry
+
+    if registry is None:
+        registry = queryUtility(IRegistry)
+
+    if registry is None:
+        return MappingProxyType({})
+
+    return _getOptionsCache(registry).prefetch(registry, prefix)
+
+
+def _resolveOption(records, prefix, rulename, option):
+    if rulename is not None:
+        value = records.get(f"{rulename}.{option}", _marker)
+        if value is not _marker:
+            return value
+    return records.get(option, _marker)
+
+
+class _OptionsCache:
+    """Per-registry cache of records read by option prefix, and of options
+    resolved per ``(prefix, rulename, options)``.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self.records = {}
+        self.resolved = {}
+
+    def prefetch(self, registry, prefix):
+        entry = self.records.get(prefix)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        generation = self.generation
+        start = prefix + "."
+        values = {}
+        try:
+            keys = registry.records.keys(start, prefix + "/")
+        except (AttributeError, TypeError):
+            # Not a plone.registry Registry; fall back to probing every key
+            keys = [key for key in registry.records.keys() if key.startswith(start)]
+        for key in keys:
+            if key.startswith(start):
+                values[key[len(start) :]] = registry[key]
+
+        records = MappingProxyType(values)
+        self.store(
+            self.records,
             prefix,
-            option,
+            (time.monotonic() + SETTINGS_MAX_AGE, records),
+            generation,
         )
-    )
-    if key in registry:
-        return registry[key]
+        return records
+
+    def store(self, mapping, key, entry, generation):
+        # Don't cache values read before a concurrent invalidation
+        with _settingsLock:
+            if self.generation == generation:
+                mapping[key] = entry
+
+    def invalidate(self, name):
+        with _settingsLock:
+            self.generation += 1
+            for prefix in list(self.records):
+                if name.startswith(prefix + "."):
+                    del self.records[prefix]
+            for key in list(self.resolved):
+                if name.startswith(key[0] + "."):
+                    del self.resolved[key]
+
+
+def _getOptionsCache(registry):
+    cache = _optionsCaches.get(registry)
+    if cache is None:
+        cache = _optionsCaches.setdefault(registry, _OptionsCache())
+    return cache
+
+
+class ExpiringCache(dict):
+    """Dictionary of cached lookups which is emptied by ``expire()`` once
+    ``maxAge`` seconds have passed since it was last emptied.
+
+    This is for caches invalidated by events, such as component registration
+    events, which other ZEO clients do not fire in this process.
+    """
+
+    __slots__ = ("maxAge", "expires")
+
+    def __init__(self, maxAge=SETTINGS_MAX_AGE):
+        self.maxAge = maxAge
+        self.expires = time.monotonic() + maxAge
 
-    return default
+    def expire(self):
+        """Empty the cache if it is older than ``maxAge`` seconds."""
+        now = time.monotonic()
+        if now >= self.expires:
+            self.clear()
+            self.expires = now + self.maxAge
 
 
 def findOperation(request):
+    """Find the caching rule and operation for the published object of the
+    given request, returning a tuple ``(rule, operationName, operation)``.
+
+    If caching is globally disabled, or the request is excluded by the
+    request filter settings, this returns early without further lookups.
+
+    The result is memoised on the request, so that the intercept and mutate
+    hooks only resolve the rule once per request. The memo is keyed on the
+    ``PUBLISHED`` object and is discarded if that changes between phases,
+    except if caching was disabled, in which case it stays disabled for the
+    rest of the request without the settings being looked up again.
+    """
+
+    # Look in the instance dictionary directly, since a missing attribute on
+    # a Zope request falls back to a full request variable lookup.
+    memo = request.__dict__.get(_OPERATION_MEMO_KEY)
+    if memo is not None and memo[0] is _disabled:
+        return _noOperation
+
+    settings = getCacheSettings()
+    if settings is None or not settings.enabled:
+        try:
+            setattr(request, _OPERATION_MEMO_KEY, (_disabled, _noOperation))
+        except AttributeError:
+            pass
+        return _noOperation
+
     published = request.get("PUBLISHED", None)
     if published is None:
-        return None, None, None
+        return _noOperation
 
+    if memo is not None and memo[0] is published:
+        return memo[1]
+
+    if not settings.accepts(request):
+        result = None, None, None
+    else:
+        timer = startTimer(request, settings)
+        result = _findOperation(request, published, settings, timer)
+
+        rule, operationName, operation = result
+        if rule is not None:
+            statistics.increment("rules", rule, "requests")
+            if operation is None:
+                statistics.increment("rules", rule, "noOperation")
+
+    try:
+        setattr(request, _OPERATION_MEMO_KEY, (published, result))
+    except AttributeError:
+        pass
+
+    return result
+
+
+def _findOperation(request, published, settings, timer=None):
     # If we get a method, try to look up its class
     if isinstance(published, types.MethodType):
         published = getattr(published, "__self__", published)
 
-    registry = queryUtility(IRegistry)
-    if registry is None:
-        return None, None, None
-
-    settings = registry.forInterface(ICacheSettings, check=False)
-    if not settings.enabled:
-        return None, None, None
-
     if settings.operationMapping is None:
         return None, None, None
 
@@ -114,7 +532,11 @@ def findOperation(request):
         return None, None, None
 
     # From this point, we want to at least log
+    if timer is not None:
+        start = perf_counter()
     rule = lookup()
+    if timer is not None:
+        timer.record("caching-ruleset", start, rule)
 
     if rule is None:
         return None, None, None
@@ -123,7 +545,91 @@ def findOperation(request):
     if operationName is None:
         return rule, None, None
 
+    if timer is not None:
+        start = perf_counter()
     operation = queryMultiAdapter(
         (published, request), ICachingOperation, name=operationName
     )
+    if timer is not None:
+        timer.record("caching-operation", start, operationName)
     return rule, operationName, operation
+
+
+def setResponseBody(request, result, encoding):
+    """Record the response body passed to the mutator by the transform chain,
+    so that caching operations can read it with ``getResponseBody()``.
+    """
+    try:
+        setattr(request, _BODY_KEY, (result, encoding))
+    except AttributeError:
+        pass
+
+
+def getResponseBody(request, response):
+    """Return the body of the response being modified as a byte string, or
+    None if it is not available, e.g. because it is a stream iterator.
+
+    Earlier transforms in the transform chain may have replaced the body
+    without setting it on the response yet, so the body seen by the mutator
+    is preferred over ``response.body``.
+    """
+
+    recorded = request.__dict__.get(_BODY_KEY)
+    if recorded is None:
+        body = getattr(response, "body", None)
+        return body if isinstance(body, bytes) else None
+
+    result, encoding = recorded
+    if isinstance(result, bytes):
+        return result
+    if isinstance(result, str):
+        return result.encode(encoding)
+    if isinstance(result, (list, tuple)):
+        try:
+            return b"".join(
+                chunk.encode(encoding) if isinstance(chunk, str) else chunk
+                for chunk in result
+            )
+        except TypeError:
+            return None
+    return None
+
+
+def getResponseStream(request, response):
+    """Return the body of the response being modified if it is a stream
+    iterator sent as it is, or None.
+
+    The transform chain only keeps stream iterators of known length
+    (``IStreamIterator``) as they are, and reads any other iterable into a
+    string, so unbound stream iterators are only returned outside it.
+    """
+
+    recorded = request.__dict__.get(_BODY_KEY)
+    if recorded is not None:
+        body = recorded[0]
+        return body if IStreamIterator.providedBy(body) else None
+    body = getattr(response, "body", None)
+    return body if IUnboundStreamIterator.providedBy(body) else None
+
+
+def replaceResponseStream(request, response, body):
+    """Replace the stream iterator body of the response being modified.
+
+    The headers set for the previous body, such as ``Content-Length``, are
+    kept. If the mutator was called by the transform chain, it returns the
+    new body to the chain, so that it is not replaced by the previous one.
+    """
+
+    response.body = body
+    recorded = request.__dict__.get(_BODY_KEY)
+    if recorded is not None:
+        setResponseBody(request, body, recorded[1])
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(_clearSiteSnapshots)
+    del addCleanUp